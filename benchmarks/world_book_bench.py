@@ -0,0 +1,242 @@
+"""世界书激活基准测试
+
+生成合成的SillyTavern世界书(默认1k/10k/50k条目，中文关键词)和合成聊天记录，
+测量WorldBookProcessor的冷/热加载、get_world_book_prompt、保存和条目启用/禁用耗时，
+并报告吞吐量和峰值内存。同时把处理器的匹配结果与逐条目的子串匹配做等价性校验。
+
+插件依赖LangBot的pkg包，请在LangBot主程序目录下运行：
+    python plugins/QQSillyTavern/benchmarks/world_book_bench.py
+    python plugins/QQSillyTavern/benchmarks/world_book_bench.py --sizes 1000 --histories 20
+    python plugins/QQSillyTavern/benchmarks/world_book_bench.py --check-only
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import importlib
+import statistics
+import tracemalloc
+from typing import Any, Callable, Dict, List, Tuple
+
+PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 常用汉字，用于生成内容和聊天文本
+COMMON_CHARS = (
+    "的一是在不了有和人这中大为上个国我以要他时来用们生到作地于出就分对成会可主发年动"
+    "同工也能下过子说产种面而方后多定行学法所民得经十三之进着等部度家电力里如水化高自二"
+    "理起小物现实加量都两体制机当使点从业本去把性好应开它合还因由其些然前外天政四日那社"
+    "义事平形相全表间样与关各重新线内数正心反你明看原又么利比或但质气第向道命此变条只没"
+    "结解问意建月公无系军很情者最立代想已通并提直题党程展五果料象员革位入常文总次品式活"
+    "设及管特件长求老头基资边流路级少图山统接知较将组见计别她手角期根论运农指几九区强放"
+)
+# 专有名词用字和后缀，组合成类似世界书里的人名地名关键词
+NAME_CHARS = "艾琳娜卡洛斯莉亚塔兰德索菲雅克罗伊尔维斯凯瑟琳阿瑞安诺拉希尔薇奥蕾赫敏冰焰岚雪霜月星辰"
+NAME_SUFFIXES = ["", "", "", "城", "山", "族", "学院", "王国", "之森", "公会", "神殿", "骑士团"]
+
+def load_processor_class():
+    """以包的方式导入插件中的WorldBookProcessor"""
+    sys.path.insert(0, os.path.dirname(PLUGIN_DIR))
+    try:
+        module = importlib.import_module(f"{os.path.basename(PLUGIN_DIR)}.system.world_book_processor")
+    except ModuleNotFoundError as e:
+        print(f"导入世界书处理器失败: {e}")
+        print("请在LangBot主程序目录下运行本脚本，以便能导入pkg包")
+        sys.exit(1)
+    return module.WorldBookProcessor, module.Message
+
+def make_keyword(rng: random.Random) -> str:
+    """生成一个2-4字的专有名词，可能带地名/组织后缀"""
+    name = "".join(rng.choice(NAME_CHARS) for _ in range(rng.randint(2, 4)))
+    return name + rng.choice(NAME_SUFFIXES)
+
+def make_text(rng: random.Random, length: int) -> str:
+    """生成指定长度的随机中文文本，夹杂标点"""
+    chars = []
+    for i in range(length):
+        chars.append(rng.choice(COMMON_CHARS))
+        if i % rng.randint(8, 20) == 0 and i:
+            chars.append(rng.choice("，。！？"))
+    return "".join(chars)
+
+def generate_lorebooks(rng: random.Random, size: int, per_file: int) -> Tuple[List[Dict[str, Any]], List[str]]:
+    """生成若干个世界书文件内容，返回(文件数据列表, 关键词池)"""
+    vocabulary = list({make_keyword(rng) for _ in range(max(size // 2, 10))})
+    books = []
+    for start in range(0, size, per_file):
+        entries = {}
+        for uid in range(start, min(start + per_file, size)):
+            # 约三成条目带次要关键词和随机的selectiveLogic
+            has_secondary = rng.random() < 0.3
+            entries[str(uid)] = {
+                "uid": uid,
+                "key": rng.sample(vocabulary, rng.randint(1, 3)),
+                "keysecondary": rng.sample(vocabulary, rng.randint(1, 2)) if has_secondary else [],
+                "selective": True,
+                "selectiveLogic": rng.randint(0, 3) if has_secondary else 0,
+                "comment": f"条目{uid}",
+                "content": make_text(rng, rng.randint(80, 200)),
+                "constant": rng.random() < 0.05,
+                "disable": rng.random() < 0.02,
+                "order": 100,
+                "position": 4,
+                "probability": 100,
+                "depth": 4,
+                "displayIndex": uid
+            }
+        books.append({"entries": entries})
+    return books, vocabulary
+
+def generate_histories(rng: random.Random, vocabulary: List[str], count: int, turns: int) -> List[List[str]]:
+    """生成聊天记录，每条消息有一定概率提到世界书关键词"""
+    histories = []
+    for _ in range(count):
+        history = []
+        for _ in range(turns):
+            text = make_text(rng, rng.randint(30, 120))
+            if rng.random() < 0.3:
+                pos = rng.randint(0, len(text))
+                text = text[:pos] + rng.choice(vocabulary) + text[pos:]
+            history.append(text)
+        histories.append(history)
+    return histories
+
+def write_lorebooks(plugin_dir: str, books: List[Dict[str, Any]]):
+    """把世界书写到临时插件目录的shijieshu下"""
+    book_dir = os.path.join(plugin_dir, "shijieshu")
+    os.makedirs(book_dir, exist_ok=True)
+    for i, book in enumerate(books):
+        with open(os.path.join(book_dir, f"bench_{i:03d}.json"), "w", encoding="utf-8") as f:
+            json.dump(book, f, ensure_ascii=False)
+
+def reference_match(processor, text: str) -> List[int]:
+    """参考实现：逐条目调用matches_keywords(含次要关键词逻辑)，返回激活条目的UID"""
+    return [
+        entry.uid for entry in processor.entries
+        if not entry.constant and not entry.vectorized and entry.matches_keywords(text)
+    ]
+
+def timed(func: Callable[[], Any], repeat: int) -> Tuple[float, Any]:
+    """执行多次取中位数耗时(秒)，返回(耗时, 最后一次的结果)"""
+    durations = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        durations.append(time.perf_counter() - start)
+    return statistics.median(durations), result
+
+def run_size(processor_cls, message_cls, size: int, args) -> Dict[str, Any]:
+    """对一个规模的世界书运行全部测量"""
+    rng = random.Random(args.seed + size)
+    books, vocabulary = generate_lorebooks(rng, size, args.per_file)
+    histories = generate_histories(rng, vocabulary, args.histories, args.turns)
+    result: Dict[str, Any] = {"size": size, "files": len(books)}
+
+    with tempfile.TemporaryDirectory() as plugin_dir:
+        write_lorebooks(plugin_dir, books)
+
+        # 加载，顺便记录峰值内存
+        tracemalloc.start()
+        processor = processor_cls(plugin_dir)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        result["peak_mb"] = peak / 1024 / 1024
+
+        # 冷启动删除磁盘缓存后加载，热启动直接使用缓存
+        cache_dir = os.path.join(plugin_dir, "shijieshu", ".cache")
+        def cold_load():
+            shutil.rmtree(cache_dir, ignore_errors=True)
+            return processor_cls(plugin_dir)
+        result["cold_load_s"], _ = timed(cold_load, args.repeat)
+        result["load_s"], processor = timed(lambda: processor_cls(plugin_dir), args.repeat)
+
+        # 等价性校验
+        mismatches = 0
+        activated = 0
+        for history in histories:
+            text = " ".join(history)
+            expected = reference_match(processor, text)
+            actual = [entry.uid for entry in processor.match_keyword_entries(text)]
+            activated += len(actual)
+            if sorted(expected) != sorted(actual):
+                mismatches += 1
+                if mismatches <= 3:
+                    print(f"  匹配结果不一致: 期望 {len(expected)} 条, 实际 {len(actual)} 条, "
+                          f"缺少 {sorted(set(expected) - set(actual))[:5]}, 多出 {sorted(set(actual) - set(expected))[:5]}")
+        result["mismatches"] = mismatches
+        result["avg_activated"] = activated / max(len(histories), 1)
+        if args.check_only:
+            return result
+
+        # 提示词构建
+        message_histories = [[message_cls(role="user", content=text) for text in history] for history in histories]
+        def build_prompts():
+            for messages in message_histories:
+                processor.get_world_book_prompt(messages)
+        prompt_s, _ = timed(build_prompts, args.repeat)
+        result["prompt_ms"] = prompt_s / len(histories) * 1000
+        result["prompt_per_s"] = len(histories) / prompt_s if prompt_s else float("inf")
+
+        # 条目启用/禁用，每次只回写条目所在文件
+        toggle_entries = rng.sample(processor.entries, min(args.toggles, len(processor.entries)))
+        def toggle():
+            for entry in toggle_entries:
+                processor.set_entry_enabled(entry, not entry.enabled)
+        toggle_s, _ = timed(toggle, 1)
+        result["toggle_ms"] = toggle_s / len(toggle_entries) * 1000
+
+        # 全量保存：把所有文件标记为需要回写
+        def save_all():
+            for entry in processor.entries:
+                processor._mark_dirty(entry)
+            processor._save_world_books()
+        result["save_all_s"], _ = timed(save_all, args.repeat)
+
+    return result
+
+def print_report(results: List[Dict[str, Any]], check_only: bool):
+    """打印结果表格"""
+    print("\n=== 世界书基准测试结果 ===")
+    if check_only:
+        header = f"{'条目数':>8} {'文件':>4} {'平均激活':>8} {'不一致':>6}"
+        print(header)
+        for r in results:
+            print(f"{r['size']:>8} {r['files']:>4} {r['avg_activated']:>8.1f} {r['mismatches']:>6}")
+        return
+    header = (f"{'条目数':>8} {'文件':>4} {'冷加载(s)':>9} {'热加载(s)':>9} {'峰值内存(MB)':>12} {'提示词(ms)':>10} "
+              f"{'提示词/秒':>9} {'切换(ms)':>9} {'全量保存(s)':>11} {'平均激活':>8} {'不一致':>6}")
+    print(header)
+    for r in results:
+        print(f"{r['size']:>8} {r['files']:>4} {r['cold_load_s']:>9.3f} {r['load_s']:>9.3f} {r['peak_mb']:>12.1f} {r['prompt_ms']:>10.2f} "
+              f"{r['prompt_per_s']:>9.1f} {r['toggle_ms']:>9.2f} {r['save_all_s']:>11.3f} "
+              f"{r['avg_activated']:>8.1f} {r['mismatches']:>6}")
+
+def main():
+    parser = argparse.ArgumentParser(description="世界书激活基准测试")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000], help="世界书条目数")
+    parser.add_argument("--per-file", type=int, default=2000, help="每个世界书文件的条目数")
+    parser.add_argument("--histories", type=int, default=50, help="合成聊天记录数量")
+    parser.add_argument("--turns", type=int, default=20, help="每段聊天记录的消息条数")
+    parser.add_argument("--toggles", type=int, default=20, help="启用/禁用操作次数")
+    parser.add_argument("--repeat", type=int, default=3, help="每项测量的重复次数(取中位数)")
+    parser.add_argument("--seed", type=int, default=42, help="随机种子，保证结果可复现")
+    parser.add_argument("--check-only", action="store_true", help="只做匹配等价性校验")
+    args = parser.parse_args()
+
+    processor_cls, message_cls = load_processor_class()
+    results = []
+    for size in args.sizes:
+        print(f"运行 {size} 条目...")
+        results.append(run_size(processor_cls, message_cls, size, args))
+    print_report(results, args.check_only)
+
+    if any(r["mismatches"] for r in results):
+        print("\n存在匹配结果不一致的聊天记录")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
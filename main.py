@@ -5,13 +5,18 @@ from .system.chat_manager import ChatManager
 from .pojia.pojia_mode import PoJiaModePlugin
 import os
 import yaml
+import asyncio
+import functools
 from .system.regex_processor import RegexProcessor
+from .system.status_store import StatusStore
 from .system.user_manager import UserManager
+from .system.user_state import UserStateStore, UserFlagSet, UserPageMap
+from .system.character_catalog import CharacterCatalog, PAGE_SIZE
 from .system.memory import Memory
 from datetime import datetime
 from pkg.provider.entities import Message
-from .system.world_book_processor import WorldBookProcessor
-from typing import Dict, Any, Callable, Awaitable, Optional, List
+from .system.world_book_processor import WorldBookProcessor, CharacterWorldBooks
+from typing import Dict, Any, Callable, Awaitable, Optional, List, Tuple
 
 # 通用错误处理装饰器
 def error_handler(func):
@@ -61,12 +66,17 @@ class TavernPlugin(BasePlugin, CommandBase):
     def __init__(self, host: APIHost):
         BasePlugin.__init__(self, host)
         CommandBase.__init__(self)
-        self.started_users = set()
         self.user_manager = None
         self.chat_manager = None
         self.world_book_processor = None
+        self.character_world_books = None
         self.pojia_plugin = None
         self.debug_mode = False
+        self.admin_users = set()  # 可以使用管理命令的QQ号
+        status_config = {}
+        self.conversion_workers = 0  # 角色卡转换进程数，0表示使用CPU核心数
+        self.watch_interval = 10  # 检查png目录的间隔秒数，0表示不检查
+        verify_crc = False  # 读取角色卡时是否校验PNG块的CRC
         
         # 加载配置
         config_path = os.path.join(os.path.dirname(__file__), "config.yaml")
@@ -74,16 +84,37 @@ class TavernPlugin(BasePlugin, CommandBase):
             with open(config_path, 'r', encoding='utf-8') as f:
                 config = yaml.safe_load(f)
                 self.debug_mode = config.get('system', {}).get('debug', False)
+                self.admin_users = {str(user_id) for user_id in config.get('system', {}).get('admin_users') or []}
+                status_config = config.get('status') or {}
+                conversion_config = (config.get('character') or {}).get('conversion') or {}
+                self.conversion_workers = conversion_config.get('workers', 0)
+                verify_crc = conversion_config.get('verify_crc', False)
+                self.watch_interval = conversion_config.get('watch_interval', 10)
         except Exception as e:
             print(f"加载配置文件失败: {e}")
         
-        self.enabled_users = set()  # 初始化启用用户集合
-        self.selecting_users = set()  # 正在选择角色的用户
-        self.current_page = {}  # 用户当前查看的角色页面
-        self.image_processor = ImageProcessor()  # 创建图片处理器实例
+        # 每个会话的最新状态块，持久化在角色目录中
+        self.status_store = StatusStore(
+            cache_size=status_config.get('cache_size', 256),
+            history_limit=status_config.get('history_limit', 0)
+        )
+        
+        # 用户状态(选择的角色和预设、是否开启酒馆等)集中保存在users/state.db，重启后仍然有效
+        self.user_state = UserStateStore(os.path.join(os.path.dirname(__file__), "users"))
+        self.enabled_users = UserFlagSet(self.user_state, 'enabled')  # 开启了酒馆的用户
+        self.started_users = UserFlagSet(self.user_state, 'started')  # 已经开始对话的用户
+        self.selecting_users = UserFlagSet(self.user_state, 'selecting')  # 正在选择角色的用户
+        self.current_page = UserPageMap(self.user_state)  # 用户当前查看的角色页面
+        # 排序、分页并建好搜索索引的角色列表，juese目录变化后自动重建
+        self.character_catalog = CharacterCatalog(os.path.join(os.path.dirname(__file__), "juese"))
+        self.character_choices: Dict[str, List[str]] = {}  # 用户最近一次看到的角色列表，输入数字时按它选择
+        self.image_processor = ImageProcessor(verify_crc=verify_crc)  # 创建图片处理器实例
+        self._conversion_lock = asyncio.Lock()  # 同一时间只进行一轮角色卡转换
+        self._conversion_task = None
+        self._watch_task = None
         
         # 初始化用户管理器
-        self.user_manager = UserManager(os.path.dirname(__file__))
+        self.user_manager = UserManager(os.path.dirname(__file__), state_store=self.user_state)
         
         # 初始化聊天管理器
         self.chat_manager = ChatManager()
@@ -92,24 +123,29 @@ class TavernPlugin(BasePlugin, CommandBase):
         
         # 初始化世界设定处理器
         self.world_book_processor = WorldBookProcessor(os.path.dirname(__file__))
+        # 角色卡自带的世界书，按角色在第一次使用时加载
+        self.character_world_books = CharacterWorldBooks(os.path.join(os.path.dirname(__file__), "juese", "shijieshu"))
         
-        # 初始化破甲插件
-        self.pojia_plugin = PoJiaModePlugin(self.host, self.chat_manager, self.user_manager)
+        # 初始化破甲插件，与主插件共用同一个世界书处理器
+        self.pojia_plugin = PoJiaModePlugin(self.host, self.chat_manager, self.user_manager, self.world_book_processor)
         
-        # 加载正则规则
-        regex_rules = {}
+        # 加载正则规则，RegexProcessor需要完整的配置(rules、show_processed等)
+        regex_config = {}
         try:
             regex_path = os.path.join(os.path.dirname(__file__), "regex_rules.yaml")
             with open(regex_path, 'r', encoding='utf-8') as f:
-                config = yaml.safe_load(f)
-                regex_rules = config.get('rules', {})
-                self.regex_enabled = config.get('enabled', True)
+                regex_config = yaml.safe_load(f) or {}
+                self.regex_enabled = regex_config.get('enabled', True)
         except Exception as e:
             print(f"加载正则规则失败: {e}")
             self.regex_enabled = False
-            regex_rules = {}
+            regex_config = {}
             
-        self.regex_processor = RegexProcessor(regex_rules, self.regex_enabled)
+        # 角色卡自带的正则脚本转换后放在juese/regex，按角色编译缓存
+        self.regex_processor = RegexProcessor(
+            regex_config, self.regex_enabled,
+            character_rules_dir=os.path.join(os.path.dirname(__file__), "juese", "regex")
+        )
         
         self._register_commands()
 
@@ -137,6 +173,12 @@ class TavernPlugin(BasePlugin, CommandBase):
         # 用户预设命令
         self.register("/设定我的个人资料", self._handle_set_preset)
         
+        # 状态命令
+        self.register("/状态", self._handle_status)
+        
+        # 管理命令
+        self.register("/正则", self._handle_regex_command)
+        
     def debug_print(self, *args, **kwargs):
         """调试信息打印函数"""
         if self.debug_mode:
@@ -146,24 +188,74 @@ class TavernPlugin(BasePlugin, CommandBase):
     async def initialize(self):
         """异步初始化"""
         # 初始化用户管理器
-        self.user_manager = UserManager(os.path.dirname(__file__))
+        self.user_manager = UserManager(os.path.dirname(__file__), state_store=self.user_state)
         
         # 初始化聊天管理器
         self.chat_manager = ChatManager()
         self.chat_manager.set_debug_mode(self.debug_mode)
         
-        # 初始化世界设定处理器
-        self.world_book_processor = WorldBookProcessor(os.path.dirname(__file__))
+        # 世界设定处理器已在构造时加载，这里不再重复加载世界书
         
         # 初始化破甲插件
-        self.pojia_plugin = PoJiaModePlugin(self.host, self.chat_manager, self.user_manager)
+        self.pojia_plugin = PoJiaModePlugin(self.host, self.chat_manager, self.user_manager, self.world_book_processor)
         
         # 初始化破甲模式
         await self.pojia_plugin.initialize()
         
-        # 自动转换角色卡
+        # 自动转换角色卡，在后台进行，不阻塞插件启动
+        self._conversion_task = asyncio.create_task(self._convert_cards_on_startup())
+        
+        # 运行中放进png目录的角色卡也自动转换，不需要重启
+        if self.watch_interval and self._watch_task is None:
+            self._watch_task = asyncio.create_task(self._watch_character_cards())
+
+    async def _convert_character_cards(self) -> Tuple[int, List[str]]:
+        """转换png目录下的角色卡：在线程中调度，由进程池并行转换，不阻塞事件循环"""
+        async with self._conversion_lock:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(None, functools.partial(
+                self.image_processor.convert_all_character_cards,
+                self.conversion_workers,
+                self._report_conversion_progress
+            ))
+
+    def _report_conversion_progress(self, done: int, total: int, file_name: str):
+        """大约每完成十分之一打印一次转换进度"""
+        step = max(total // 10, 1)
+        if done == total or done % step == 0:
+            print(f"角色卡转换进度: {done}/{total}")
+
+    async def _watch_character_cards(self):
+        """定期检查png目录，发现新增或修改的角色卡时在后台转换
+
+        文件要在两次检查之间保持不变才会转换，避免读到还没上传完的文件
+        """
+        loop = asyncio.get_running_loop()
+        if self._conversion_task is not None:
+            await asyncio.gather(self._conversion_task, return_exceptions=True)
+        handled = await loop.run_in_executor(None, self.image_processor.snapshot_pending_cards)
+        previous = handled
+        while True:
+            try:
+                await asyncio.sleep(self.watch_interval)
+                current = await loop.run_in_executor(None, self.image_processor.snapshot_pending_cards)
+                if current != handled and current == previous:
+                    count, converted = await self._convert_character_cards()
+                    if count > 0:
+                        print(f"已自动转换 {count} 个新角色卡: {', '.join(converted)}")
+                    # 转换后文件被移走，以转换后的目录状态为准
+                    current = await loop.run_in_executor(None, self.image_processor.snapshot_pending_cards)
+                    handled = current
+                previous = current
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"检查新角色卡失败: {e}")
+
+    async def _convert_cards_on_startup(self):
+        """启动时在后台转换角色卡"""
         try:
-            count, converted = self.image_processor.convert_all_character_cards()
+            count, converted = await self._convert_character_cards()
             if count > 0:
                 self.ap.logger.info(f"成功转换 {count} 个角色卡")
                 self.ap.logger.info(f"转换的角色: {', '.join(converted)}")
@@ -387,7 +479,15 @@ class TavernPlugin(BasePlugin, CommandBase):
                 except Exception as e:
                     print(f"处理世界书设定失败: {e}")
                 
-                # 4. 添加相关的长期记忆
+                # 4. 添加角色卡自带的世界书设定
+                try:
+                    character_book = self.character_world_books.get(current_character)
+                    if character_book is not None:
+                        ctx.event.default_prompt.extend(character_book.get_world_book_prompt(short_term, "# 角色世界书"))
+                except Exception as e:
+                    print(f"处理角色世界书设定失败: {e}")
+                
+                # 5. 添加相关的长期记忆
                 if relevant_memories:
                     memory_text = "# 相关的历史记忆\n"
                     for memory in relevant_memories:
@@ -398,7 +498,7 @@ class TavernPlugin(BasePlugin, CommandBase):
                         content=memory_text
                     ))
                 
-                # 5. 添加短期记忆
+                # 6. 添加短期记忆
                 if short_term:
                     ctx.event.prompt.extend(short_term)
 
@@ -457,7 +557,7 @@ class TavernPlugin(BasePlugin, CommandBase):
                 print(f"记忆总结失败: {e}")
 
         # 处理消息用于显示（统一处理所有占位符和状态块）
-        display_message = self._process_message_for_display(response)
+        display_message = self._process_message_for_display(response, is_group=is_group)
         
         # 更新返回消息
         ctx.event.response_text = display_message
@@ -536,10 +636,12 @@ class TavernPlugin(BasePlugin, CommandBase):
             "/关闭酒馆 - 关闭插件",
             "/帮助 - 显示此帮助信息",
             "/开始 - 开始与角色对话",
+            "/状态 - 查看当前角色的最新状态",
             "```",
             "\n### 角色系统命令",
             "```",
             "/角色 列表 - 显示所有可用角色",
+            "/角色 搜索 <关键词> - 按名称搜索角色",
             "/角色 切换 <名称> - 切换到指定角色",
             "/角色 当前 - 显示当前角色信息",
             "```",
@@ -572,6 +674,11 @@ class TavernPlugin(BasePlugin, CommandBase):
             "/破甲 关闭 - 关闭破甲模式\n"
             "/破甲 状态 - 查看当前配置",
             "```",
+            "\n### 管理命令(需在config.yaml的admin_users中)",
+            "```",
+            "/正则 统计 - 查看每条正则规则的执行次数、匹配次数和耗时\n"
+            "/正则 重置统计 - 清零正则运行统计",
+            "```",
             "\n💡 使用说明：",
             "1. 首次使用请先输入 /开启酒馆",
             "2. 使用 /设定我的个人资料 设置你的称呼和性格",
@@ -635,6 +742,7 @@ class TavernPlugin(BasePlugin, CommandBase):
             self.selecting_users.remove(user_id)
         if user_id in self.current_page:
             del self.current_page[user_id]
+        self.character_choices.pop(str(user_id), None)
         
         # 清空聊天历史
         self.chat_manager.clear_history(user_id)
@@ -660,45 +768,63 @@ class TavernPlugin(BasePlugin, CommandBase):
         ctx.add_return("reply", ["酒馆已关闭，下次进入可以重新选择角色"])
         ctx.prevent_default()
 
-    def _process_message_for_display(self, message: str, show_status: bool = False) -> str:
-        """处理消息用于显示"""
+    def _display_replacements(self, user_id) -> Dict[str, str]:
+        """显示消息时要替换的占位符，按顺序替换"""
+        if not user_id:
+            return {}
+            
+        # 获取用户名
+        user_name = "我"
+        try:
+            preset = self.user_manager.get_user_preset(user_id, False)
+            if preset:
+                preset_data = yaml.safe_load(preset)
+                if preset_data and "user_profile" in preset_data:
+                    user_name = preset_data["user_profile"].get("name", "我")
+        except Exception as e:
+            print(f"获取用户名失败: {e}")
+        
+        # 获取当前角色名
+        current_character = self.user_manager.get_user_character(user_id, False)
+        return {"{{user}}": user_name, "{{char}}": current_character}
+
+    def _save_status(self, user_id, status_content: str, is_group: bool = False):
+        """把状态块保存到用户当前角色的会话中"""
+        current_character = self.user_manager.get_user_character(user_id, is_group)
+        character_path = self.user_manager.get_character_path(user_id, current_character, is_group)
+        self.status_store.save(character_path, status_content)
+
+    def _process_message_for_display(self, message: str, is_group: bool = False) -> str:
+        """处理消息用于显示，提取到的状态块保存到状态存储中"""
         if not message:
             return message
         
         # 获取当前用户ID
         user_id = getattr(self, '_current_user_id', None)
+        
+        # 先执行角色卡自带的正则规则，替换内容中的占位符随后一并处理
         if user_id:
-            # 获取用户名
-            user_name = "我"
-            try:
-                preset = self.user_manager.get_user_preset(user_id, False)
-                if preset:
-                    preset_data = yaml.safe_load(preset)
-                    if preset_data and "user_profile" in preset_data:
-                        user_name = preset_data["user_profile"].get("name", "我")
-            except Exception as e:
-                print(f"获取用户名失败: {e}")
-            
-            # 获取当前角色名
-            current_character = self.user_manager.get_user_character(user_id, False)
-            
-            # 替换所有占位符
-            message = message.replace("{{user}}", user_name).replace("{{char}}", current_character)
+            current_character = self.user_manager.get_user_character(user_id, is_group)
+            message = self.regex_processor.process_character_text(current_character, message)
+        
+        # 替换所有占位符
+        for placeholder, value in self._display_replacements(user_id).items():
+            message = message.replace(placeholder, value)
         
-        # 处理状态块
-        processed_text, status_content = self.regex_processor.process_status_block(message, show_status)
+        # 处理状态块，显示时总是移除，内容保存下来供 /状态 查看
+        processed_text, status_content = self.regex_processor.process_status_block(message, show_status=True)
         
         # 如果有状态块内容，保存它
         if status_content:
             if user_id:
-                self.regex_processor.save_status(user_id, status_content)
+                self._save_status(user_id, status_content, is_group)
         
         return processed_text.strip()
 
     async def _handle_start_command(self, ctx: EventContext):
         """处理开始命令"""
         user_id = ctx.event.sender_id
-        is_group = ctx.event.launcher_type == "group"  # 仅用于显示
+        is_group = ctx.event.launcher_type == "group"  # 用于显示和清空群聊会话的状态
         
         if user_id not in self.enabled_users:
             ctx.add_return("reply", ["请先使用 /开启酒馆 命令开启酒馆"])
@@ -735,10 +861,12 @@ class TavernPlugin(BasePlugin, CommandBase):
             if hasattr(ctx.event.query, 'history'):
                 ctx.event.query.history = []
         
-        # 4. 清空正则处理器的状态缓存
-        if hasattr(self.regex_processor, 'clear_status'):
-            self.regex_processor.clear_status(user_id)
-            
+        # 4. 清空该角色会话的状态记录；群聊中的状态块按群聊会话保存，一并清空
+        self.status_store.clear(character_path)
+        if is_group:
+            group_character = self.user_manager.get_user_character(user_id, True)
+            self.status_store.clear(self.user_manager.get_character_path(user_id, group_character, True))
+
         # 将用户添加到已开始列表
         self.started_users.add(user_id)
         
@@ -789,11 +917,13 @@ class TavernPlugin(BasePlugin, CommandBase):
     async def _handle_convert_card(self, ctx: EventContext):
         """处理转换角色卡命令"""
         try:
-            count, converted = self.image_processor.convert_all_character_cards()
+            count, converted = await self._convert_character_cards()
             if count > 0:
+                # 从压缩包批量导入时角色可能有上千个，只列出前面一部分
+                shown = ', '.join(converted[:20]) + (f" 等{count}个" if count > 20 else "")
                 ctx.add_return("reply", [
                     f"成功转换 {count} 个角色卡\n" +
-                    f"转换的角色: {', '.join(converted)}"
+                    f"转换的角色: {shown}"
                 ])
             else:
                 ctx.add_return("reply", ["没有找到需要转换的角色卡"])
@@ -1192,16 +1322,15 @@ class TavernPlugin(BasePlugin, CommandBase):
         current_character = self.user_manager.get_user_character(user_id, is_group)
         
         # 获取最后一个状态块
-        last_status = self.regex_processor.get_last_status(user_id)
+        character_path = self.user_manager.get_character_path(user_id, current_character, is_group)
+        last_status = self.status_store.get(character_path)
         
-        # 如果没有缓存的状态块，从记忆中读取
+        # 没有保存过状态块时(例如升级前的会话)，从记忆中读取一次
         if not last_status:
-            # 获取角色目录路径
-            character_path = self.user_manager.get_character_path(user_id, current_character, is_group)
             memory = Memory(character_path, self.host)
             
             # 获取短期记忆
-            messages = memory.get_short_term()
+            messages = await memory.get_short_term(is_group=is_group, session_id=str(user_id))
             
             # 从最新到最旧遍历消息，寻找助手消息中的状态块
             if messages:
@@ -1212,7 +1341,7 @@ class TavernPlugin(BasePlugin, CommandBase):
                         if status_content:
                             last_status = status_content
                             # 保存找到的状态块
-                            self.regex_processor.save_status(user_id, status_content)
+                            self.status_store.save(character_path, status_content)
                             break
         
         if last_status:
@@ -1240,17 +1369,15 @@ class TavernPlugin(BasePlugin, CommandBase):
         
         # 获取所有角色
         try:
-            juese_dir = os.path.join(os.path.dirname(__file__), "juese")
-            yaml_files = [f for f in os.listdir(juese_dir) if f.endswith('.yaml')]
+            total_pages = self.character_catalog.total_pages
             
-            if not yaml_files:
+            if not total_pages:
                 ctx.add_return("reply", ["暂无可用角色"])
                 ctx.prevent_default()
                 return
             
             # 获取当前页码
             current_page = self.current_page.get(user_id, 1)
-            total_pages = (len(yaml_files) + 99) // 100  # 向上取整，每页100个
             
             # 检查页码是否有效
             if current_page > total_pages:
@@ -1258,10 +1385,8 @@ class TavernPlugin(BasePlugin, CommandBase):
                 ctx.prevent_default()
                 return
             
-            # 计算当前页的角色范围
-            start_idx = (current_page - 1) * 100
-            end_idx = min(start_idx + 100, len(yaml_files))
-            current_characters = yaml_files[start_idx:end_idx]
+            # 当前页的角色已经预先分好
+            current_characters = self.character_catalog.get_page(current_page)
             
             # 构建角色列表显示
             display = [
@@ -1270,8 +1395,7 @@ class TavernPlugin(BasePlugin, CommandBase):
             ]
             
             # 显示角色列表
-            for i, char_file in enumerate(current_characters, start=1):
-                char_name = os.path.splitext(char_file)[0]
+            for i, char_name in enumerate(current_characters, start=1):
                 display.append(f"{i}. {char_name}")
             
             # 添加操作提示
@@ -1279,10 +1403,14 @@ class TavernPlugin(BasePlugin, CommandBase):
                 "\n=== 操作提示 ===",
                 "1. 使用 /角色 第N页 切换到指定页面",
                 "2. 直接输入数字(1-100)选择本页角色",
-                "3. 选择角色后使用 /开始 开始对话",
+                "3. 使用 /角色 搜索 <关键词> 按名称查找角色",
+                "4. 选择角色后使用 /开始 开始对话",
                 f"（当前第{current_page}页，共{total_pages}页）"
             ])
             
+            # 记下用户看到的列表，之后输入的数字按这份列表选择，不受角色增删影响
+            self.character_choices[str(user_id)] = list(current_characters)
+            
             # 将用户添加到选择状态
             self.selecting_users.add(user_id)
             
@@ -1303,6 +1431,12 @@ class TavernPlugin(BasePlugin, CommandBase):
             ctx.prevent_default()
             return
         
+        # 处理搜索命令
+        parts = message.split(maxsplit=2)
+        if len(parts) >= 2 and parts[1] == "搜索":
+            await self._handle_character_search(ctx, parts[2] if len(parts) > 2 else "")
+            return
+        
         # 处理翻页命令
         if "第" in message and "页" in message:
             try:
@@ -1327,6 +1461,37 @@ class TavernPlugin(BasePlugin, CommandBase):
         # 如果不是翻页命令，则显示角色列表
         await self._handle_character_list(ctx)
 
+    async def _handle_character_search(self, ctx: EventContext, term: str):
+        """按名称搜索角色，结果可以像列表一样输入数字选择"""
+        user_id = ctx.event.sender_id
+        term = term.strip()
+        if not term:
+            ctx.add_return("reply", ["请输入要搜索的角色名，例如：/角色 搜索 雪"])
+            ctx.prevent_default()
+            return
+        
+        results = self.character_catalog.search(term, PAGE_SIZE + 1)
+        if not results:
+            ctx.add_return("reply", [f"没有找到名称包含“{term}”的角色"])
+            ctx.prevent_default()
+            return
+        
+        display = [f"=== 搜索“{term}”的结果 ==="]
+        if len(results) > PAGE_SIZE:
+            results = results[:PAGE_SIZE]
+            display.append(f"结果超过 {PAGE_SIZE} 个，只显示前 {PAGE_SIZE} 个，请使用更完整的名称")
+        for i, char_name in enumerate(results, start=1):
+            display.append(f"{i}. {char_name}")
+        display.extend([
+            "\n=== 操作提示 ===",
+            f"直接输入数字(1-{len(results)})选择角色，选择后使用 /开始 开始对话"
+        ])
+        
+        self.character_choices[str(user_id)] = results
+        self.selecting_users.add(user_id)
+        ctx.add_return("reply", ["\n".join(display)])
+        ctx.prevent_default()
+
     async def _handle_character_selection(self, ctx: EventContext, selection: str):
         """处理角色选择"""
         user_id = ctx.event.sender_id
@@ -1339,24 +1504,20 @@ class TavernPlugin(BasePlugin, CommandBase):
         # 阻止数字选择被记录到记忆
         ctx.prevent_default()
         
-        # 获取当前页码
-        current_page = self.current_page.get(user_id, 1)
-        
-        # 获取所有角色
-        juese_dir = os.path.join(os.path.dirname(__file__), "juese")
-        yaml_files = [f for f in os.listdir(juese_dir) if f.endswith('.yaml')]
-        total_pages = max(1, (len(yaml_files) + 99) // 100)  # 至少有1页，每页100个
+        # 按用户最近一次看到的列表选择；重启后没有记录时使用当前页
+        choices = self.character_choices.get(str(user_id))
+        if choices is None:
+            choices = self.character_catalog.get_page(self.current_page.get(user_id, 1))
         
         # 处理角色选择
         try:
             selection_num = int(selection)
-            if 1 <= selection_num <= 100:  # 修改为1-100
-                # 计算实际角色索引
-                start_idx = (current_page - 1) * 100  # 每页100个
-                actual_idx = start_idx + selection_num - 1
-                
-                if actual_idx < len(yaml_files):
-                    selected_char = os.path.splitext(yaml_files[actual_idx])[0]
+            if 1 <= selection_num <= PAGE_SIZE:
+                if selection_num <= len(choices):
+                    selected_char = choices[selection_num - 1]
+                    if selected_char not in self.character_catalog:
+                        ctx.add_return("reply", [f"角色 {selected_char} 已不存在，请使用 /角色 列表 重新查看"])
+                        return
                     
                     # 清理旧的记忆和历史记录
                     self.chat_manager.clear_history(user_id)
@@ -1375,6 +1536,7 @@ class TavernPlugin(BasePlugin, CommandBase):
                     # 清理所有状态
                     if user_id in self.selecting_users:
                         self.selecting_users.remove(user_id)
+                    self.character_choices.pop(str(user_id), None)
                     if user_id in self.started_users:
                         self.started_users.remove(user_id)
                     
@@ -1404,13 +1566,22 @@ class TavernPlugin(BasePlugin, CommandBase):
                 "/世界书 禁用 常开条目 <序号> - 禁用指定常开条目\n"
                 "/世界书 禁用 关键词条目 <序号> - 禁用指定关键词条目\n"
                 "/世界书 启用 常开条目 <序号> - 启用指定常开条目\n"
-                "/世界书 启用 关键词条目 <序号> - 启用指定关键词条目"
+                "/世界书 启用 关键词条目 <序号> - 启用指定关键词条目\n"
+                "/世界书 导入 [文件名] - 导入shijieshu/daoru下的SillyTavern世界书\n"
+                "/世界书 导出 [世界书文件名] - 导出到shijieshu/daochu，不指定时导出全部"
             ])
             ctx.prevent_default()
             return
             
         subcommand = parts[1]
         
+        if subcommand == "导入":
+            await self._handle_world_book_import(ctx, True)
+            return
+        if subcommand == "导出":
+            await self._handle_world_book_export(ctx, True)
+            return
+        
         if subcommand in ["常开", "关键词调动"]:
             page = 1
             if len(parts) > 2:
@@ -1474,20 +1645,12 @@ class TavernPlugin(BasePlugin, CommandBase):
             # 获取要操作的条目
             entry = entries[entry_num - 1]
             
-            # 执行启用/禁用操作
-            if subcommand == "启用":
-                entry.enabled = True
-                action = "启用"
-            else:
-                entry.enabled = False
-                action = "禁用"
-                
-            # 保存更改
-            try:
-                self.world_book_processor._save_world_books()
+            # 执行启用/禁用操作，只回写该条目所在的世界书文件
+            action = subcommand
+            if self.world_book_processor.set_entry_enabled(entry, subcommand == "启用"):
                 ctx.add_return("reply", [f"已{action}{entry_type} {entry_num}: {entry.comment}"])
-            except Exception as e:
-                ctx.add_return("reply", [f"保存更改失败: {e}"])
+            else:
+                ctx.add_return("reply", ["保存更改失败，请查看日志"])
             ctx.prevent_default()
             return
             
@@ -1517,6 +1680,35 @@ class TavernPlugin(BasePlugin, CommandBase):
             await self.pojia_plugin._send_help_message(ctx)
         ctx.prevent_default()
 
+    async def _handle_regex_command(self, ctx: EventContext):
+        """处理正则规则管理命令"""
+        msg = ctx.event.text_message.strip()
+        parts = msg.split()
+        user_id = str(ctx.event.sender_id)
+        
+        if user_id not in self.admin_users:
+            ctx.add_return("reply", ["只有管理员可以使用该命令，请在config.yaml的system.admin_users中添加QQ号"])
+            ctx.prevent_default()
+            return
+            
+        subcommand = parts[1] if len(parts) > 1 else ""
+        if subcommand == "统计":
+            ctx.add_return("reply", [
+                "=== 正则运行统计 ===\n"
+                f"{self.regex_processor.format_stats()}\n\n"
+                f"{self.regex_processor.stats_summary()}"
+            ])
+        elif subcommand == "重置统计":
+            self.regex_processor.reset_stats()
+            ctx.add_return("reply", ["已清零正则运行统计"])
+        else:
+            ctx.add_return("reply", [
+                "请使用以下格式：\n"
+                "/正则 统计 - 查看每条正则规则的执行次数、匹配次数和耗时\n"
+                "/正则 重置统计 - 清零正则运行统计"
+            ])
+        ctx.prevent_default()
+
     async def _handle_character_switch(self, ctx: EventContext, character_name: str):
         """处理角色切换命令"""
         user_id = ctx.event.sender_id
@@ -1724,15 +1916,77 @@ class TavernPlugin(BasePlugin, CommandBase):
         ctx.prevent_default()
 
     async def _handle_world_book_import(self, ctx: EventContext, is_common: bool):
-        """导入世界书"""
-        # TODO: 实现世界书导入功能
-        ctx.add_return("reply", ["世界书导入功能开发中"])
+        """导入世界书：把shijieshu/daoru下的SillyTavern世界书批量导入为新的世界书文件"""
+        processor = self.world_book_processor
+        parts = ctx.event.text_message.strip().split(maxsplit=2)
+        import_dir = os.path.join(processor.world_book_dir, processor.IMPORT_DIR)
+        os.makedirs(import_dir, exist_ok=True)
+
+        if len(parts) < 3:
+            files = sorted(f for f in os.listdir(import_dir) if f.endswith('.json'))
+            if not files:
+                ctx.add_return("reply", [f"请先把SillyTavern世界书JSON文件放到 shijieshu/{processor.IMPORT_DIR} 目录下"])
+            else:
+                ctx.add_return("reply", [
+                    "可导入的世界书：\n" + "\n".join(files) + "\n\n使用 /世界书 导入 <文件名> 导入"
+                ])
+            ctx.prevent_default()
+            return
+
+        name = os.path.basename(parts[2].strip())
+        if not name.endswith('.json'):
+            name += '.json'
+        source_path = os.path.join(import_dir, name)
+        if not os.path.exists(source_path):
+            ctx.add_return("reply", [f"找不到要导入的世界书: {name}"])
+            ctx.prevent_default()
+            return
+
+        try:
+            filename, count, skipped = processor.import_world_book(source_path)
+        except Exception as e:
+            ctx.add_return("reply", [f"导入世界书失败: {e}"])
+            ctx.prevent_default()
+            return
+
+        if not count:
+            reply = [f"{name} 中没有可导入的条目"]
+        else:
+            reply = [f"已导入 {count} 条条目到 {filename}"]
+        if skipped:
+            reply.append(f"跳过 {len(skipped)} 条无效条目：")
+            reply.extend(skipped[:10])
+            if len(skipped) > 10:
+                reply.append(f"……等共 {len(skipped)} 条")
+        ctx.add_return("reply", ["\n".join(reply)])
         ctx.prevent_default()
 
     async def _handle_world_book_export(self, ctx: EventContext, is_common: bool):
-        """导出世界书"""
-        # TODO: 实现世界书导出功能
-        ctx.add_return("reply", ["世界书导出功能开发中"])
+        """导出世界书：不指定文件名时把所有条目合并导出"""
+        processor = self.world_book_processor
+        parts = ctx.event.text_message.strip().split(maxsplit=2)
+        filename = None
+        if len(parts) >= 3:
+            filename = os.path.basename(parts[2].strip())
+            if not filename.endswith('.json'):
+                filename += '.json'
+            if filename not in processor.get_book_files():
+                ctx.add_return("reply", [
+                    f"世界书 {filename} 不存在，现有世界书：\n" + "\n".join(processor.get_book_files())
+                ])
+                ctx.prevent_default()
+                return
+
+        export_name = filename or f"全部世界书_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+        target_path = os.path.join(processor.world_book_dir, processor.EXPORT_DIR, export_name)
+        try:
+            count = processor.export_world_book(target_path, filename)
+        except Exception as e:
+            ctx.add_return("reply", [f"导出世界书失败: {e}"])
+            ctx.prevent_default()
+            return
+
+        ctx.add_return("reply", [f"已导出 {count} 条条目到 shijieshu/{processor.EXPORT_DIR}/{export_name}"])
         ctx.prevent_default()
 
     async def _handle_world_book_enable(self, ctx: EventContext, entry_id: int):
@@ -1744,8 +1998,10 @@ class TavernPlugin(BasePlugin, CommandBase):
             return
             
         entry = entries[entry_id]
-        entry.enabled = True
-        ctx.add_return("reply", [f"已启用条目: {entry.comment}"])
+        if self.world_book_processor.set_entry_enabled(entry, True):
+            ctx.add_return("reply", [f"已启用条目: {entry.comment}"])
+        else:
+            ctx.add_return("reply", ["保存更改失败，请查看日志"])
         ctx.prevent_default()
 
     async def _handle_world_book_disable(self, ctx: EventContext, entry_id: int):
@@ -1757,8 +2013,10 @@ class TavernPlugin(BasePlugin, CommandBase):
             return
             
         entry = entries[entry_id]
-        entry.enabled = False
-        ctx.add_return("reply", [f"已禁用条目: {entry.comment}"])
+        if self.world_book_processor.set_entry_enabled(entry, False):
+            ctx.add_return("reply", [f"已禁用条目: {entry.comment}"])
+        else:
+            ctx.add_return("reply", ["保存更改失败，请查看日志"])
         ctx.prevent_default()
 
     async def _handle_world_book_delete(self, ctx: EventContext, entry_id: int):
@@ -1769,8 +2027,11 @@ class TavernPlugin(BasePlugin, CommandBase):
             ctx.prevent_default()
             return
             
-        entry = entries.pop(entry_id)
-        ctx.add_return("reply", [f"已删除条目: {entry.comment}"])
+        entry = entries[entry_id]
+        if self.world_book_processor.delete_entry(entry_id):
+            ctx.add_return("reply", [f"已删除条目: {entry.comment}"])
+        else:
+            ctx.add_return("reply", ["保存更改失败，请查看日志"])
         ctx.prevent_default()
 
     async def _handle_world_book_view(self, ctx: EventContext, entry_id: int):
@@ -1803,7 +2064,15 @@ class TavernPlugin(BasePlugin, CommandBase):
 
     # 插件卸载时触发
     def __del__(self):
-        pass
+        # 结束正则限时执行的子进程
+        if hasattr(self, 'regex_processor'):
+            self.regex_processor.close()
+        # 停止检查新角色卡
+        if getattr(self, '_watch_task', None) is not None:
+            self._watch_task.cancel()
+        # 写入尚未保存的用户状态
+        if getattr(self, 'user_state', None) is not None:
+            self.user_state.close()
 
     async def _handle_memory_command(self, ctx: EventContext):
         """处理记忆相关命令"""
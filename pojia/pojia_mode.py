@@ -9,14 +9,14 @@ from pkg.plugin.context import EventContext
 from ..system.world_book_processor import WorldBookProcessor
 
 class PoJiaModePlugin:
-    def __init__(self, host: APIHost, chat_manager: ChatManager, user_manager):
+    def __init__(self, host: APIHost, chat_manager: ChatManager, user_manager, world_book_processor: WorldBookProcessor = None):
         self.host = host
         self.enabled_users = set()  # 启用破甲模式的用户集合
         self.prompt_template = []   # 当前使用的提示词模板
         self.config = {}           # 配置信息
         self.chat_manager = chat_manager  # 使用共享的聊天管理器
         self.user_manager = user_manager  # 使用共享的用户管理器
-        self.world_book_processor = None  # 世界书处理器
+        self.world_book_processor = world_book_processor  # 世界书处理器，优先使用主插件共享的实例
         
     async def initialize(self):
         # 读取配置文件
@@ -28,8 +28,9 @@ class PoJiaModePlugin:
             print(f"读取配置文件失败: {e}")
             return
 
-        # 初始化世界书处理器
-        self.world_book_processor = WorldBookProcessor(os.path.dirname(os.path.dirname(__file__)))
+        # 没有共享的世界书处理器时才自行加载
+        if self.world_book_processor is None:
+            self.world_book_processor = WorldBookProcessor(os.path.dirname(os.path.dirname(__file__)))
 
         # 读取默认模板
         template_name = self.config.get("default_template", "gemini")
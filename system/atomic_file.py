@@ -0,0 +1,28 @@
+import os
+import threading
+from contextlib import contextmanager
+from typing import IO, Iterator, Optional
+
+@contextmanager
+def atomic_write(path: str, mode: str = 'w', encoding: Optional[str] = 'utf-8',
+                 newline: Optional[str] = None) -> Iterator[IO]:
+    """先写同目录下的临时文件，写完fsync后再替换目标文件
+
+    其他线程或进程读取时不会看到写了一半的文件；写入出错时删除临时文件，目标文件保持原样，异常继续抛出。
+
+    用法：
+        with atomic_write(path) as f:
+            json.dump(data, f)
+    """
+    # 临时文件名带上进程和线程，进程池中同时写同一个文件时互不覆盖
+    tmp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+    binary = 'b' in mode
+    try:
+        with open(tmp_path, mode, encoding=None if binary else encoding, newline=None if binary else newline) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
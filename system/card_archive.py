@@ -0,0 +1,88 @@
+import io
+import os
+import json
+import zlib
+import hashlib
+import zipfile
+from typing import AbstractSet, Any, Dict, List, Optional, Tuple
+
+from .png_chunks import PngChunkError
+from .card_decoder import CardDecodeError, parse_character_card, read_png_card
+
+CARD_EXTENSIONS = ('.png', '.json')
+MAX_MEMBER_SIZE = 64 * 1024 * 1024  # 单个成员解压后的上限，防止压缩炸弹
+BATCH_SIZE = 32  # 每个任务处理的成员数，减少子进程重复打开压缩包的次数
+
+# 成员的处理结果
+MEMBER_CONVERTED = 'converted'
+MEMBER_SKIPPED = 'skipped'  # 同样内容已经转换过
+MEMBER_FAILED = 'failed'
+
+class ArchiveMemberError(ValueError):
+    """压缩包成员无法作为角色卡读取"""
+
+def list_card_members(archive_path: str) -> List[str]:
+    """列出压缩包中的PNG/JSON角色卡，只读取中央目录，不解压任何成员"""
+    with zipfile.ZipFile(archive_path) as archive:
+        members = []
+        for info in archive.infolist():
+            base_name = os.path.basename(info.filename)
+            if info.is_dir() or base_name.startswith('.') or info.filename.startswith('__MACOSX/'):
+                continue
+            if base_name.lower().endswith(CARD_EXTENSIONS):
+                members.append(info.filename)
+        return members
+
+def _read_member(archive: zipfile.ZipFile, member: str) -> bytes:
+    """读出一个成员的内容，超过MAX_MEMBER_SIZE时放弃"""
+    info = archive.getinfo(member)
+    if info.file_size > MAX_MEMBER_SIZE:
+        raise ArchiveMemberError(f"文件过大: {info.file_size} 字节")
+    with archive.open(info) as f:
+        # 不相信中央目录里记录的大小，多读一个字节判断是否超限
+        data = f.read(MAX_MEMBER_SIZE + 1)
+    if len(data) > MAX_MEMBER_SIZE:
+        raise ArchiveMemberError("文件过大")
+    return data
+
+def _decode_member(member: str, data: bytes, verify_crc: bool) -> Optional[Dict[str, Any]]:
+    """解码PNG或JSON角色卡，PNG中没有角色数据时返回None"""
+    if member.lower().endswith('.json'):
+        try:
+            card = parse_character_card(json.loads(data.decode('utf-8-sig')))
+        except (UnicodeDecodeError, ValueError) as e:
+            raise ArchiveMemberError(f"不是有效的JSON: {e}") from e
+        if card is None:
+            raise ArchiveMemberError("不是角色卡")
+        return card
+    return read_png_card(io.BytesIO(data), verify_crc)
+
+def decode_members(archive_path: str, members: List[str], known_hashes: AbstractSet[str],
+                   verify_crc: bool = False) -> List[Tuple[str, str, Optional[str], Optional[Dict[str, Any]]]]:
+    """依次读取并解码压缩包中的一批成员，返回[(结果, 成员名, 内容哈希, 角色数据)]
+
+    每次只有一个成员的内容在内存中，不会把压缩包解压到磁盘。内容哈希在known_hashes中的成员
+    已经转换过，不再解码；PNG中没有角色数据时角色数据为None，由调用方生成默认角色。
+    模块级函数，可以直接提交给进程池。
+    """
+    results = []
+    with zipfile.ZipFile(archive_path) as archive:
+        for member in members:
+            try:
+                data = _read_member(archive, member)
+                digest = hashlib.sha256(data).hexdigest()
+                if digest in known_hashes:
+                    results.append((MEMBER_SKIPPED, member, digest, None))
+                    continue
+                card = _decode_member(member, data, verify_crc)
+                results.append((MEMBER_CONVERTED, member, digest, card))
+            except (ArchiveMemberError, CardDecodeError, PngChunkError, zipfile.BadZipFile, zlib.error,
+                    OSError, RuntimeError, NotImplementedError) as e:
+                # 加密成员会抛出RuntimeError，不支持的压缩方法会抛出NotImplementedError
+                print(f"读取压缩包成员失败 {member}: {e}")
+                results.append((MEMBER_FAILED, member, None, None))
+    return results
+
+def batched(members: List[str], size: int = BATCH_SIZE) -> List[List[str]]:
+    """把成员按size分批"""
+    return [members[i:i + size] for i in range(0, len(members), size)]
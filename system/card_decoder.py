@@ -0,0 +1,133 @@
+import json
+import zlib
+import binascii
+from typing import Any, BinaryIO, Dict, Optional, Tuple
+
+from .png_chunks import iter_png_chunks, TEXT_CHUNK_TYPES
+
+CARD_KEYWORDS = ('ccv3', 'chara')  # 按优先级排列：V3卡的ccv3优先于兼容旧版的chara
+CARD_SPECS = ('chara_card_v2', 'chara_card_v3')
+MAX_TEXT_SIZE = 64 * 1024 * 1024  # 解压后文本的上限，防止压缩炸弹
+DECOMPRESS_STEP = 1 << 20  # 每次最多解压出的字节数
+
+_BASE64_CHARS = b'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/='
+_WHITESPACE = b' \t\r\n'
+
+class CardDecodeError(ValueError):
+    """角色卡数据块无法解码"""
+
+def is_base64(data: bytes) -> bool:
+    """用bytes.translate删掉所有base64字符(及空白)，剩下为空即是base64，在C层完成"""
+    return bool(data) and not data.translate(None, _BASE64_CHARS + _WHITESPACE)
+
+def _inflate(data: bytes) -> bytes:
+    """分段解压zlib数据，超过MAX_TEXT_SIZE时放弃"""
+    decompressor = zlib.decompressobj()
+    parts = []
+    size = 0
+    pending = data
+    while pending or not decompressor.eof:
+        part = decompressor.decompress(pending, DECOMPRESS_STEP)
+        pending = decompressor.unconsumed_tail
+        size += len(part)
+        if size > MAX_TEXT_SIZE:
+            raise CardDecodeError("压缩文本过大")
+        parts.append(part)
+        if not part and not pending:
+            break  # 数据被截断，已解压出的部分照常使用
+    return b''.join(parts)
+
+def _split_keyword(data: bytes) -> Tuple[str, bytes]:
+    null_pos = data.find(b'\0')
+    if null_pos <= 0:
+        raise CardDecodeError("无效的文本块格式")
+    return data[:null_pos].decode('latin1'), data[null_pos + 1:]
+
+def decode_text_chunk(chunk_type: bytes, data: bytes) -> Tuple[str, bytes]:
+    """解码tEXt/zTXt/iTXt块，返回(关键字, 文本的原始字节)"""
+    keyword, rest = _split_keyword(data)
+    if chunk_type == b'tEXt':
+        return keyword, rest
+    if chunk_type == b'zTXt':
+        # 压缩方法(1字节，只有0=zlib) + 压缩数据
+        if not rest or rest[0] != 0:
+            raise CardDecodeError("不支持的zTXt压缩方法")
+        return keyword, _inflate(rest[1:])
+    if chunk_type == b'iTXt':
+        # 压缩标志、压缩方法各1字节，语言标签\0，翻译后的关键字\0，文本(UTF-8)
+        if len(rest) < 2:
+            raise CardDecodeError("无效的iTXt块")
+        compressed, method = rest[0], rest[1]
+        language_end = rest.find(b'\0', 2)
+        translated_end = rest.find(b'\0', language_end + 1) if language_end >= 0 else -1
+        if translated_end < 0:
+            raise CardDecodeError("无效的iTXt块")
+        text = rest[translated_end + 1:]
+        if compressed:
+            if method != 0:
+                raise CardDecodeError("不支持的iTXt压缩方法")
+            text = _inflate(text)
+        return keyword, text
+    raise CardDecodeError(f"不是文本块: {chunk_type!r}")
+
+def decode_payload(text: bytes) -> Any:
+    """角色数据通常是base64编码的JSON，也兼容直接存放的JSON"""
+    stripped = text.strip()
+    if is_base64(stripped):
+        try:
+            return json.loads(binascii.a2b_base64(stripped).decode('utf-8'))
+        except (binascii.Error, UnicodeDecodeError, ValueError):
+            pass  # 恰好全是base64字符的普通文本
+    try:
+        return json.loads(stripped.decode('utf-8'))
+    except (UnicodeDecodeError, ValueError) as e:
+        raise CardDecodeError(f"角色数据不是JSON: {e}") from e
+
+def parse_character_card(card: Any) -> Optional[Dict[str, Any]]:
+    """把V1/V2/V3角色卡统一成顶层带name等字段的字典，不是角色卡时返回None
+
+    V2/V3卡的字段在data中(顶层的同名字段只为兼容旧程序，可能已过时)，以data为准；
+    spec缺失但带有data信封的卡同样展开。
+    """
+    if not isinstance(card, dict):
+        return None
+    data = card.get('data')
+    if isinstance(data, dict) and (card.get('spec') in CARD_SPECS or 'name' in data):
+        result = {key: value for key, value in card.items() if key != 'data'}
+        result.update(data)
+    else:
+        result = dict(card)
+    name = result.get('name')
+    if not isinstance(name, str) or not name.strip():
+        return None
+    return result
+
+def decode_card_chunk(chunk_type: bytes, data: bytes) -> Optional[Tuple[str, Dict[str, Any]]]:
+    """解码一个可能含有角色卡的文本块，返回(关键字, 角色数据)；不是角色卡块或数据无效时返回None"""
+    try:
+        keyword, _ = _split_keyword(data)
+        if keyword not in CARD_KEYWORDS:
+            return None  # 其他文本块不解压也不解码
+        keyword, text = decode_text_chunk(chunk_type, data)
+        card = parse_character_card(decode_payload(text))
+    except (CardDecodeError, zlib.error):
+        return None
+    if card is None:
+        return None
+    return keyword, card
+
+def read_png_card(f: BinaryIO, verify_crc: bool = False) -> Optional[Dict[str, Any]]:
+    """从PNG文件流中读取角色数据：ccv3优先于chara，找到ccv3后不再继续读"""
+    found: Dict[str, Dict[str, Any]] = {}
+    for chunk_type, chunk_data in iter_png_chunks(f, TEXT_CHUNK_TYPES, verify_crc):
+        decoded = decode_card_chunk(chunk_type, chunk_data)
+        if decoded is None:
+            continue
+        keyword, card = decoded
+        found.setdefault(keyword, card)
+        if keyword == CARD_KEYWORDS[0]:
+            break
+    for keyword in CARD_KEYWORDS:
+        if keyword in found:
+            return found[keyword]
+    return None
@@ -0,0 +1,111 @@
+import os
+import json
+import hashlib
+from datetime import datetime
+from typing import Any, Dict, Optional
+from .atomic_file import atomic_write
+
+MANIFEST_VERSION = 1
+HASH_BLOCK_SIZE = 1 << 20
+
+def hash_file(path: str) -> str:
+    """按块计算文件内容的SHA-256"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+class ConversionManifest:
+    """角色卡转换清单：记录每张PNG的内容哈希和转换结果，重复导入时直接跳过
+
+    files: 文件名 -> {size, mtime_ns, hash}，文件大小和修改时间都没变时不必重新计算哈希
+    cards: 内容哈希 -> {name, yaml, source, converted_at}，同样内容的卡换了文件名也能识别
+    另外按YAML文件建立到内容哈希的索引，批量转换时查找和覆盖旧记录不必遍历整个清单。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.files: Dict[str, Dict[str, Any]] = {}
+        self.cards: Dict[str, Dict[str, Any]] = {}
+        self._yaml_owners: Dict[str, str] = {}  # YAML文件 -> 内容哈希
+        self.dirty = False
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') == MANIFEST_VERSION:
+                self.files = data.get('files') or {}
+                self.cards = data.get('cards') or {}
+                for digest, card in list(self.cards.items()):
+                    old_digest = self._yaml_owners.get(card.get('yaml'))
+                    if old_digest is not None:
+                        # 同一YAML只保留后面的记录，与record的规则一致
+                        del self.cards[old_digest]
+                    self._yaml_owners[card.get('yaml')] = digest
+        except Exception as e:
+            print(f"读取角色卡转换清单失败，将重新建立: {e}")
+
+    def save(self):
+        """有改动时写入临时文件再替换"""
+        if not self.dirty:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with atomic_write(self.path) as f:
+                json.dump({'version': MANIFEST_VERSION, 'files': self.files, 'cards': self.cards},
+                          f, ensure_ascii=False, indent=2)
+            self.dirty = False
+        except Exception as e:
+            print(f"保存角色卡转换清单失败: {e}")
+
+    def known_hash(self, file_name: str, stat: os.stat_result) -> Optional[str]:
+        """文件大小和修改时间与清单一致时返回记录的哈希，不读文件"""
+        entry = self.files.get(file_name)
+        if entry and entry.get('size') == stat.st_size and entry.get('mtime_ns') == stat.st_mtime_ns:
+            return entry.get('hash')
+        return None
+
+    def remember_file(self, file_name: str, stat: os.stat_result, digest: str):
+        self.files[file_name] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'hash': digest}
+        self.dirty = True
+
+    def converted(self, digest: str, base_path: str) -> Optional[Dict[str, Any]]:
+        """该内容已经转换过且输出文件还在时返回转换记录"""
+        card = self.cards.get(digest)
+        if card and os.path.exists(os.path.join(base_path, card['yaml'])):
+            return card
+        return None
+
+    def owner_of(self, yaml_file: str) -> Optional[Dict[str, Any]]:
+        """找到生成了该YAML文件的转换记录"""
+        digest = self._yaml_owners.get(yaml_file)
+        return self.cards.get(digest) if digest is not None else None
+
+    def forget(self, digest: str):
+        """删除一条转换记录"""
+        card = self.cards.pop(digest, None)
+        if card is not None:
+            if self._yaml_owners.get(card.get('yaml')) == digest:
+                del self._yaml_owners[card.get('yaml')]
+            self.dirty = True
+
+    def record(self, digest: str, name: str, yaml_file: str, source: str):
+        """记录一次转换；同一YAML以前由其他内容生成时，旧记录作废"""
+        old_digest = self._yaml_owners.get(yaml_file)
+        if old_digest is not None:
+            self.forget(old_digest)
+        # 同样内容以前生成的是其他YAML时，那个YAML不再归它所有
+        self.forget(digest)
+        self._yaml_owners[yaml_file] = digest
+        self.cards[digest] = {
+            'name': name,
+            'yaml': yaml_file,
+            'source': source,
+            'converted_at': datetime.now().isoformat()
+        }
+        self.dirty = True
@@ -0,0 +1,87 @@
+from typing import Any, Dict, Optional
+
+# 角色卡character_book条目extensions中的字段 -> SillyTavern世界书条目字段
+_EXTENSION_FIELDS = {
+    'probability': 'probability',
+    'useProbability': 'useProbability',
+    'depth': 'depth',
+    'selectiveLogic': 'selectiveLogic',
+    'group': 'group',
+    'group_override': 'groupOverride',
+    'group_weight': 'groupWeight',
+    'scan_depth': 'scanDepth',
+    'case_sensitive': 'caseSensitive',
+    'match_whole_words': 'matchWholeWords',
+    'use_group_scoring': 'useGroupScoring',
+    'automation_id': 'automationId',
+    'role': 'role',
+    'vectorized': 'vectorized',
+    'sticky': 'sticky',
+    'cooldown': 'cooldown',
+    'delay': 'delay',
+    'exclude_recursion': 'excludeRecursion',
+    'prevent_recursion': 'preventRecursion',
+    'delay_until_recursion': 'delayUntilRecursion',
+}
+
+def get_character_book(card: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """取角色卡内嵌的世界书，兼容V2/V3卡的data.character_book和旧卡的顶层character_book"""
+    for source in (card.get('data'), card):
+        if isinstance(source, dict):
+            book = source.get('character_book')
+            if isinstance(book, dict) and isinstance(book.get('entries'), list):
+                return book
+    return None
+
+def _as_keys(value: Any) -> list:
+    if isinstance(value, str):
+        return [value] if value.strip() else []
+    if isinstance(value, list):
+        return [str(key) for key in value if str(key).strip()]
+    return []
+
+def convert_book_entry(entry: Dict[str, Any], index: int) -> Dict[str, Any]:
+    """把character_book的一个条目转换为世界书条目，与SillyTavern导入角色卡世界书的规则一致"""
+    extensions = entry.get('extensions') if isinstance(entry.get('extensions'), dict) else {}
+    uid = entry.get('id') if isinstance(entry.get('id'), int) else index
+    comment = entry.get('comment') or entry.get('name') or ''
+    position = extensions.get('position')
+    if position is None:
+        position = 0 if entry.get('position') == 'before_char' else 1
+    converted = {
+        'uid': uid,
+        'key': _as_keys(entry.get('keys')),
+        'keysecondary': _as_keys(entry.get('secondary_keys')),
+        'comment': comment,
+        'content': entry.get('content') or '',
+        'constant': bool(entry.get('constant', False)),
+        'selective': bool(entry.get('selective', False)),
+        'order': entry.get('insertion_order', 100),
+        'position': position,
+        'disable': not entry.get('enabled', True),
+        'addMemo': bool(comment),
+        'displayIndex': extensions.get('display_index', index),
+    }
+    # 大小写设置在V2规范中是条目字段，SillyTavern写在extensions中
+    if entry.get('case_sensitive') is not None:
+        converted['caseSensitive'] = entry['case_sensitive']
+    for source_key, target_key in _EXTENSION_FIELDS.items():
+        if extensions.get(source_key) is not None:
+            converted[target_key] = extensions[source_key]
+    return converted
+
+def convert_character_book(book: Dict[str, Any]) -> Dict[str, Any]:
+    """把角色卡的character_book转换为世界书文件(shijieshu目录下JSON的格式)，条目以uid为键"""
+    entries: Dict[str, Dict[str, Any]] = {}
+    for index, entry in enumerate(book.get('entries') or []):
+        if not isinstance(entry, dict):
+            continue
+        converted = convert_book_entry(entry, index)
+        # 条目id重复时顺延，保证uid唯一
+        while str(converted['uid']) in entries:
+            converted['uid'] += 1
+        entries[str(converted['uid'])] = converted
+    data: Dict[str, Any] = {'entries': entries}
+    if book.get('name'):
+        data['name'] = book['name']
+    return data
@@ -0,0 +1,42 @@
+import os
+from typing import Any, Dict, Optional, Tuple
+
+class CharacterFileCache:
+    """按角色缓存从juese目录下角色文件加载的内容(角色正则规则、角色世界书等)
+
+    每个角色只在第一次用到时加载并缓存，之后每次只检查一下文件的修改时间和大小，
+    文件被修改或删除后自动重新加载。子类实现file_path和_load。
+    """
+
+    def __init__(self):
+        self._cache: Dict[str, Tuple[Optional[Tuple[int, int]], Any]] = {}  # 角色名 -> (文件签名, 加载结果)
+
+    def file_path(self, character: str) -> str:
+        """角色对应的文件路径"""
+        raise NotImplementedError
+
+    def _load(self, character: str, path: str) -> Any:
+        """加载角色的文件，失败或没有内容时返回None"""
+        raise NotImplementedError
+
+    def get(self, character: str) -> Any:
+        """取角色的加载结果，角色没有对应文件时返回None"""
+        path = self.file_path(character)
+        try:
+            stat = os.stat(path)
+            signature = (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            signature = None
+        cached = self._cache.get(character)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+        value = self._load(character, path) if signature is not None else None
+        self._cache[character] = (signature, value)
+        return value
+
+    def clear(self, character: Optional[str] = None):
+        """丢弃缓存，下次使用时重新加载"""
+        if character is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(character, None)
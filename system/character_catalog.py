@@ -0,0 +1,121 @@
+import os
+import bisect
+import threading
+from typing import Dict, List, Optional, Tuple
+
+PAGE_SIZE = 100  # 每页显示的角色数，选择时输入1-PAGE_SIZE的数字
+
+class CharacterCatalog:
+    """juese目录下的角色索引：按名称排序、预先分好页，并建立名称的前缀和n元组索引用于搜索
+
+    只在第一次使用和目录的修改时间变化(新增、删除或重命名角色卡)后才重新扫描目录，
+    其余时候翻页和搜索都不访问磁盘。每次重建后version加一，调用方可以据此判断列表是否变化。
+    """
+
+    def __init__(self, juese_dir: str, page_size: int = PAGE_SIZE):
+        self.juese_dir = juese_dir
+        self.page_size = max(page_size, 1)
+        self.version = 0
+        self._signature: Optional[int] = None
+        self._lock = threading.Lock()
+        self._names: Tuple[str, ...] = ()  # 排序后的角色名
+        self._name_set = frozenset()
+        self._pages: Tuple[Tuple[str, ...], ...] = ()
+        self._keys: List[str] = []  # 与_names同序的小写名称，用于前缀二分查找
+        self._prefix_order: List[int] = []  # 按_keys排序后的角色序号
+        self._prefix_keys: List[str] = []
+        self._grams: Dict[str, List[int]] = {}  # 单字和二元组 -> 包含它的角色序号(升序)
+
+    @staticmethod
+    def _sort_key(name: str) -> Tuple[str, str]:
+        # 先忽略大小写比较，相同时再按原名，保证顺序唯一且稳定
+        return name.casefold(), name
+
+    def _refresh(self):
+        """目录修改时间变化时重建索引"""
+        try:
+            signature = os.stat(self.juese_dir).st_mtime_ns
+        except OSError:
+            signature = None
+        if signature == self._signature and self.version:
+            return
+        with self._lock:
+            if signature == self._signature and self.version:
+                return
+            names = []
+            if signature is not None:
+                with os.scandir(self.juese_dir) as entries:
+                    names = [entry.name[:-5] for entry in entries if entry.name.endswith('.yaml') and entry.is_file()]
+            self._build(sorted(names, key=self._sort_key))
+            self._signature = signature
+            self.version += 1
+
+    def _build(self, names: List[str]):
+        keys = [name.casefold() for name in names]
+        grams: Dict[str, List[int]] = {}
+        for index, key in enumerate(keys):
+            seen = set(key) | {key[i:i + 2] for i in range(len(key) - 1)}
+            for gram in seen:
+                grams.setdefault(gram, []).append(index)
+        self._names = tuple(names)
+        self._name_set = frozenset(names)
+        self._pages = tuple(
+            self._names[start:start + self.page_size] for start in range(0, len(names), self.page_size)
+        )
+        self._keys = keys
+        self._prefix_order = sorted(range(len(keys)), key=keys.__getitem__)
+        self._prefix_keys = [keys[index] for index in self._prefix_order]
+        self._grams = grams
+
+    @property
+    def names(self) -> Tuple[str, ...]:
+        """全部角色名，按名称排序"""
+        self._refresh()
+        return self._names
+
+    @property
+    def total_pages(self) -> int:
+        self._refresh()
+        return len(self._pages)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __contains__(self, name: str) -> bool:
+        self._refresh()
+        return name in self._name_set
+
+    def get_page(self, page: int) -> Tuple[str, ...]:
+        """取第page页(从1开始)的角色名，页码超出范围时返回空"""
+        self._refresh()
+        if 1 <= page <= len(self._pages):
+            return self._pages[page - 1]
+        return ()
+
+    def search(self, term: str, limit: int = PAGE_SIZE) -> List[str]:
+        """按名称搜索角色：以搜索词开头的排在前面，其次是名称中包含搜索词的，各自按名称排序"""
+        self._refresh()
+        key = term.strip().casefold()
+        if not key:
+            return []
+
+        # 前缀匹配：在排序好的小写名称中二分查找
+        start = bisect.bisect_left(self._prefix_keys, key)
+        prefix_hits = []
+        for position in range(start, len(self._prefix_keys)):
+            if not self._prefix_keys[position].startswith(key):
+                break
+            prefix_hits.append(self._prefix_order[position])
+        prefix_hits.sort()
+
+        # 包含匹配：取搜索词中候选最少的单字或二元组，再逐个确认
+        grams = [key] if len(key) == 1 else [key[i:i + 2] for i in range(len(key) - 1)]
+        postings = [self._grams.get(gram, []) for gram in grams]
+        candidates = min(postings, key=len)
+        prefix_set = set(prefix_hits)
+        contain_hits = [
+            index for index in candidates
+            if index not in prefix_set and key in self._keys[index]
+        ]
+
+        return [self._names[index] for index in (prefix_hits + contain_hits)[:limit]]
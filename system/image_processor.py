@@ -1,14 +1,54 @@
 import os
-import yaml
+import re
 import json
-import struct
-import zlib
-import base64
-from typing import Dict, Any, Tuple, List
+import math
+import yaml
+import zipfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, Any, Tuple, List, Optional, Callable
+from .regex_scripts import get_regex_scripts, convert_regex_scripts
+from .card_decoder import parse_character_card, read_png_card
+from .card_manifest import ConversionManifest, hash_file
+from .card_archive import (
+    BATCH_SIZE, MEMBER_FAILED, MEMBER_SKIPPED, batched, decode_members, list_card_members
+)
+from .character_book import get_character_book, convert_character_book
+from .world_book_processor import WorldBookProcessor
+from .atomic_file import atomic_write
+
+MANIFEST_FILE = ".manifest.json"  # png目录下的转换清单
+# 进程池在机器人的多线程进程中创建，fork可能复制其他线程持有的锁导致子进程卡死，因此用spawn启动
+POOL_CONTEXT = multiprocessing.get_context("spawn")
+_UNSAFE_NAME_CHARS = re.compile(r'[\\/:*?"<>|\x00-\x1f]')  # 不能出现在文件名中的字符
+
+def safe_character_name(name: Any, fallback: str) -> str:
+    """把角色卡中的名称转换为juese下可用的文件名
+
+    名称来自不受信任的角色卡，路径分隔符等字符替换为下划线，并去掉首尾的空白和点，
+    防止写到juese目录之外；处理后为空时使用fallback(角色卡的文件名)。
+    """
+    cleaned = _UNSAFE_NAME_CHARS.sub('_', str(name) if name is not None else '').strip().strip('.').strip()
+    if cleaned:
+        return cleaned
+    cleaned = _UNSAFE_NAME_CHARS.sub('_', fallback).strip().strip('.').strip()
+    return cleaned or "未命名角色"
+
+def convert_card(base_path: str, file_name: str, verify_crc: bool = False) -> Tuple[str, Optional[str]]:
+    """转换png目录下的一张角色卡，返回(文件名, 角色名)，失败时角色名为None
+
+    模块级函数，可以直接提交给进程池
+    """
+    return file_name, ImageProcessor(base_path, verify_crc).convert_character_card(file_name)
 
 class ImageProcessor:
-    def __init__(self):
-        self.base_path = os.path.dirname(os.path.dirname(__file__))
+    def __init__(self, base_path: Optional[str] = None, verify_crc: bool = False):
+        """
+        :param base_path: 插件根目录，默认为本文件所在插件的目录
+        :param verify_crc: 读取角色卡数据块时是否校验CRC
+        """
+        self.base_path = base_path or os.path.dirname(os.path.dirname(__file__))
+        self.verify_crc = verify_crc
         self._init_directories()
         
     def _init_directories(self):
@@ -17,6 +57,8 @@ class ImageProcessor:
             'png': '原始PNG角色卡目录',
             'png/converted': '已转换的PNG角色卡目录',
             'juese': '转换后的角色卡目录',
+            'juese/regex': '角色正则规则目录',
+            'juese/shijieshu': '角色世界书目录',
         }
         
         for dir_name, desc in dirs.items():
@@ -37,85 +79,16 @@ class ImageProcessor:
             return True
         return len(text.strip()) == 0
 
-    def _extract_png_chunks(self, data: bytes) -> List[tuple[bytes, bytes]]:
-        """提取PNG文件的所有数据块"""
-        # 验证PNG签名
-        if data[:8] != b'\x89PNG\r\n\x1a\n':
-            raise ValueError("不是有效的PNG文件")
-            
-        chunks = []
-        pos = 8  # 跳过签名
-        
-        while pos < len(data):
-            length = struct.unpack('>I', data[pos:pos+4])[0]
-            pos += 4
-            
-            chunk_type = data[pos:pos+4]
-            pos += 4
-            
-            chunk_data = data[pos:pos+length]
-            pos += length
-            
-            pos += 4  # 跳过CRC
-            
-            chunks.append((chunk_type, chunk_data))
-            
-            if chunk_type == b'IEND':
-                break
-                
-        return chunks
-
-    def _decode_text_chunk(self, data: bytes) -> tuple[str, str]:
-        """解码PNG文本块数据"""
-        null_pos = data.find(b'\0')
-        if null_pos == -1:
-            raise ValueError("无效的文本块格式")
-            
-        keyword = data[:null_pos].decode('latin1')
-        text_data = data[null_pos+1:]
-        
-        try:
-            if all(c in b'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/=' for c in text_data):
-                decoded = base64.b64decode(text_data)
-                try:
-                    text = decoded.decode('utf-8')
-                    return keyword, text
-                except UnicodeDecodeError:
-                    pass
-        except:
-            pass
-        
-        return keyword, text_data.decode('utf-8', errors='ignore')
+    def _read_character_data(self, image_path: str) -> Optional[Dict[str, Any]]:
+        """读取PNG中的角色数据：ccv3优先于chara，找到ccv3后不再继续读文件"""
+        with open(image_path, 'rb') as f:
+            return read_png_card(f, self.verify_crc)
 
     def process_character_image(self, image_path: str) -> Dict[str, Any]:
         """处理SillyTavern角色卡PNG图片"""
         try:
-            with open(image_path, 'rb') as f:
-                png_data = f.read()
-            
-            chunks = self._extract_png_chunks(png_data)
-            character_data = None
-            
-            for chunk_type, chunk_data in chunks:
-                if chunk_type == b'tEXt':
-                    try:
-                        keyword, text_data = self._decode_text_chunk(chunk_data)
-                        
-                        if keyword == 'chara':
-                            try:
-                                character_data = json.loads(text_data)
-                                if self._is_valid_character(character_data):
-                                    break
-                            except json.JSONDecodeError:
-                                try:
-                                    decoded = base64.b64decode(text_data)
-                                    character_data = json.loads(decoded.decode('utf-8'))
-                                    if self._is_valid_character(character_data):
-                                        break
-                                except Exception:
-                                    pass
-                    except Exception:
-                        pass
+            # 只读取文本块，图像数据直接跳过
+            character_data = self._read_character_data(image_path)
             
             if not character_data:
                 file_name = os.path.splitext(os.path.basename(image_path))[0]
@@ -130,10 +103,8 @@ class ImageProcessor:
             return {}
             
     def _is_valid_character(self, data: Dict[str, Any]) -> bool:
-        """验证是否是有效的角色数据"""
-        if not isinstance(data, dict):
-            return False
-        return 'name' in data
+        """验证是否是有效的角色数据，V2/V3卡的字段在data信封中"""
+        return parse_character_card(data) is not None
 
     def _create_default_character(self, name: str) -> Dict[str, Any]:
         """创建默认角色数据"""
@@ -147,10 +118,24 @@ class ImageProcessor:
             'creator_notes': '通过PNG直接转换（未找到角色数据）',
         }
 
-    def _save_character(self, data: Dict[str, Any], original_path: str) -> None:
-        """保存角色数据为YAML"""
+    def _write_yaml(self, path: str, data: Dict[str, Any], header: str = '') -> None:
+        """先写临时文件再替换，机器人运行中转换时不会读到写了一半的角色卡"""
+        with atomic_write(path, newline='\n') as f:
+            f.write(header)
+            yaml.safe_dump(
+                data,
+                f,
+                allow_unicode=True,
+                sort_keys=False,
+                default_flow_style=False,
+                width=float("inf"),
+                indent=2
+            )
+
+    def _save_character(self, data: Dict[str, Any], original_path: str) -> Optional[str]:
+        """保存角色数据为YAML，返回保存的文件名(不含扩展名)，失败时返回None"""
         try:
-            file_name = data.get('name', os.path.splitext(os.path.basename(original_path))[0])
+            file_name = safe_character_name(data.get('name'), os.path.splitext(os.path.basename(original_path))[0])
             yaml_path = os.path.join(self.base_path, 'juese', f"{file_name}.yaml")
             
             os.makedirs(os.path.dirname(yaml_path), exist_ok=True)
@@ -161,64 +146,273 @@ class ImageProcessor:
                 if not self._is_empty(value):
                     save_data[field] = value
             
-            with open(yaml_path, 'w', encoding='utf-8', newline='\n') as f:
-                yaml.safe_dump(
-                    save_data,
-                    f,
-                    allow_unicode=True,
-                    sort_keys=False,
-                    default_flow_style=False,
-                    width=float("inf"),
-                    indent=2
-                )
+            self._write_yaml(yaml_path, save_data)
                 
             print(f"已转换并保存: {os.path.basename(original_path)} -> {os.path.basename(yaml_path)}")
             
+            self._save_regex_scripts(data, file_name)
+            self._save_character_book(data, file_name)
+            return file_name
+            
         except Exception as e:
             print(f"保存角色卡失败: {e}")
             import traceback
             traceback.print_exc()
+            return None
+
+    def _save_regex_scripts(self, data: Dict[str, Any], file_name: str) -> None:
+        """把角色卡自带的正则脚本转换为juese/regex/角色名.yaml，由RegexProcessor按角色编译缓存"""
+        rules = convert_regex_scripts(get_regex_scripts(data))
+        regex_path = os.path.join(self.base_path, 'juese', 'regex', f"{file_name}.yaml")
+        if not rules:
+            return
+            
+        try:
+            os.makedirs(os.path.dirname(regex_path), exist_ok=True)
+            self._write_yaml(
+                regex_path, {'rules': rules},
+                "# 由角色卡中作用于AI回复的正则脚本转换，格式与regex_rules.yaml的rules相同，修改后自动重新加载\n"
+            )
+            print(f"已转换角色正则脚本: {len(rules)} 条 -> {os.path.basename(regex_path)}")
+        except Exception as e:
+            print(f"保存角色正则脚本失败: {e}")
+
+    def _save_character_book(self, data: Dict[str, Any], file_name: str) -> None:
+        """把角色卡内嵌的世界书保存为juese/shijieshu/角色名/角色名.json，并预先编译关键词索引
+
+        WorldBookProcessor加载时会把解析结果和编译好的匹配器写入该目录的缓存，
+        运行时第一次用到这个角色直接读取缓存，不需要再解析角色卡或编译关键词。
+        """
+        book = get_character_book(data)
+        if not book or not book.get('entries'):
+            return
+        book_dir = os.path.join(self.base_path, 'juese', 'shijieshu', file_name)
+        book_path = os.path.join(book_dir, f"{file_name}.json")
+        try:
+            world_book = convert_character_book(book)
+            os.makedirs(book_dir, exist_ok=True)
+            with atomic_write(book_path) as f:
+                json.dump(world_book, f, ensure_ascii=False, indent=2)
+            processor = WorldBookProcessor(self.base_path, world_book_dir=book_dir)
+            print(f"已转换角色世界书: {len(processor.entries)} 条 -> {file_name}/{os.path.basename(book_path)}")
+        except Exception as e:
+            print(f"保存角色世界书失败: {e}")
+
+    def get_pending_cards(self) -> List[str]:
+        """png目录下等待转换的角色卡文件名，不包括converted子目录"""
+        png_dir = os.path.join(self.base_path, "png")
+        return sorted(
+            file_name for file_name in os.listdir(png_dir)
+            if file_name.lower().endswith('.png') and not os.path.isdir(os.path.join(png_dir, file_name))
+        )
+
+    def get_pending_archives(self) -> List[str]:
+        """png目录下等待导入的zip角色卡包"""
+        png_dir = os.path.join(self.base_path, "png")
+        return sorted(
+            file_name for file_name in os.listdir(png_dir)
+            if file_name.lower().endswith('.zip') and os.path.isfile(os.path.join(png_dir, file_name))
+        )
 
-    def convert_all_character_cards(self) -> Tuple[int, list[str]]:
-        """转换所有PNG角色卡"""
+    def snapshot_pending_cards(self) -> Dict[str, Tuple[int, int]]:
+        """png目录下等待转换的角色卡和压缩包的(大小, 修改时间)，用于发现新增或修改的文件"""
+        png_dir = os.path.join(self.base_path, "png")
+        snapshot = {}
+        for file_name in self.get_pending_cards() + self.get_pending_archives():
+            try:
+                stat = os.stat(os.path.join(png_dir, file_name))
+            except OSError:
+                continue  # 刚被移走或删除
+            snapshot[file_name] = (stat.st_size, stat.st_mtime_ns)
+        return snapshot
+
+    def convert_character_card(self, file_name: str) -> Optional[str]:
+        """转换png目录下的一张角色卡并移动到converted目录，返回角色名，失败时返回None"""
         png_dir = os.path.join(self.base_path, "png")
         converted_dir = os.path.join(png_dir, "converted")
+        image_path = os.path.join(png_dir, file_name)
+        try:
+            character_data = self.process_character_image(image_path)
+            if not character_data:
+                return None
+                
+            # 移动已转换的PNG文件到converted目录
+            converted_path = os.path.join(converted_dir, file_name)
+            try:
+                os.makedirs(converted_dir, exist_ok=True)
+                os.rename(image_path, converted_path)
+                print(f"已移动转换完成的文件到: {converted_path}")
+            except Exception as e:
+                print(f"移动文件失败 {file_name}: {e}")
+            return safe_character_name(character_data.get('name'), os.path.splitext(file_name)[0])
+        except Exception as e:
+            print(f"转换失败 {file_name}: {e}")
+            return None
+
+    def _select_changed_cards(self, files: List[str], manifest: ConversionManifest) -> Dict[str, str]:
+        """对照转换清单挑出新增或内容有变化的角色卡，返回文件名 -> 内容哈希
+
+        文件大小和修改时间与清单一致时直接用记录的哈希，不读文件；内容转换过且YAML还在的卡跳过
+        """
+        png_dir = os.path.join(self.base_path, "png")
+        changed: Dict[str, str] = {}
+        pending = set()
+        skipped = 0
+        for file_name in files:
+            path = os.path.join(png_dir, file_name)
+            try:
+                stat = os.stat(path)
+                digest = manifest.known_hash(file_name, stat)
+                if digest is None:
+                    digest = hash_file(path)
+                    manifest.remember_file(file_name, stat, digest)
+            except OSError as e:
+                print(f"读取角色卡失败 {file_name}: {e}")
+                continue
+            # 本轮已有同样内容的卡时也跳过
+            if manifest.converted(digest, self.base_path) or digest in pending:
+                skipped += 1
+                continue
+            changed[file_name] = digest
+            pending.add(digest)
+        if skipped:
+            print(f"跳过 {skipped} 张已转换且未变化的角色卡")
+        return changed
+
+    def _record_conversion(self, manifest: ConversionManifest, digest: str, name: str, source: str):
+        """在清单中记录一次转换，覆盖了其他来源转换的YAML时给出提示"""
+        yaml_file = os.path.join('juese', f"{name}.yaml")
+        owner = manifest.owner_of(yaml_file)
+        if owner and owner.get('source') != source:
+            print(f"角色卡 {source} 覆盖了由 {owner.get('source')} 转换的 {yaml_file}")
+        manifest.record(digest, name, yaml_file, source)
+
+    def _convert_pending_cards(self, manifest: ConversionManifest, workers: int,
+                               progress: Optional[Callable[[int, int, str], None]]) -> List[str]:
+        """转换png目录下新增或有变化的PNG角色卡，返回转换的角色名"""
+        changed = self._select_changed_cards(self.get_pending_cards(), manifest)
+        if not changed:
+            return []
+        files = list(changed)
+        workers = min(workers or os.cpu_count() or 1, len(files))
         converted = []
-        count = 0
         
-        # 确保已转换目录存在
-        if not os.path.exists(converted_dir):
-            os.makedirs(converted_dir)
+        def finished(done: int, file_name: str, name: Optional[str]):
+            if name:
+                converted.append(name)
+                self._record_conversion(manifest, changed[file_name], name, file_name)
+            if progress is not None:
+                progress(done, len(files), file_name)
         
-        # 只处理png目录下的文件，不处理converted子目录中的文件
-        for file_name in os.listdir(png_dir):
-            if not file_name.lower().endswith('.png'):
-                continue
-                
-            # 跳过converted目录
-            if file_name == "converted":
-                continue
-                
-            image_path = os.path.join(png_dir, file_name)
-            try:
-                # 检查文件是否是目录
-                if os.path.isdir(image_path):
-                    continue
-                    
-                character_data = self.process_character_image(image_path)
-                if character_data:
-                    count += 1
-                    converted.append(character_data.get('name', file_name))
-                    
-                    # 移动已转换的PNG文件到converted目录
-                    converted_path = os.path.join(converted_dir, file_name)
+        if workers <= 1:
+            for done, file_name in enumerate(files, 1):
+                finished(done, file_name, self.convert_character_card(file_name))
+        else:
+            # 解码、写YAML都在子进程中完成，每张卡互不相关
+            with ProcessPoolExecutor(max_workers=workers, mp_context=POOL_CONTEXT) as executor:
+                futures = {
+                    executor.submit(convert_card, self.base_path, file_name, self.verify_crc): file_name
+                    for file_name in files
+                }
+                for done, future in enumerate(as_completed(futures), 1):
                     try:
-                        os.rename(image_path, converted_path)
-                        print(f"已移动转换完成的文件到: {converted_path}")
+                        _, name = future.result()
                     except Exception as e:
-                        print(f"移动文件失败 {file_name}: {e}")
-                        
-            except Exception as e:
-                print(f"转换失败 {file_name}: {e}")
-                
-        return count, converted 
\ No newline at end of file
+                        print(f"角色卡转换进程出错 {futures[future]}: {e}")
+                        name = None
+                    finished(done, futures[future], name)
+        return converted
+
+    def import_card_archive(self, archive_name: str, manifest: ConversionManifest, workers: int = 1,
+                            progress: Optional[Callable[[int, int, str], None]] = None) -> List[str]:
+        """从png目录下的zip包批量导入PNG/JSON角色卡，返回导入的角色名
+
+        成员分批交给进程池，每个进程直接从压缩包中逐个读取和解码，不解压到磁盘；
+        全部解码完成后按包内顺序一次写出所有角色文件，转换清单也只更新一次。导入后压缩包移到converted目录。
+        """
+        png_dir = os.path.join(self.base_path, "png")
+        archive_path = os.path.join(png_dir, archive_name)
+        try:
+            members = list_card_members(archive_path)
+        except (zipfile.BadZipFile, OSError) as e:
+            print(f"读取角色卡压缩包失败 {archive_name}: {e}")
+            return []
+
+        # 已经转换过的内容在子进程中读出哈希后直接跳过，不再解码
+        known = frozenset(digest for digest in manifest.cards if manifest.converted(digest, self.base_path))
+        workers = min(workers or os.cpu_count() or 1, max(len(members), 1))
+        # 每个进程分到几批即可，批次太小时已转换哈希集合会被重复传给子进程
+        batches = batched(members, max(BATCH_SIZE, math.ceil(len(members) / (workers * 4))))
+        decoded = []
+
+        def collect(results):
+            for result in results:
+                decoded.append(result)
+                if progress is not None:
+                    progress(len(decoded), len(members), result[1])
+
+        if workers <= 1:
+            for batch in batches:
+                collect(decode_members(archive_path, batch, known, self.verify_crc))
+        else:
+            with ProcessPoolExecutor(max_workers=min(workers, len(batches)), mp_context=POOL_CONTEXT) as executor:
+                futures = {
+                    executor.submit(decode_members, archive_path, batch, known, self.verify_crc): batch
+                    for batch in batches
+                }
+                for future in as_completed(futures):
+                    try:
+                        results = future.result()
+                    except Exception as e:
+                        print(f"角色卡导入进程出错 {archive_name}: {e}")
+                        results = [(MEMBER_FAILED, member, None, None) for member in futures[future]]
+                    collect(results)
+
+        # 按包内顺序写出，同名角色以后出现的为准
+        order = {member: index for index, member in enumerate(members)}
+        decoded.sort(key=lambda result: order[result[1]])
+        converted = []
+        written = set()
+        skipped = failed = 0
+        for status, member, digest, card in decoded:
+            if status == MEMBER_FAILED:
+                failed += 1
+                continue
+            if status == MEMBER_SKIPPED or digest in written:
+                skipped += 1
+                continue
+            if card is None:
+                card = self._create_default_character(os.path.splitext(os.path.basename(member))[0])
+            name = self._save_character(card, member)
+            if name is None:
+                failed += 1
+                continue
+            written.add(digest)
+            converted.append(name)
+            self._record_conversion(manifest, digest, name, f"{archive_name}/{member}")
+        print(f"已导入压缩包 {archive_name}: {len(converted)} 个角色，跳过 {skipped} 个已转换的，失败 {failed} 个")
+
+        converted_dir = os.path.join(png_dir, "converted")
+        try:
+            os.makedirs(converted_dir, exist_ok=True)
+            os.replace(archive_path, os.path.join(converted_dir, archive_name))
+        except Exception as e:
+            print(f"移动文件失败 {archive_name}: {e}")
+        return converted
+
+    def convert_all_character_cards(self, workers: int = 1,
+                                    progress: Optional[Callable[[int, int, str], None]] = None) -> Tuple[int, list[str]]:
+        """转换所有新增或有变化的PNG角色卡，并导入png目录下的zip角色卡包
+
+        :param workers: 并行转换的进程数，1表示在当前进程中逐个转换，0表示使用CPU核心数
+        :param progress: 每转换完一张调用一次，参数为(已完成数, 总数, 文件名)
+        """
+        manifest = ConversionManifest(os.path.join(self.base_path, "png", MANIFEST_FILE))
+        try:
+            converted = self._convert_pending_cards(manifest, workers, progress)
+            for archive_name in self.get_pending_archives():
+                converted.extend(self.import_card_archive(archive_name, manifest, workers, progress))
+            return len(converted), converted
+        finally:
+            # 整轮转换只写一次清单
+            manifest.save()
@@ -0,0 +1,257 @@
+import re
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence, Set, Tuple, Any
+
+# 与SillyTavern一致：条目未指定时关键词不区分大小写，也不要求整词匹配
+DEFAULT_CASE_SENSITIVE = False
+DEFAULT_MATCH_WHOLE_WORDS = False
+
+# SillyTavern的selectiveLogic取值：主关键词命中后如何看待次要关键词
+SELECTIVE_AND_ANY = 0  # 任一次要关键词命中
+SELECTIVE_NOT_ALL = 1  # 次要关键词没有全部命中
+SELECTIVE_NOT_ANY = 2  # 次要关键词都没有命中
+SELECTIVE_AND_ALL = 3  # 次要关键词全部命中
+
+# /pattern/flags 形式的正则关键词
+_REGEX_KEY_PATTERN = re.compile(r'^/(.+)/([a-z]*)$', re.DOTALL)
+# JavaScript的命名分组(?<name>...)，Python写作(?P<name>...)
+_JS_NAMED_GROUP = re.compile(r'\(\?<(?![=!])')
+# 含反向引用的正则放进合并的交替式后分组编号会错位，只能单独匹配
+_BACKREFERENCE = re.compile(r'\\[1-9]|\(\?P=')
+_JS_FLAGS = {'i': re.IGNORECASE, 's': re.DOTALL, 'm': re.MULTILINE}
+
+# 整词匹配按JavaScript的\W处理，只把ASCII字母数字下划线视为单词字符
+_WORD_BEFORE = r'(?<![A-Za-z0-9_])'
+_WORD_AFTER = r'(?![A-Za-z0-9_])'
+
+@lru_cache(maxsize=4096)
+def parse_regex_key(key: str) -> Optional[Tuple[str, str]]:
+    """解析 /pattern/flags 形式的关键词，返回(Python正则源码, 内联标志)；不是正则或无法编译时返回None"""
+    match = _REGEX_KEY_PATTERN.match(key)
+    if not match:
+        return None
+    source = _JS_NAMED_GROUP.sub('(?P<', match.group(1))
+    flags = ''.join(flag for flag in match.group(2) if flag in _JS_FLAGS)
+    try:
+        re.compile(f"(?{flags}:{source})" if flags else source)
+    except re.error:
+        # 与SillyTavern一致，无效的正则按普通关键词处理
+        return None
+    return source, flags
+
+@lru_cache(maxsize=4096)
+def _compile_regex_key(source: str, flags: str) -> re.Pattern:
+    return re.compile(f"(?{flags}:{source})" if flags else source)
+
+@lru_cache(maxsize=4096)
+def _compile_whole_word(key: str) -> re.Pattern:
+    return re.compile(_WORD_BEFORE + re.escape(key) + _WORD_AFTER)
+
+def _fold(text: str) -> str:
+    return text.casefold()
+
+def key_matches(key: str, text: str, case_sensitive: Optional[bool] = None,
+                match_whole_words: Optional[bool] = None) -> bool:
+    """逐个关键词的参考实现，语义与KeywordMatcher完全一致，用于单条目判断和等价性校验"""
+    regex_key = parse_regex_key(key)
+    if regex_key:
+        # 正则关键词只看自身的标志
+        return _compile_regex_key(*regex_key).search(text) is not None
+
+    if not (DEFAULT_CASE_SENSITIVE if case_sensitive is None else case_sensitive):
+        key = _fold(key)
+        text = _fold(text)
+    whole_words = DEFAULT_MATCH_WHOLE_WORDS if match_whole_words is None else match_whole_words
+    if whole_words and not any(c.isspace() for c in key):
+        return _compile_whole_word(key).search(text) is not None
+    # 多个单词组成的关键词即使要求整词也按子串匹配，与SillyTavern相同
+    return key in text
+
+def selective_passes(logic: int, hit_bits: int, full_mask: int) -> bool:
+    """用位运算判断次要关键词逻辑：hit_bits是命中的次要关键词位，full_mask是全部次要关键词位"""
+    if not full_mask:
+        return True
+    if logic == SELECTIVE_NOT_ALL:
+        return hit_bits & full_mask != full_mask
+    if logic == SELECTIVE_NOT_ANY:
+        return hit_bits & full_mask == 0
+    if logic == SELECTIVE_AND_ALL:
+        return hit_bits & full_mask == full_mask
+    return hit_bits & full_mask != 0
+
+class KeywordMatcher:
+    """把一组条目的关键词编译成一次扫描：普通关键词按长度分桶做子串哈希查找，
+    正则关键词合并成一个带命名分组的交替式，整轮只做一次大小写折叠"""
+
+    def __init__(self, entries: Sequence[Any]):
+        """
+        :param entries: 需要关键词扫描的条目，返回结果是这些条目的下标
+
+        匹配器不保留条目本身，可以单独序列化到磁盘缓存
+        """
+        self.slot_entries: List[int] = []  # 关键词槽 -> 条目下标
+        self.slot_bits: List[int] = []  # 关键词槽 -> 次要关键词在条目位集中的位，主关键词为0
+        self._selective: Dict[int, Tuple[int, int]] = {}  # 条目下标 -> (selectiveLogic, 全部次要关键词位)
+
+        # 普通关键词: 长度 -> 关键词集合，关键词 -> 槽列表；区分大小写和不区分大小写两张表
+        self._exact_by_length: Dict[int, Set[str]] = {}
+        self._exact_slots: Dict[str, List[int]] = {}
+        self._folded_by_length: Dict[int, Set[str]] = {}
+        self._folded_slots: Dict[str, List[int]] = {}
+        # 需要整词匹配的普通关键词槽，命中后再检查边界
+        self._whole_word_slots: Set[int] = set()
+
+        # 正则关键词
+        self._regex_slots: List[int] = []  # 交替式中的顺序 -> 槽
+        self._regex_patterns: List[re.Pattern] = []  # 与_regex_slots对应的单独编译结果
+        self._group_alternatives: Dict[int, int] = {}  # 合并正则的分组编号 -> 交替式中的顺序
+        self._combined: Optional[re.Pattern] = None
+        self._standalone: List[Tuple[int, re.Pattern]] = []  # 无法合并的正则
+
+        for index, entry in enumerate(entries):
+            for key in entry.key:
+                self._add_key(index, 0, key, entry.case_sensitive, entry.match_whole_words)
+            if entry.selective and entry.keysecondary:
+                # 次要关键词依次占用条目位集中的一位
+                for position, key in enumerate(entry.keysecondary):
+                    self._add_key(index, 1 << position, key, entry.case_sensitive, entry.match_whole_words)
+                self._selective[index] = (entry.selective_logic, (1 << len(entry.keysecondary)) - 1)
+        self._compile_regex()
+
+    def _new_slot(self, entry_index: int, bit: int) -> int:
+        self.slot_entries.append(entry_index)
+        self.slot_bits.append(bit)
+        return len(self.slot_entries) - 1
+
+    def _add_key(self, entry_index: int, bit: int, key: str, case_sensitive: Optional[bool],
+                 match_whole_words: Optional[bool]):
+        """登记一个关键词，bit为0表示主关键词"""
+        if not key:
+            return
+        slot = self._new_slot(entry_index, bit)
+
+        regex_key = parse_regex_key(key)
+        if regex_key:
+            source, flags = regex_key
+            pattern = _compile_regex_key(source, flags)
+            if _BACKREFERENCE.search(source) or not self._can_combine(pattern):
+                self._standalone.append((slot, pattern))
+            else:
+                self._regex_slots.append(slot)
+                self._regex_patterns.append(pattern)
+            return
+
+        if DEFAULT_CASE_SENSITIVE if case_sensitive is None else case_sensitive:
+            by_length, slots = self._exact_by_length, self._exact_slots
+        else:
+            key = _fold(key)
+            by_length, slots = self._folded_by_length, self._folded_slots
+        by_length.setdefault(len(key), set()).add(key)
+        slots.setdefault(key, []).append(slot)
+
+        whole_words = DEFAULT_MATCH_WHOLE_WORDS if match_whole_words is None else match_whole_words
+        if whole_words and not any(c.isspace() for c in key):
+            self._whole_word_slots.add(slot)
+
+    @staticmethod
+    def _can_combine(pattern: re.Pattern) -> bool:
+        """检查正则能否放进合并的交替式，例如不在开头的全局内联标志(?i)就不行"""
+        try:
+            re.compile(f"(?=(?P<_wbk0>{pattern.pattern}))")
+            return True
+        except re.error:
+            return False
+
+    def _compile_regex(self):
+        """把正则关键词合并成一个零宽前瞻交替式，每个位置只需尝试一次"""
+        if not self._regex_slots:
+            return
+        parts = []
+        for alternative, pattern in enumerate(self._regex_patterns):
+            parts.append(f"(?P<_wbk{alternative}>{pattern.pattern})")
+        try:
+            combined = re.compile("(?=" + "|".join(parts) + ")")
+        except re.error:
+            # 例如用户正则里自带了同名分组，退回逐个匹配
+            self._standalone.extend(zip(self._regex_slots, self._regex_patterns))
+            self._regex_slots, self._regex_patterns = [], []
+            return
+        self._combined = combined
+        self._group_alternatives = {
+            combined.groupindex[f"_wbk{alternative}"]: alternative
+            for alternative in range(len(self._regex_patterns))
+        }
+
+    def _scan_literals(self, text: str, by_length: Dict[int, Set[str]], slots: Dict[str, List[int]],
+                       hits: Set[int]):
+        """对每种关键词长度取一次文本的全部子串，与关键词集合求交集"""
+        n = len(text)
+        for length, keys in by_length.items():
+            if length > n:
+                continue
+            grams = {text[i:i + length] for i in range(n - length + 1)}
+            for key in grams & keys:
+                for slot in slots[key]:
+                    if slot in self._whole_word_slots:
+                        if not _compile_whole_word(key).search(text):
+                            continue
+                    hits.add(slot)
+
+    def _scan_regex(self, text: str, hits: Set[int]):
+        """一次扫描合并的正则；同一位置只会报告第一个命中的分支，被遮挡的分支在这些位置上补查"""
+        positions: List[Tuple[int, int]] = []
+        found = set()
+        for match in self._combined.finditer(text):
+            alternative = self._group_alternatives.get(match.lastindex)
+            if alternative is None:
+                continue
+            positions.append((match.start(), alternative))
+            found.add(alternative)
+
+        for alternative, pattern in enumerate(self._regex_patterns):
+            if alternative in found:
+                continue
+            # 该分支能匹配的位置上必然有更靠前的分支先命中
+            for position, earlier in positions:
+                if earlier < alternative and pattern.match(text, position):
+                    found.add(alternative)
+                    break
+
+        hits.update(self._regex_slots[alternative] for alternative in found)
+
+    def match_slots(self, text: str) -> Set[int]:
+        """返回文本命中的关键词槽"""
+        hits: Set[int] = set()
+        if not text:
+            return hits
+        if self._exact_by_length:
+            self._scan_literals(text, self._exact_by_length, self._exact_slots, hits)
+        if self._folded_by_length:
+            self._scan_literals(_fold(text), self._folded_by_length, self._folded_slots, hits)
+        if self._combined is not None:
+            self._scan_regex(text, hits)
+        for slot, pattern in self._standalone:
+            if pattern.search(text):
+                hits.add(slot)
+        return hits
+
+    def match(self, text: str) -> List[int]:
+        """返回被文本激活的条目下标，按下标排序"""
+        # 一次扫描的结果同时填充主关键词命中集合和每个条目的次要关键词位集
+        primary: Set[int] = set()
+        secondary: Dict[int, int] = {}
+        slot_entries, slot_bits = self.slot_entries, self.slot_bits
+        for slot in self.match_slots(text):
+            index = slot_entries[slot]
+            bit = slot_bits[slot]
+            if bit:
+                secondary[index] = secondary.get(index, 0) | bit
+            else:
+                primary.add(index)
+
+        activated = []
+        for index in primary:
+            rule = self._selective.get(index)
+            if rule is None or selective_passes(rule[0], secondary.get(index, 0), rule[1]):
+                activated.append(index)
+        return sorted(activated)
@@ -0,0 +1,153 @@
+import json
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple
+from .atomic_file import atomic_write
+
+_WHITESPACE = ' \t\n\r'
+
+class LorebookFormatError(ValueError):
+    """世界书文件不是SillyTavern的格式"""
+
+class LorebookReader:
+    """流式读取SillyTavern世界书JSON：按块读文件，entries中的条目逐个解码后交出，
+    不需要先把整个文件解析成一棵大字典
+
+    用法：
+        reader = LorebookReader(path)
+        for entry_key, entry_data in reader:
+            ...
+        reader.meta  # 读完后包含entries以外的顶层字段
+    """
+
+    CHUNK_SIZE = 1 << 16
+
+    def __init__(self, path: str):
+        self.path = path
+        self.meta: Dict[str, Any] = {}  # entries以外的顶层字段
+        self._decoder = json.JSONDecoder()
+        self._file = None
+        self._buffer = ''
+        self._pos = 0
+        self._eof = False
+
+    def __iter__(self) -> Iterator[Tuple[str, Any]]:
+        with open(self.path, 'r', encoding='utf-8-sig') as f:
+            self._file = f
+            self._buffer, self._pos, self._eof = '', 0, False
+            try:
+                yield from self._read_book()
+            finally:
+                self._file = None
+
+    def _fill(self) -> bool:
+        """再读一块文件内容，已读过的部分丢弃；文件读完时返回False"""
+        if self._eof:
+            return False
+        chunk = self._file.read(self.CHUNK_SIZE)
+        if not chunk:
+            self._eof = True
+            return False
+        self._buffer = self._buffer[self._pos:] + chunk
+        self._pos = 0
+        return True
+
+    def _peek(self) -> str:
+        """跳过空白，返回下一个字符；文件结束时返回空串"""
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos] in _WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                return ''
+
+    def _expect(self, chars: str) -> str:
+        char = self._peek()
+        if not char or char not in chars:
+            raise LorebookFormatError(f"应为 {' 或 '.join(chars)}，实际为 {char or '文件结尾'}")
+        self._pos += 1
+        return char
+
+    def _value(self) -> Any:
+        """解码下一个完整的JSON值，缓冲区不够时继续读文件"""
+        self._peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+                # 数字等值可能被块边界截断，后面还有字符才能确认已经完整
+                if end < len(self._buffer) or self._eof:
+                    self._pos = end
+                    return value
+            except json.JSONDecodeError as e:
+                if self._eof:
+                    raise LorebookFormatError(f"JSON解析失败: {e}") from e
+            self._fill()
+
+    def _members(self, closing: str, keyed: bool) -> Iterator[str]:
+        """逐个交出对象的键或数组的下标，由调用方接着读取成员的值；调用前已消费开括号"""
+        index = 0
+        if self._peek() == closing:
+            self._pos += 1
+            return
+        while True:
+            if keyed:
+                key = self._value()
+                if not isinstance(key, str):
+                    raise LorebookFormatError("对象的键必须是字符串")
+                self._expect(':')
+            else:
+                key = str(index)
+            yield key
+            index += 1
+            if self._expect(',' + closing) == closing:
+                return
+
+    def _read_book(self) -> Iterator[Tuple[str, Any]]:
+        self._expect('{')
+        found = False
+        for name in self._members('}', keyed=True):
+            if name != 'entries':
+                self.meta[name] = self._value()
+                continue
+            found = True
+            # SillyTavern导出的是以UID为键的对象，也兼容条目数组
+            opening = self._expect('{[')
+            closing, keyed = ('}', True) if opening == '{' else (']', False)
+            for entry_key in self._members(closing, keyed):
+                yield entry_key, self._value()
+        if not found:
+            raise LorebookFormatError("缺少entries字段")
+
+def validate_entry(data: Any) -> Optional[str]:
+    """检查导入的条目能否转换为世界书条目，返回问题说明，没有问题时返回None"""
+    if not isinstance(data, dict):
+        return "条目不是对象"
+    if not isinstance(data.get('content', ''), str):
+        return "content必须是字符串"
+    for field in ('key', 'keysecondary'):
+        if not isinstance(data.get(field, []), (str, list)):
+            return f"{field}必须是字符串或列表"
+    if not isinstance(data.get('selectiveLogic', 0), int):
+        return "selectiveLogic必须是整数"
+    return None
+
+def write_lorebook(path: str, meta: Dict[str, Any], entries: Iterable[Tuple[str, Dict[str, Any]]]) -> int:
+    """流式写出SillyTavern世界书：条目逐个序列化写入临时文件，完成后再替换目标文件
+
+    :return: 写出的条目数
+    """
+    count = 0
+    with atomic_write(path) as f:
+        f.write('{\n  "entries": {')
+        for entry_key, entry_data in entries:
+            f.write(',\n    ' if count else '\n    ')
+            f.write(json.dumps(str(entry_key), ensure_ascii=False))
+            f.write(': ')
+            f.write(json.dumps(entry_data, ensure_ascii=False))
+            count += 1
+        f.write('\n  }')
+        for name, value in meta.items():
+            if name == 'entries':
+                continue
+            f.write(f',\n  {json.dumps(name, ensure_ascii=False)}: {json.dumps(value, ensure_ascii=False)}')
+        f.write('\n}\n')
+    return count
@@ -0,0 +1,52 @@
+import os
+import struct
+import zlib
+from typing import BinaryIO, Iterable, Iterator, Optional, Tuple
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+TEXT_CHUNK_TYPES = (b'tEXt', b'zTXt', b'iTXt')  # 角色卡数据可能出现的文本块
+MAX_CHUNK_LENGTH = 0x7FFFFFFF  # PNG规范规定的块长度上限
+
+_HEADER = struct.Struct('>I4s')
+
+class PngChunkError(ValueError):
+    """PNG文件损坏或不是PNG"""
+
+def iter_png_chunks(f: BinaryIO, chunk_types: Optional[Iterable[bytes]] = TEXT_CHUNK_TYPES,
+                    verify_crc: bool = False) -> Iterator[Tuple[bytes, bytes]]:
+    """流式读取PNG的块，交出(块类型, 块数据)
+
+    只读取每个块的8字节头；不需要的块(包括体积最大的IDAT图像数据)直接seek跳过，不读入内存。
+    调用方找到需要的块后可以随时停止迭代，后面的内容不会再读。
+
+    :param f: 以二进制方式打开、可seek的文件
+    :param chunk_types: 需要读取数据的块类型，为None时读取所有块
+    :param verify_crc: 是否校验读取的块的CRC，跳过的块不校验
+    """
+    wanted = None if chunk_types is None else frozenset(chunk_types)
+    if f.read(len(PNG_SIGNATURE)) != PNG_SIGNATURE:
+        raise PngChunkError("不是有效的PNG文件")
+
+    while True:
+        header = f.read(_HEADER.size)
+        if not header:
+            return  # 缺少IEND，按已读到的内容处理
+        if len(header) < _HEADER.size:
+            raise PngChunkError("PNG块头不完整")
+        length, chunk_type = _HEADER.unpack(header)
+        if length > MAX_CHUNK_LENGTH:
+            raise PngChunkError(f"PNG块长度无效: {length}")
+
+        if chunk_type == b'IEND':
+            return
+        if wanted is not None and chunk_type not in wanted:
+            f.seek(length + 4, os.SEEK_CUR)  # 跳过数据和CRC
+            continue
+
+        data = f.read(length)
+        crc = f.read(4)
+        if len(data) < length or len(crc) < 4:
+            raise PngChunkError(f"PNG块 {chunk_type!r} 数据不完整")
+        if verify_crc and zlib.crc32(data, zlib.crc32(chunk_type)) != struct.unpack('>I', crc)[0]:
+            raise PngChunkError(f"PNG块 {chunk_type!r} CRC校验失败")
+        yield chunk_type, data
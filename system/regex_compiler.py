@@ -0,0 +1,388 @@
+import re
+import time
+from typing import Any, FrozenSet, List, Optional, Sequence, Tuple
+
+try:
+    from re import _parser as sre_parse
+    from re import _constants as sre_constants
+except ImportError:  # Python 3.10及更早版本
+    import sre_parse
+    import sre_constants
+
+_LITERAL = sre_constants.LITERAL
+_NOT_LITERAL = sre_constants.NOT_LITERAL
+_ANY = sre_constants.ANY
+_IN = sre_constants.IN
+_RANGE = sre_constants.RANGE
+_NEGATE = sre_constants.NEGATE
+_BRANCH = sre_constants.BRANCH
+_SUBPATTERN = sre_constants.SUBPATTERN
+_MAX_REPEAT = sre_constants.MAX_REPEAT
+_MIN_REPEAT = sre_constants.MIN_REPEAT
+_REPEATS = (_MAX_REPEAT, _MIN_REPEAT, getattr(sre_constants, 'POSSESSIVE_REPEAT', _MAX_REPEAT))
+_ATOMIC_GROUP = getattr(sre_constants, 'ATOMIC_GROUP', None)
+
+MAX_CLAUSE_ATOMS = 32  # 一个预筛选条件最多包含的候选字面量/字符数
+MAX_CLAUSES = 3  # 每条规则最多检查的预筛选条件数
+MAX_CLASS_CHARS = 256  # 字符类展开成字符集合的上限
+
+class CharSet:
+    """单个字符位置可以匹配的字符集合，negated为True时表示chars以外的所有字符"""
+    __slots__ = ('negated', 'chars')
+
+    def __init__(self, negated: bool, chars: FrozenSet[str]):
+        self.negated = negated
+        self.chars = chars
+
+    def disjoint(self, other: 'CharSet') -> bool:
+        """两个集合是否没有共同的字符"""
+        if self.negated and other.negated:
+            return False
+        if self.negated:
+            return other.chars <= self.chars
+        if other.negated:
+            return self.chars <= other.chars
+        return not (self.chars & other.chars)
+
+def item_char_set(op, av, dotall: bool) -> Optional[CharSet]:
+    """单字符项对应的字符集合，含\\d、\\w等类别时无法确定，返回None"""
+    if op is _LITERAL:
+        return CharSet(False, frozenset(chr(av)))
+    if op is _NOT_LITERAL:
+        return CharSet(True, frozenset(chr(av)))
+    if op is _ANY:
+        return CharSet(True, frozenset() if dotall else frozenset('\n'))
+    if op is _IN:
+        negated = False
+        chars = set()
+        for item_op, item_av in av:
+            if item_op is _NEGATE:
+                negated = True
+            elif item_op is _LITERAL:
+                chars.add(chr(item_av))
+            elif item_op is _RANGE and item_av[1] - item_av[0] < MAX_CLASS_CHARS:
+                chars.update(chr(c) for c in range(item_av[0], item_av[1] + 1))
+            else:
+                return None
+            if len(chars) > MAX_CLASS_CHARS:
+                return None
+        return CharSet(negated, frozenset(chars))
+    return None
+
+# ---------- 必需字面量 ----------
+
+def _clause_strength(clause: FrozenSet[str]) -> Tuple[int, int]:
+    """候选越少、最短的候选越长，预筛选越有效"""
+    return len(clause), -min(len(atom) for atom in clause)
+
+def _sequence_clauses(items, ignorecase: bool, dotall: bool) -> List[FrozenSet[str]]:
+    """计算一段序列的必需条件：每个条件是一组候选字符串，文本至少包含其中之一"""
+    clauses: List[FrozenSet[str]] = []
+    run: List[str] = []
+
+    def flush():
+        if run:
+            clauses.append(frozenset(["".join(run)]))
+            run.clear()
+
+    for op, av in items:
+        if op is _LITERAL and not ignorecase:
+            run.append(chr(av))
+            continue
+        flush()
+        if op is _IN and not ignorecase:
+            char_set = item_char_set(op, av, dotall)
+            if char_set is not None and not char_set.negated and 0 < len(char_set.chars) <= MAX_CLAUSE_ATOMS:
+                clauses.append(char_set.chars)
+        elif op is _SUBPATTERN:
+            _, add_flags, del_flags, body = av
+            group_ignorecase = (ignorecase or bool(add_flags & re.IGNORECASE)) and not del_flags & re.IGNORECASE
+            clauses.extend(_sequence_clauses(body, group_ignorecase, dotall))
+        elif op in _REPEATS:
+            low, _, body = av
+            if low >= 1:
+                clauses.extend(_sequence_clauses(body, ignorecase, dotall))
+        elif op is _ATOMIC_GROUP:
+            clauses.extend(_sequence_clauses(av, ignorecase, dotall))
+        elif op is _BRANCH:
+            clause = _branch_clause(av[1], ignorecase, dotall)
+            if clause:
+                clauses.append(clause)
+        # 断言、反向引用、任意字符等不产生必需条件
+    flush()
+    return clauses
+
+def _branch_clause(alternatives, ignorecase: bool, dotall: bool) -> Optional[FrozenSet[str]]:
+    """交替式的必需条件：每个分支取最强的一个条件再合并，任一分支没有条件时整体没有"""
+    atoms = set()
+    for alternative in alternatives:
+        clauses = _sequence_clauses(alternative, ignorecase, dotall)
+        if not clauses:
+            return None
+        atoms.update(min(clauses, key=_clause_strength))
+        if len(atoms) > MAX_CLAUSE_ATOMS:
+            return None
+    return frozenset(atoms)
+
+class RulePrefilter:
+    """规则的廉价预筛选：文本缺少任一必需条件时规则不可能匹配，可以跳过"""
+
+    def __init__(self, clauses: Sequence[FrozenSet[str]]):
+        strongest = sorted(clauses, key=_clause_strength)[:MAX_CLAUSES]
+        # 条件内按长度从长到短检查，长字面量更少出现
+        self.clauses: List[Tuple[str, ...]] = [
+            tuple(sorted(clause, key=lambda atom: (-len(atom), atom))) for clause in strongest
+        ]
+
+    def might_match(self, text: str) -> bool:
+        for clause in self.clauses:
+            for atom in clause:
+                if atom in text:
+                    break
+            else:
+                return False
+        return True
+
+# ---------- 可合并的删除规则 ----------
+
+def _sequence_start(items, dotall: bool) -> Optional[FrozenSet[str]]:
+    """判断一个序列是否"由前缀决定"，是则返回匹配首字符的集合
+
+    要求：以确定的字符开头和结尾，中间至多一个变长部分；懒惰重复后面紧跟确定字符，
+    贪婪重复的字符集与后面的字符不相交。这样匹配成功时引擎读到的字符都不超出匹配的结尾，
+    删除其他规则的匹配不会改变它的结果。
+    """
+    elements = []  # (是否变长, 字符集合, 是否贪婪)
+    for op, av in items:
+        if op in _REPEATS:
+            low, high, body = av
+            if len(body) != 1 or op is not _MAX_REPEAT and op is not _MIN_REPEAT:
+                return None
+            char_set = item_char_set(body[0][0], body[0][1], dotall)
+            if char_set is None:
+                return None
+            if low == high:
+                elements.extend([(False, char_set, False)] * low)
+            else:
+                elements.append((True, char_set, op is _MAX_REPEAT))
+        else:
+            char_set = item_char_set(op, av, dotall)
+            if char_set is None:
+                return None
+            elements.append((False, char_set, False))
+
+    if not elements or elements[0][0] or elements[0][1].negated or elements[-1][0]:
+        return None
+    if sum(1 for variable, _, _ in elements if variable) > 1:
+        return None
+    for i, (variable, char_set, greedy) in enumerate(elements):
+        if variable and greedy and not char_set.disjoint(elements[i + 1][1]):
+            return None
+    return elements[0][1].chars
+
+def fusable_start_chars(parsed, flags: int) -> Optional[FrozenSet[str]]:
+    """删除规则可以放进合并交替式时，返回其匹配可能的首字符集合，否则返回None"""
+    if flags & re.IGNORECASE:
+        return None
+    dotall = bool(flags & re.DOTALL)
+    items = list(parsed)
+    if len(items) == 1 and items[0][0] is _BRANCH:
+        # 顶层交替式要求各分支首字符互不相交，同一位置最多一个分支能开始匹配
+        starts: List[FrozenSet[str]] = []
+        for alternative in items[0][1][1]:
+            start = _sequence_start(alternative, dotall)
+            if start is None or any(start & other for other in starts):
+                return None
+            starts.append(start)
+        return frozenset().union(*starts)
+    return _sequence_start(items, dotall)
+
+def analyze_pattern(pattern: str, flags: int = re.DOTALL) -> Tuple[RulePrefilter, Optional[FrozenSet[str]]]:
+    """分析规则的正则，返回(预筛选, 可合并时的首字符集合)"""
+    try:
+        parsed = sre_parse.parse(pattern, flags)
+    except Exception:
+        return RulePrefilter([]), None
+    flags = parsed.state.flags
+    prefilter = RulePrefilter(_sequence_clauses(parsed, bool(flags & re.IGNORECASE), bool(flags & re.DOTALL)))
+    return prefilter, fusable_start_chars(parsed, flags)
+
+# ---------- 运行统计 ----------
+
+class RuleStats:
+    """一条规则(或一次合并扫描)的运行统计，耗时单位为秒"""
+    __slots__ = ('calls', 'skips', 'matches', 'chars', 'total_time', 'max_time')
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.calls = 0  # 实际执行正则的次数
+        self.skips = 0  # 被预筛选跳过的次数
+        self.matches = 0  # 累计匹配(替换)次数
+        self.chars = 0  # 累计处理的字符数
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def record(self, elapsed: float, chars: int, matches: int):
+        self.calls += 1
+        self.chars += chars
+        self.matches += matches
+        self.total_time += elapsed
+        if elapsed > self.max_time:
+            self.max_time = elapsed
+
+    def as_dict(self) -> dict:
+        return {
+            'calls': self.calls,
+            'skips': self.skips,
+            'matches': self.matches,
+            'chars': self.chars,
+            'total_ms': self.total_time * 1000,
+            'avg_ms': self.total_time * 1000 / self.calls if self.calls else 0.0,
+            'max_ms': self.max_time * 1000,
+        }
+
+# ---------- 编译后的流水线 ----------
+
+class CompiledRule:
+    """单条规则及其预筛选"""
+
+    def __init__(self, rule: Any, prefilter: RulePrefilter):
+        self.rule = rule
+        self.prefilter = prefilter
+
+    def apply(self, text: str) -> str:
+        if not self.prefilter.might_match(text):
+            self.rule.stats.skips += 1
+            return text
+        return self.rule.apply(text)
+
+def _char_class(chars: FrozenSet[str]) -> Optional[re.Pattern]:
+    if not chars:
+        return None
+    return re.compile("[" + "".join(re.escape(c) for c in sorted(chars)) + "]")
+
+class FusedRules:
+    """把相邻的若干删除规则合并成一次交替式扫描
+
+    各规则的首字符集合互不相交，由匹配的首字符即可确定是哪条规则，且匹配由前缀决定。
+    运行时再检查两点：每个合并匹配的内部不含其他规则的首字符，删除后的结果中不再含有任何首字符。
+    两点都满足时结果与逐条执行完全相同，否则退回逐条执行。
+
+    合并扫描的耗时记在stats中，并平均分摊到各成员规则的统计里；成员的匹配数按首字符归属计算。
+    """
+
+    def __init__(self, members: List[CompiledRule], member_starts: List[FrozenSet[str]], guard: Any = None):
+        self.members = members
+        self.name = "+".join(member.rule.name for member in members)
+        self.enabled = True  # 合并扫描多次超时后停用，改为逐条执行
+        self.guard = guard  # 限时执行器，为None时直接执行
+        # 交替式优先级最低，直接拼接等价于给每条规则加非捕获分组，且保留了首字符快速定位
+        self.regex = re.compile("|".join(member.rule.pattern for member in members), re.DOTALL)
+        all_starts = frozenset().union(*member_starts)
+        self.start_chars = tuple(sorted(all_starts))
+        self.owner = {char: index for index, starts in enumerate(member_starts) for char in starts}
+        self.foreign_starts = [_char_class(all_starts - starts) for starts in member_starts]
+        self.stats = RuleStats()
+        self.fallbacks = 0  # 合并扫描结果无法保证一致、改为逐条执行的次数
+
+    def _apply_fused(self, text: str) -> Optional[Tuple[str, List[int]]]:
+        """一次扫描删除所有成员的匹配，返回(结果, 各成员的匹配数)；无法保证与逐条执行一致时返回None"""
+        owner, foreign_starts = self.owner, self.foreign_starts
+        counts = [0] * len(self.members)
+        if self.guard is not None:
+            spans = self.guard.spans(self, self.regex, text)
+            if spans is None:
+                return None
+        else:
+            spans = [match.span() for match in self.regex.finditer(text)]
+        pieces = []
+        last = 0
+        for start, end in spans:
+            index = owner[text[start]]
+            foreign = foreign_starts[index]
+            if foreign is not None and foreign.search(text, start + 1, end):
+                return None
+            counts[index] += 1
+            pieces.append(text[last:start])
+            last = end
+        if pieces:
+            pieces.append(text[last:])
+            text = "".join(pieces)
+        # 残留的首字符说明某条规则在此处没有匹配，删除其他内容后它可能匹配，交给逐条执行
+        for char in self.start_chars:
+            if char in text:
+                return None
+        return text, counts
+
+    def apply(self, text: str) -> str:
+        if not any(member.prefilter.might_match(text) for member in self.members):
+            for member in self.members:
+                member.rule.stats.skips += 1
+            return text
+        if self.enabled and all(member.rule.enabled for member in self.members):
+            result = None
+            start = time.perf_counter()
+            try:
+                result = self._apply_fused(text)
+            except Exception as e:
+                print(f"合并正则替换失败: {e}")
+            elapsed = time.perf_counter() - start
+            if result is not None:
+                fused_text, counts = result
+                self.stats.record(elapsed, len(text), sum(counts))
+                share = elapsed / len(self.members)
+                for member, count in zip(self.members, counts):
+                    member.rule.stats.record(share, len(text), count)
+                return fused_text
+            self.stats.record(elapsed, len(text), 0)
+            self.fallbacks += 1
+        for member in self.members:
+            text = member.apply(text)
+        return text
+
+class RulePipeline:
+    """按顺序执行的规则流水线，输出与逐条调用RegexRule.apply相同"""
+
+    def __init__(self, rules: Sequence[Any], guard: Any = None):
+        """
+        :param rules: 按执行顺序排列的RegexRule
+        :param guard: RegexGuard，合并扫描需要限时执行时传入
+        """
+        self.stages: List[Any] = []
+        fused_guard = guard if guard is not None and guard.protects(False) else None
+        pending: List[CompiledRule] = []
+        pending_starts: List[FrozenSet[str]] = []
+
+        def flush():
+            nonlocal pending, pending_starts
+            if len(pending) > 1:
+                try:
+                    self.stages.append(FusedRules(pending, pending_starts, fused_guard))
+                except re.error:
+                    self.stages.extend(pending)
+            else:
+                self.stages.extend(pending)
+            pending, pending_starts = [], []
+
+        for rule in rules:
+            if not rule.enabled:
+                continue
+            prefilter, start_chars = analyze_pattern(rule.pattern, rule.regex.flags)
+            compiled = CompiledRule(rule, prefilter)
+            if rule.replace == '' and not rule.count and start_chars:
+                if any(start_chars & starts for starts in pending_starts):
+                    # 与当前组的首字符冲突，另起一组
+                    flush()
+                pending.append(compiled)
+                pending_starts.append(start_chars)
+                continue
+            flush()
+            self.stages.append(compiled)
+        flush()
+
+    def run(self, text: str) -> str:
+        for stage in self.stages:
+            text = stage.apply(text)
+        return text
@@ -0,0 +1,306 @@
+import re
+import threading
+import multiprocessing
+from typing import Any, Dict, List, Optional, Tuple
+
+from .regex_compiler import (
+    sre_parse, item_char_set,
+    _BRANCH, _SUBPATTERN, _REPEATS, _ATOMIC_GROUP,
+)
+
+try:
+    import regex as regex_module  # 第三方regex模块原生支持超时
+except ImportError:  # 没有时改用子进程执行，超时后结束子进程
+    regex_module = None
+
+GUARD_ALL = "all"  # 所有规则限时执行
+GUARD_RISKY = "risky"  # 只对检查出回溯风险的规则限时执行
+GUARD_OFF = "off"  # 不限时，与旧版行为相同
+
+WORKER_STARTUP_TIMEOUT = 5  # 等待子进程就绪的秒数，不计入规则的时间预算
+
+class RegexTimeout(Exception):
+    """正则执行超出时间预算"""
+
+class WorkerUnavailable(RuntimeError):
+    """正则子进程无法启动"""
+
+# ---------- 加载时检查 ----------
+
+def _is_variable(op, av) -> bool:
+    return op in _REPEATS and av[0] != av[1]
+
+def _contains_variable_repeat(items) -> bool:
+    for op, av in items:
+        if _is_variable(op, av):
+            return True
+        if op is _SUBPATTERN and _contains_variable_repeat(av[3]):
+            return True
+        if op is _ATOMIC_GROUP and _contains_variable_repeat(av):
+            return True
+        # 含空分支的交替式相当于可选，例如(a|aa)会被解析成a(?:|a)
+        if op is _BRANCH and any(not alt or _contains_variable_repeat(alt) for alt in av[1]):
+            return True
+        if op in _REPEATS and _contains_variable_repeat(av[2]):
+            return True
+    return False
+
+def _first_char_set(items, dotall: bool):
+    """序列第一个字符的集合，无法确定时返回None"""
+    for op, av in items:
+        if op is _SUBPATTERN:
+            return _first_char_set(av[3], dotall)
+        if op in _REPEATS:
+            if av[0] == 0:
+                return None
+            return _first_char_set(av[2], dotall)
+        return item_char_set(op, av, dotall)
+    return None
+
+def _body_branches(body):
+    """量词内直接出现的交替式(包括被分组包住的)"""
+    for op, av in body:
+        if op is _BRANCH:
+            yield av[1]
+        elif op is _SUBPATTERN and len(av[3]) == 1 and av[3][0][0] is _BRANCH:
+            yield av[3][0][1][1]
+
+def _branches_overlap(alternatives, dotall: bool) -> bool:
+    """交替分支的首字符可能相同时，同一段文本有多种拆分方式"""
+    firsts = [_first_char_set(alternative, dotall) for alternative in alternatives]
+    if any(first is None for first in firsts):
+        return True
+    return any(
+        not firsts[x].disjoint(firsts[y])
+        for x in range(len(firsts)) for y in range(x + 1, len(firsts))
+    )
+
+def _lint_items(items, dotall: bool, warnings: List[str]):
+    items = list(items)
+    for i, (op, av) in enumerate(items):
+        if op in _REPEATS:
+            body = av[2]
+            if av[0] != av[1] and _contains_variable_repeat(body):
+                warnings.append("嵌套量词，例如(a+)+")
+            if av[0] != av[1] and any(_branches_overlap(alternatives, dotall) for alternatives in _body_branches(body)):
+                warnings.append("量词内的交替分支可能重叠，例如(ab|a.)*")
+            # 相邻两个可变量词的字符集重叠，例如\s*\s*或.*.*，回溯是多项式级的
+            if av[0] != av[1] and len(body) == 1 and i + 1 < len(items):
+                next_op, next_av = items[i + 1]
+                if _is_variable(next_op, next_av) and len(next_av[2]) == 1:
+                    first = item_char_set(body[0][0], body[0][1], dotall)
+                    second = item_char_set(next_av[2][0][0], next_av[2][0][1], dotall)
+                    if first is None or second is None or not first.disjoint(second):
+                        warnings.append("相邻的量词匹配的字符重叠，例如.*.*")
+            _lint_items(body, dotall, warnings)
+        elif op is _SUBPATTERN:
+            _lint_items(av[3], dotall, warnings)
+        elif op is _ATOMIC_GROUP:
+            _lint_items(av, dotall, warnings)
+        elif op is _BRANCH:
+            for alternative in av[1]:
+                _lint_items(alternative, dotall, warnings)
+
+def lint_pattern(pattern: str, flags: int = re.DOTALL) -> List[str]:
+    """检查正则中容易引发灾难性回溯的写法，返回问题说明(去重)"""
+    try:
+        parsed = sre_parse.parse(pattern, flags)
+    except Exception:
+        return []
+    warnings: List[str] = []
+    _lint_items(parsed, bool(parsed.state.flags & re.DOTALL), warnings)
+    return list(dict.fromkeys(warnings))
+
+# ---------- 子进程执行 ----------
+
+def _worker_main(conn):
+    """子进程：循环接收(类型, 正则, 标志, 替换, 替换次数, 文本)并返回结果"""
+    compiled: Dict[Tuple[str, int], re.Pattern] = {}
+    conn.send("ready")
+    while True:
+        try:
+            kind, pattern, flags, replace, count, text = conn.recv()
+        except (EOFError, OSError):
+            return
+        try:
+            regex = compiled.get((pattern, flags))
+            if regex is None:
+                regex = compiled[(pattern, flags)] = re.compile(pattern, flags)
+            if kind == "subn":
+                result = regex.subn(replace, text, count=count)
+            else:
+                result = [match.span() for match in regex.finditer(text)]
+            conn.send((True, result))
+        except Exception as e:
+            conn.send((False, str(e)))
+
+class _RegexWorker:
+    """常驻的正则子进程，超时后直接结束并重新启动"""
+
+    def __init__(self):
+        self._process = None
+        self._conn = None
+        self._ready = False
+
+    def start(self):
+        """提前启动子进程，不等待就绪；已经在运行时什么都不做"""
+        if self._process is None or not self._process.is_alive():
+            self._start()
+
+    def _start(self):
+        context = multiprocessing.get_context()
+        parent_conn, child_conn = context.Pipe()
+        process = context.Process(target=_worker_main, args=(child_conn,), daemon=True, name="regex-guard")
+        try:
+            process.start()
+        except Exception as e:
+            parent_conn.close()
+            child_conn.close()
+            raise WorkerUnavailable(f"正则子进程启动失败: {e}") from e
+        child_conn.close()
+        self._process, self._conn, self._ready = process, parent_conn, False
+
+    def _wait_ready(self):
+        if not self._conn.poll(WORKER_STARTUP_TIMEOUT):
+            self.close()
+            raise WorkerUnavailable("正则子进程启动超时")
+        self._conn.recv()
+        self._ready = True
+
+    def run(self, task: Tuple, timeout: float) -> Any:
+        self.start()
+        if not self._ready:
+            self._wait_ready()
+        self._conn.send(task)
+        if not self._conn.poll(timeout):
+            # 回溯失控的子进程无法中断，只能结束；提前启动替补，下次调用时已经就绪
+            self.close()
+            self._start()
+            raise RegexTimeout()
+        ok, result = self._conn.recv()
+        if not ok:
+            raise re.error(result)
+        return result
+
+    def close(self):
+        if self._process is not None:
+            if self._process.is_alive():
+                self._process.kill()
+            self._process.join(1)
+            self._conn.close()
+        self._process, self._conn, self._ready = None, None, False
+
+# ---------- 限时执行 ----------
+
+class RegexGuard:
+    """按时间预算执行正则，超时的规则跳过本次替换并记一次超时，次数达到上限后自动禁用
+
+    子进程无法启动时需要限时执行的规则都会被跳过，不会退回到不限时执行。
+    """
+
+    def __init__(self, mode: str = GUARD_RISKY, timeout_ms: int = 200, max_timeouts: int = 3):
+        """
+        :param mode: all/risky/off，见GUARD_*
+        :param timeout_ms: 单条规则单次执行的时间上限
+        :param max_timeouts: 累计超时达到该次数后禁用规则
+        """
+        if mode not in (GUARD_ALL, GUARD_RISKY, GUARD_OFF):
+            print(f"未知的正则保护模式 {mode}，使用 {GUARD_RISKY}")
+            mode = GUARD_RISKY
+        self.mode = mode
+        self.timeout = max(timeout_ms, 1) / 1000
+        self.max_timeouts = max_timeouts
+        self.timeouts: Dict[str, int] = {}  # 规则名 -> 累计超时次数
+        self.backend = "regex" if regex_module is not None else "process"
+        self._regex_compiled: Dict[Tuple[str, int], Any] = {}
+        self._worker = _RegexWorker() if self.backend == "process" and mode != GUARD_OFF else None
+        self._worker_failed = False  # 子进程无法启动后不再重试
+        self._lock = threading.Lock()
+
+    def prepare(self):
+        """有规则需要限时执行时在加载阶段调用，提前启动子进程，第一次执行规则时不必等待子进程启动"""
+        if self.backend != "process" or self.mode == GUARD_OFF:
+            return
+        with self._lock:
+            if self._worker_failed:
+                return
+            try:
+                self._worker.start()
+            except WorkerUnavailable as e:
+                self._worker_unavailable(str(e))
+
+    def _worker_unavailable(self, reason: str):
+        """子进程无法启动，只提示一次；之后需要限时执行的规则直接跳过，不会不限时执行"""
+        print(f"{reason}，本次运行中需要限时执行的正则规则将被跳过；安装regex模块(pip install regex)可以避免使用子进程")
+        self._worker_failed = True
+        if self._worker is not None:
+            self._worker.close()
+
+    def protects(self, risky: bool) -> bool:
+        """规则是否需要限时执行"""
+        return self.mode == GUARD_ALL or (self.mode == GUARD_RISKY and risky)
+
+    def _regex_module_pattern(self, pattern: re.Pattern):
+        key = (pattern.pattern, pattern.flags)
+        if key not in self._regex_compiled:
+            try:
+                self._regex_compiled[key] = regex_module.compile(pattern.pattern, pattern.flags)
+            except Exception:
+                # regex模块不支持的写法退回子进程执行
+                self._regex_compiled[key] = None
+        return self._regex_compiled[key]
+
+    def _run(self, kind: str, pattern: re.Pattern, replace: str, text: str, count: int = 0) -> Any:
+        if self.backend == "regex":
+            compiled = self._regex_module_pattern(pattern)
+            if compiled is not None:
+                try:
+                    if kind == "subn":
+                        return compiled.subn(replace, text, count=count, timeout=self.timeout)
+                    return [match.span() for match in compiled.finditer(text, timeout=self.timeout)]
+                except TimeoutError:
+                    raise RegexTimeout()
+            if self._worker is None:
+                self._worker = _RegexWorker()
+        with self._lock:
+            if self._worker_failed:
+                raise WorkerUnavailable()
+            try:
+                return self._worker.run((kind, pattern.pattern, pattern.flags, replace, count, text), self.timeout)
+            except WorkerUnavailable as e:
+                self._worker_unavailable(str(e))
+                raise
+
+    def _record_timeout(self, owner: Any, text: str):
+        """记一次超时，达到上限时禁用规则"""
+        count = self.timeouts[owner.name] = self.timeouts.get(owner.name, 0) + 1
+        print(f"正则规则 [{owner.name}] 执行超过 {self.timeout * 1000:.0f}ms，已跳过 (文本长度 {len(text)}，第 {count} 次)")
+        if count >= self.max_timeouts and owner.enabled:
+            owner.enabled = False
+            print(f"正则规则 [{owner.name}] 超时 {count} 次，已自动禁用，请检查regex_rules.yaml中的写法")
+
+    def subn(self, rule: Any, text: str) -> Tuple[str, int]:
+        """限时执行规则的替换，返回(结果, 替换次数)，超时返回(原文, 0)"""
+        try:
+            result, count = self._run("subn", rule.regex, rule.replace, text, rule.count)
+            return result, count
+        except RegexTimeout:
+            self._record_timeout(rule, text)
+            return text, 0
+        except WorkerUnavailable:
+            return text, 0
+
+    def spans(self, owner: Any, pattern: re.Pattern, text: str) -> Optional[List[Tuple[int, int]]]:
+        """限时查找所有匹配的位置，超时返回None"""
+        try:
+            return self._run("spans", pattern, "", text)
+        except RegexTimeout:
+            self._record_timeout(owner, text)
+            return None
+        except WorkerUnavailable:
+            return None
+
+    def close(self):
+        """结束子进程"""
+        if self._worker is not None:
+            self._worker.close()
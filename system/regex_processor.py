@@ -1,18 +1,30 @@
+import os
 import re
+import time
+import yaml
 from typing import Dict, Optional, List, Tuple
+from .regex_compiler import RulePipeline, FusedRules, RuleStats
+from .regex_guard import RegexGuard, lint_pattern
+from .character_cache import CharacterFileCache
 
 class RegexRule:
-    def __init__(self, name: str, pattern: str, replace: str = '', enabled: bool = True, description: str = ''):
+    def __init__(self, name: str, pattern: str, replace: str = '', enabled: bool = True, description: str = '',
+                 count: int = 0):
         self.name = name
         self.pattern = pattern
         self.replace = replace
+        self.count = count  # 最多替换的次数，0表示全部替换
         self.enabled = enabled
         self.description = description
+        self.guard: Optional[RegexGuard] = None  # 需要限时执行时由RegexProcessor设置
+        self.lint_warnings: List[str] = []  # 可能引发灾难性回溯的写法
+        self.stats = RuleStats()  # 调用次数、匹配次数、耗时等运行统计
         self._compile()
         
     def _compile(self):
         try:
             self.regex = re.compile(self.pattern, re.DOTALL)
+            self.lint_warnings = lint_pattern(self.pattern, self.regex.flags)
         except re.error as e:
             print(f"正则表达式编译失败 [{self.name}]: {self.pattern}")
             print(f"错误信息: {e}")
@@ -21,47 +33,118 @@ class RegexRule:
     def apply(self, text: str) -> str:
         if not self.enabled:
             return text
+        start = time.perf_counter()
+        count = 0
+        chars = len(text)
         try:
-            return self.regex.sub(self.replace, text)
+            if self.guard is not None:
+                text, count = self.guard.subn(self, text)
+            else:
+                text, count = self.regex.subn(self.replace, text, count=self.count)
         except Exception as e:
             print(f"正则替换失败 [{self.name}]: {e}")
-            return text
+        finally:
+            self.stats.record(time.perf_counter() - start, chars, count)
+        return text
+
+def load_rules(rules_config: dict) -> Dict[str, RegexRule]:
+    """按regex_rules.yaml中rules的格式创建规则，保持配置中的顺序"""
+    rules: Dict[str, RegexRule] = {}
+    for name, rule_config in rules_config.items():
+        if isinstance(rule_config, str):
+            # 简单格式: "规则名: 正则表达式"
+            rules[name] = RegexRule(name, rule_config)
+        else:
+            # 详细格式: {pattern, replace, enabled, description, count}
+            rules[name] = RegexRule(
+                name=name,
+                pattern=rule_config['pattern'],
+                replace=rule_config.get('replace', ''),
+                enabled=rule_config.get('enabled', True),
+                description=rule_config.get('description', ''),
+                count=rule_config.get('count', 0)
+            )
+    return rules
+
+def guard_rules(rules: Dict[str, RegexRule], guard: RegexGuard):
+    """提示有回溯风险的写法，并给需要限时执行的规则设置执行器，同时提前启动限时执行用的子进程"""
+    for rule in rules.values():
+        if rule.lint_warnings:
+            print(f"正则规则 [{rule.name}] 可能引发灾难性回溯: {'；'.join(rule.lint_warnings)}")
+        if guard.protects(bool(rule.lint_warnings)):
+            rule.guard = guard
+            guard.prepare()
+
+class CharacterRuleSets(CharacterFileCache):
+    """角色卡自带的正则规则(juese/regex/角色名.yaml)，按角色编译成流水线缓存"""
+
+    def __init__(self, rules_dir: str, guard: RegexGuard):
+        super().__init__()
+        self.rules_dir = rules_dir
+        self.guard = guard
+
+    def file_path(self, character: str) -> str:
+        return os.path.join(self.rules_dir, f"{character}.yaml")
+
+    def _load(self, character: str, path: str) -> Optional[RulePipeline]:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                config = yaml.safe_load(f) or {}
+            rules = load_rules(config.get('rules') or {})
+        except Exception as e:
+            print(f"加载角色正则规则失败 {os.path.basename(path)}: {e}")
+            return None
+        guard_rules(rules, self.guard)
+        return RulePipeline(list(rules.values()), self.guard) if rules else None
 
 class RegexProcessor:
-    def __init__(self, config: dict, enabled: bool = True):
+    def __init__(self, config: dict, enabled: bool = True, character_rules_dir: Optional[str] = None):
+        """
+        :param config: regex_rules.yaml的内容
+        :param enabled: 是否启用正则处理
+        :param character_rules_dir: 角色正则规则目录，为None时不使用角色规则
+        """
         self.enabled = enabled
         self.show_processed = config.get('show_processed', True)
-        self.rules: Dict[str, RegexRule] = {}
-        self._load_rules(config.get('rules', {}))
+        self.rules: Dict[str, RegexRule] = load_rules(config.get('rules', {}))
+
+        # 用户编写的正则可能回溯失控，按配置限时执行
+        safety = config.get('safety') or {}
+        self.guard = RegexGuard(
+            mode=safety.get('mode', 'risky'),
+            timeout_ms=safety.get('timeout_ms', 200),
+            max_timeouts=safety.get('max_timeouts', 3)
+        )
+        guard_rules(self.rules, self.guard)
+
+        # 按规则顺序编译：预筛选跳过不可能匹配的规则，相邻的删除规则合并成一次扫描
+        self.pipeline = RulePipeline(list(self.rules.values()), self.guard)
+        self.character_rules = CharacterRuleSets(character_rules_dir, self.guard) if character_rules_dir else None
         
         # 状态块处理相关
         self.status_pattern = re.compile(r'<StatusBlock>(.*?)</StatusBlock>', re.DOTALL)
-        self.last_status: Dict[str, str] = {}  # 用于存储每个用户的最后一个状态块
+        self.status_stats = RuleStats()
+
+        # 运行统计每隔log_interval秒在处理消息时打印一次摘要，0表示不打印
+        stats_config = config.get('stats') or {}
+        self.stats_log_interval = stats_config.get('log_interval', 3600)
+        self._stats_logged_at = time.monotonic()
         
-    def _load_rules(self, rules_config: dict):
-        for name, rule_config in rules_config.items():
-            if isinstance(rule_config, str):
-                # 简单格式: "规则名: 正则表达式"
-                self.rules[name] = RegexRule(name, rule_config)
-            else:
-                # 详细格式: {pattern, replace, enabled, description}
-                self.rules[name] = RegexRule(
-                    name=name,
-                    pattern=rule_config['pattern'],
-                    replace=rule_config.get('replace', ''),
-                    enabled=rule_config.get('enabled', True),
-                    description=rule_config.get('description', '')
-                )
-                
     def process_text(self, text: str) -> str:
         """处理普通文本的正则替换"""
         if not self.enabled or not text:
             return text
             
-        result = text
-        for rule in self.rules.values():
-            result = rule.apply(result)
-        return result
+        text = self.pipeline.run(text)
+        self._maybe_log_stats()
+        return text
+        
+    def process_character_text(self, character: str, text: str) -> str:
+        """用角色卡自带的正则规则处理AI回复，角色没有规则时原样返回"""
+        if not self.enabled or not text or not character or self.character_rules is None:
+            return text
+        pipeline = self.character_rules.get(character)
+        return pipeline.run(text) if pipeline is not None else text
         
     def process_status_block(self, text: str, show_status: bool = False) -> Tuple[str, Optional[str]]:
         """
@@ -74,14 +157,18 @@ class RegexProcessor:
             return text, None
             
         # 查找状态块
+        start = time.perf_counter()
         match = self.status_pattern.search(text)
         if not match:
+            self.status_stats.record(time.perf_counter() - start, len(text), 0)
             return text, None
             
         status_content = match.group(1).strip()
         
         # 移除状态块
-        processed_text = self.status_pattern.sub('', text).strip()
+        processed_text, count = self.status_pattern.subn('', text)
+        processed_text = processed_text.strip()
+        self.status_stats.record(time.perf_counter() - start, len(text), count)
         
         if show_status:
             # 如果需要显示状态，返回状态块内容
@@ -90,14 +177,6 @@ class RegexProcessor:
             # 否则只返回处理后的文本
             return processed_text, None
             
-    def save_status(self, user_id: str, status_content: str):
-        """保存用户的最后一个状态块"""
-        self.last_status[user_id] = status_content
-        
-    def get_last_status(self, user_id: str) -> Optional[str]:
-        """获取用户的最后一个状态块"""
-        return self.last_status.get(user_id)
-        
     def get_rule_info(self, name: str) -> Optional[dict]:
         """获取规则详细信息"""
         rule = self.rules.get(name)
@@ -108,9 +187,81 @@ class RegexProcessor:
             'pattern': rule.pattern,
             'replace': rule.replace,
             'enabled': rule.enabled,
-            'description': rule.description
+            'description': rule.description,
+            'lint_warnings': rule.lint_warnings,
+            'timeouts': self.guard.timeouts.get(rule.name, 0),
+            'stats': rule.stats.as_dict()
         }
         
+    def get_stats(self) -> List[dict]:
+        """所有规则、合并扫描和状态块的运行统计，按累计耗时从高到低排序"""
+        stats = []
+        for rule in self.rules.values():
+            stats.append({'name': rule.name, 'enabled': rule.enabled, 'kind': 'rule', **rule.stats.as_dict()})
+        for stage in self.pipeline.stages:
+            if isinstance(stage, FusedRules):
+                stats.append({'name': stage.name, 'enabled': stage.enabled, 'kind': 'fused',
+                              'fallbacks': stage.fallbacks, **stage.stats.as_dict()})
+        stats.append({'name': '<StatusBlock>', 'enabled': True, 'kind': 'status', **self.status_stats.as_dict()})
+        stats.sort(key=lambda item: item['total_ms'], reverse=True)
+        return stats
+
+    def format_stats(self) -> str:
+        """运行统计的多行文本，每行一条规则"""
+        lines = []
+        for item in self.get_stats():
+            label = {'fused': '合并', 'status': '状态块'}.get(item['kind'], '规则')
+            line = (f"[{label}] {item['name']}: 执行{item['calls']}次 跳过{item['skips']}次 "
+                    f"匹配{item['matches']}次 平均{item['avg_ms']:.2f}ms 最长{item['max_ms']:.2f}ms "
+                    f"累计{item['total_ms']:.1f}ms 处理{item['chars']}字")
+            if item['kind'] == 'fused':
+                line += f" 退回逐条{item['fallbacks']}次"
+            if not item['enabled']:
+                line += " (已禁用)"
+            elif item['kind'] == 'rule' and item['calls'] + item['skips'] and not item['matches']:
+                line += " (从未匹配)"
+            lines.append(line)
+        return "\n".join(lines)
+
+    def stats_summary(self) -> str:
+        """一行运行统计摘要：总耗时、最慢的规则和从未匹配的规则"""
+        rules = list(self.rules.values())
+        total = sum(rule.stats.total_time for rule in rules) * 1000
+        calls = sum(rule.stats.calls for rule in rules)
+        summary = f"正则统计: 规则执行{calls}次 累计{total:.1f}ms"
+        slowest = max(rules, key=lambda rule: rule.stats.max_time, default=None)
+        if slowest is not None and slowest.stats.calls:
+            summary += f"，最慢 [{slowest.name}] {slowest.stats.max_time * 1000:.2f}ms"
+        unmatched = [rule.name for rule in rules
+                     if rule.enabled and rule.stats.calls + rule.stats.skips and not rule.stats.matches]
+        if unmatched:
+            summary += f"，从未匹配: {', '.join(unmatched)}"
+        return summary
+
+    def reset_stats(self):
+        """清零所有运行统计"""
+        for rule in self.rules.values():
+            rule.stats.reset()
+        for stage in self.pipeline.stages:
+            if isinstance(stage, FusedRules):
+                stage.stats.reset()
+                stage.fallbacks = 0
+        self.status_stats.reset()
+        self._stats_logged_at = time.monotonic()
+
+    def _maybe_log_stats(self):
+        """距离上次打印超过log_interval秒时打印一行统计摘要"""
+        if not self.stats_log_interval:
+            return
+        now = time.monotonic()
+        if now - self._stats_logged_at >= self.stats_log_interval:
+            self._stats_logged_at = now
+            print(self.stats_summary())
+
+    def close(self):
+        """释放限时执行使用的子进程"""
+        self.guard.close()
+
     def list_rules(self) -> List[dict]:
         """列出所有规则的详细信息"""
         return [self.get_rule_info(name) for name in self.rules] 
\ No newline at end of file
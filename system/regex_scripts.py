@@ -0,0 +1,87 @@
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+from .keyword_matcher import parse_regex_key
+
+# SillyTavern正则脚本的placement取值
+PLACEMENT_USER_INPUT = 1
+PLACEMENT_AI_OUTPUT = 2
+
+_FIND_REGEX = re.compile(r'^/(.+)/([a-z]*)$', re.DOTALL)
+# SillyTavern只处理{{match}}和$数字，其余字符按原样输出
+_REPLACE_TOKEN = re.compile(r'\{\{match\}\}|\$(\d+)', re.IGNORECASE)
+
+def get_regex_scripts(card: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """取角色卡中的正则脚本，兼容V2/V3卡的data.extensions和旧卡的顶层extensions"""
+    for source in (card.get('data'), card):
+        if isinstance(source, dict):
+            extensions = source.get('extensions')
+            if isinstance(extensions, dict) and isinstance(extensions.get('regex_scripts'), list):
+                return [script for script in extensions['regex_scripts'] if isinstance(script, dict)]
+    return []
+
+def convert_find_regex(find: str) -> Optional[Tuple[str, int]]:
+    """把JavaScript的 /pattern/flags 转换成RegexRule的写法，返回(正则, 替换次数)；无法转换时返回None
+
+    RegexRule固定使用DOTALL，没有s标志时用(?-s:...)关掉；没有g标志时只替换第一个匹配。
+    与SillyTavern一致，不带斜杠的字符串按没有标志的正则处理。
+    """
+    if not find:
+        return None
+    match = _FIND_REGEX.match(find)
+    if match is None:
+        find = f"/{find}/"
+        match = _FIND_REGEX.match(find)
+    parsed = parse_regex_key(find)
+    if parsed is None:
+        return None
+    source, flags = parsed
+    scoped = flags if 's' in flags else f"{flags}-s"
+    return f"(?{scoped}:{source})", 0 if 'g' in match.group(2) else 1
+
+def convert_replace_string(replace: str, groups: int) -> str:
+    """把SillyTavern的替换字符串转换成re.sub的写法：{{match}}即$0，不存在的分组替换为空"""
+    parts = []
+    last = 0
+    for token in _REPLACE_TOKEN.finditer(replace):
+        parts.append(replace[last:token.start()].replace('\\', '\\\\'))
+        number = int(token.group(1)) if token.group(1) is not None else 0
+        if number <= groups:
+            parts.append(f"\\g<{number}>")
+        last = token.end()
+    parts.append(replace[last:].replace('\\', '\\\\'))
+    return "".join(parts)
+
+def convert_regex_scripts(scripts: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """把作用于AI回复的正则脚本转换成regex_rules.yaml中rules的格式，按脚本顺序排列"""
+    rules: Dict[str, Dict[str, Any]] = {}
+    for index, script in enumerate(scripts, 1):
+        name = str(script.get('scriptName') or f"脚本{index}")
+        if PLACEMENT_AI_OUTPUT not in (script.get('placement') or []) or script.get('promptOnly'):
+            continue
+        if script.get('substituteRegex'):
+            # 正则中含有{{char}}等宏，需要运行时替换，暂不支持
+            print(f"跳过正则脚本 [{name}]: 不支持substituteRegex")
+            continue
+        converted = convert_find_regex(str(script.get('findRegex') or ''))
+        if converted is None:
+            print(f"跳过正则脚本 [{name}]: 无法转换 {script.get('findRegex')}")
+            continue
+        pattern, count = converted
+        rule: Dict[str, Any] = {
+            'pattern': pattern,
+            'replace': convert_replace_string(str(script.get('replaceString') or ''), re.compile(pattern).groups),
+            'enabled': not script.get('disabled', False),
+            'description': '由角色卡的正则脚本转换'
+        }
+        if count:
+            rule['count'] = count
+        if script.get('trimStrings'):
+            rule['description'] += '（trimStrings未转换）'
+        # 同名脚本加上序号区分
+        key, suffix = name, 2
+        while key in rules:
+            key = f"{name}_{suffix}"
+            suffix += 1
+        rules[key] = rule
+    return rules
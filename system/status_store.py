@@ -0,0 +1,115 @@
+import os
+import json
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from .atomic_file import atomic_write
+
+class StatusStore:
+    """按会话保存角色回复中的最新状态块
+
+    每个会话(用户+角色)的状态写在角色目录下的status.json，重启后仍然可用；
+    内存中用LRU缓存最近访问的会话，条目数不超过cache_size。
+    history_limit大于0时，每次状态变化还会记录一条增量(删除和新增的行)，最多保留这么多条。
+    """
+
+    FILE_NAME = "status.json"
+
+    def __init__(self, cache_size: int = 256, history_limit: int = 0):
+        """
+        :param cache_size: 内存中最多缓存的会话数
+        :param history_limit: 每个会话保留的状态变化记录数，0表示不记录
+        """
+        self.cache_size = max(cache_size, 1)
+        self.history_limit = max(history_limit, 0)
+        self._cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()  # 角色目录 -> 状态记录
+        self._lock = threading.Lock()
+
+    def _file_path(self, character_path: str) -> str:
+        return os.path.join(character_path, self.FILE_NAME)
+
+    def _read(self, character_path: str) -> Dict[str, Any]:
+        """从磁盘读取状态记录，文件不存在或损坏时返回空记录"""
+        path = self._file_path(character_path)
+        if os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    record = json.load(f)
+                if isinstance(record, dict):
+                    return record
+            except Exception as e:
+                print(f"读取状态记录失败: {e}")
+        # 没有记录也缓存下来，之后的查询不再访问磁盘
+        return {'latest': None, 'history': []}
+
+    def _write(self, character_path: str, record: Dict[str, Any]):
+        """写入临时文件后替换，避免写到一半时留下损坏的文件"""
+        try:
+            os.makedirs(character_path, exist_ok=True)
+            with atomic_write(self._file_path(character_path)) as f:
+                json.dump(record, f, ensure_ascii=False, indent=2)
+        except Exception as e:
+            print(f"保存状态记录失败: {e}")
+
+    def _record(self, character_path: str) -> Dict[str, Any]:
+        """取会话的状态记录，需要在持有锁时调用"""
+        key = os.path.normpath(character_path)
+        record = self._cache.get(key)
+        if record is None:
+            record = self._read(character_path)
+            self._cache[key] = record
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        else:
+            self._cache.move_to_end(key)
+        return record
+
+    @staticmethod
+    def _delta(old: Optional[str], new: str) -> Dict[str, List[str]]:
+        """按行计算两次状态的差异"""
+        old_lines = old.splitlines() if old else []
+        new_lines = new.splitlines()
+        old_set, new_set = set(old_lines), set(new_lines)
+        return {
+            'removed': [line for line in old_lines if line not in new_set],
+            'added': [line for line in new_lines if line not in old_set]
+        }
+
+    def get(self, character_path: str) -> Optional[str]:
+        """获取会话的最新状态块"""
+        with self._lock:
+            return self._record(character_path).get('latest')
+
+    def get_history(self, character_path: str) -> List[Dict[str, Any]]:
+        """获取会话的状态变化记录，从旧到新"""
+        with self._lock:
+            return list(self._record(character_path).get('history') or [])
+
+    def save(self, character_path: str, content: str):
+        """保存会话的最新状态块，内容没有变化时不写磁盘"""
+        with self._lock:
+            record = self._record(character_path)
+            previous = record.get('latest')
+            if content == previous:
+                return
+            record['latest'] = content
+            record['updated'] = datetime.now().isoformat()
+            if self.history_limit:
+                history = record.setdefault('history', [])
+                history.append({'time': record['updated'], **self._delta(previous, content)})
+                del history[:-self.history_limit]
+            self._write(character_path, record)
+
+    def clear(self, character_path: str):
+        """清空会话的状态记录"""
+        with self._lock:
+            record = self._record(character_path)
+            record.clear()
+            record.update({'latest': None, 'history': []})
+            path = self._file_path(character_path)
+            if os.path.exists(path):
+                try:
+                    os.remove(path)
+                except Exception as e:
+                    print(f"删除状态记录失败: {e}")
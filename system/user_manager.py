@@ -1,12 +1,19 @@
 import os
-import yaml
-from typing import List
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from .user_state import UserStateStore
+
+DEFAULT_PRESET = "我是我，你可以根据对话来识别我的性格、年龄和性别。"
+DEFAULT_CHARACTER = "default"
 
 class UserManager:
-    def __init__(self, base_path: str):
+    def __init__(self, base_path: str, cache_size: int = 1024, state_store: Optional[UserStateStore] = None):
         """
         初始化用户管理器
         :param base_path: 插件根目录路径
+        :param cache_size: 内存中最多缓存状态的用户数，最久未使用的用户先被移出
+        :param state_store: 用户状态库，为None时打开users/state.db
         """
         self.base_path = base_path
         self.users_path = os.path.join(base_path, "users")
@@ -14,6 +21,12 @@ class UserManager:
         self.user_characters = {}  # 用户当前使用的角色
         self.user_presets = {}     # 用户预设
         self.debug_mode = False
+        self.cache_size = max(cache_size, 1)
+        # (用户ID, 是否群聊) -> {'character': 角色名, 'preset': 预设}，字段第一次读取时才从文件加载
+        self._state_cache: "OrderedDict[Tuple[str, bool], Dict[str, Any]]" = OrderedDict()
+        self._created_dirs = set()  # 已经确认存在的目录，不再重复调用makedirs
+        self.state_store = state_store or UserStateStore(self.users_path)
+        self._warm_cache()
         
     def _ensure_directories(self):
         """确保必要的目录结构存在"""
@@ -23,87 +36,86 @@ class UserManager:
         # 创建群聊和私聊目录
         os.makedirs(os.path.join(self.users_path, "group"), exist_ok=True)
         os.makedirs(os.path.join(self.users_path, "person"), exist_ok=True)
+
+    def _ensure_dir(self, path: str) -> str:
+        """目录不存在时创建，每个目录只检查一次"""
+        if path not in self._created_dirs:
+            os.makedirs(path, exist_ok=True)
+            self._created_dirs.add(path)
+        return path
+
+    def _user_dir(self, user_id: str, is_group: bool = False) -> str:
+        """用户目录路径，不创建目录"""
+        return os.path.join(self.users_path, self._scope(is_group), str(user_id))
         
     def get_user_path(self, user_id: str, is_group: bool = False) -> str:
         """获取用户目录路径"""
-        base = "group" if is_group else "person"
-        user_path = os.path.join(self.users_path, base, str(user_id))
-        os.makedirs(user_path, exist_ok=True)
-        return user_path
+        return self._ensure_dir(self._user_dir(user_id, is_group))
         
     def get_character_path(self, user_id: str, character_name: str, is_group: bool = False) -> str:
         """获取角色目录路径"""
-        user_path = self.get_user_path(user_id, is_group)
-        character_path = os.path.join(user_path, "characters", character_name)
-        os.makedirs(character_path, exist_ok=True)
-        return character_path
+        character_path = os.path.join(self._user_dir(user_id, is_group), "characters", character_name)
+        return self._ensure_dir(character_path)
+
+    @staticmethod
+    def _scope(is_group: bool) -> str:
+        return "group" if is_group else "person"
 
-    def get_user_preset_path(self, user_id: str, is_group: bool) -> str:
-        """获取用户预设文件路径"""
-        user_path = self.get_user_path(user_id, is_group)
-        return os.path.join(user_path, "preset.yaml")
+    def _state_from_record(self, record: Dict[str, Any], is_group: bool) -> Dict[str, Any]:
+        """从状态库的一行中取出私聊或群聊的角色和预设"""
+        scope = self._scope(is_group)
+        character = record.get(f"{scope}_character")
+        preset = record.get(f"{scope}_preset")
+        return {
+            'character': DEFAULT_CHARACTER if character is None else character,
+            'preset': DEFAULT_PRESET if preset is None else preset
+        }
 
-    def get_user_character_path(self, user_id: str, is_group: bool) -> str:
-        """获取用户当前角色配置文件路径"""
-        user_path = self.get_user_path(user_id, is_group)
-        return os.path.join(user_path, "character.yaml")
+    def _warm_cache(self):
+        """启动时一次读出最近活跃的用户，填充缓存"""
+        for user_id, record in reversed(list(self.state_store.recent(self.cache_size // 2 or 1).items())):
+            for is_group in (False, True):
+                self._state_cache[(user_id, is_group)] = self._state_from_record(record, is_group)
+
+    def _cached_state(self, user_id: str, is_group: bool) -> Dict[str, Any]:
+        """取用户的缓存记录并标记为最近使用，不在缓存中时从状态库读取，超出cache_size时移出最久未使用的用户"""
+        key = (str(user_id), bool(is_group))
+        state = self._state_cache.get(key)
+        if state is None:
+            state = self._state_cache[key] = self._state_from_record(self.state_store.get(user_id), is_group)
+            if len(self._state_cache) > self.cache_size:
+                self._state_cache.popitem(last=False)
+        else:
+            self._state_cache.move_to_end(key)
+        return state
 
     def get_user_preset(self, user_id: str, is_group: bool) -> str:
         """获取用户预设内容，如果不存在则返回默认预设"""
-        preset_path = self.get_user_preset_path(user_id, is_group)
-        
-        # 默认预设
-        default_preset = "我是我，你可以根据对话来识别我的性格、年龄和性别。"
-        
-        if not os.path.exists(preset_path):
-            return default_preset
-        
-        try:
-            with open(preset_path, 'r', encoding='utf-8') as f:
-                preset = yaml.safe_load(f)
-                return preset.get('description', default_preset)
-        except Exception as e:
-            print(f"读取用户预设失败: {e}")
-            return default_preset
+        return self._cached_state(user_id, is_group)['preset']
 
     def save_user_preset(self, user_id: str, is_group: bool, preset: str):
-        """保存用户预设"""
-        preset_path = self.get_user_preset_path(user_id, is_group)
-        
+        """保存用户预设，同时更新缓存和状态库"""
         try:
-            with open(preset_path, 'w', encoding='utf-8') as f:
-                yaml.dump({'description': preset}, f, allow_unicode=True)
-            return True
+            self.state_store.update(user_id, **{f"{self._scope(is_group)}_preset": preset})
         except Exception as e:
             print(f"保存用户预设失败: {e}")
             return False
+        self._cached_state(user_id, is_group)['preset'] = preset
+        return True
 
     def save_user_character(self, user_id: str, character_name: str, is_group: bool = False):
-        """保存用户选择的角色"""
-        char_path = self.get_user_character_path(user_id, is_group)
-        
+        """保存用户选择的角色，同时更新缓存和状态库"""
         try:
-            with open(char_path, 'w', encoding='utf-8') as f:
-                yaml.dump({'character': character_name}, f, allow_unicode=True)
-            return True
+            self.state_store.update(user_id, **{f"{self._scope(is_group)}_character": character_name})
         except Exception as e:
             print(f"保存用户角色选择失败: {e}")
             return False
+        self._cached_state(user_id, is_group)['character'] = character_name
+        return True
 
     def get_user_character(self, user_id: str, is_group: bool = False) -> str:
         """获取用户当前选择的角色名称"""
-        char_path = self.get_user_character_path(user_id, is_group)
-        
-        if not os.path.exists(char_path):
-            return "default"
-            
-        try:
-            with open(char_path, 'r', encoding='utf-8') as f:
-                data = yaml.safe_load(f)
-                return data.get('character', 'default')
-        except Exception as e:
-            print(f"读取用户角色选择失败: {e}")
-            return "default"
+        return self._cached_state(user_id, is_group)['character']
 
     def debug_print(self, *args, **kwargs):
         """调试信息打印函数"""
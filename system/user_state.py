@@ -0,0 +1,256 @@
+import os
+import time
+import sqlite3
+import threading
+import yaml
+from typing import Any, Dict, Iterator, List, Optional, Set
+
+# 每个用户一行；私聊和群聊各自选择的角色和预设分开保存，其余是插件运行中的会话状态
+FIELDS = (
+    'person_character', 'person_preset', 'group_character', 'group_preset',
+    'enabled', 'started', 'selecting', 'page'
+)
+FLAG_FIELDS = ('enabled', 'started', 'selecting')
+SCHEMA_VERSION = 1
+
+class UserStateStore:
+    """所有用户状态集中存放在users/state.db(SQLite)，以QQ号为主键，查询一个用户只需一次索引读取
+
+    写入先记在内存中，flush_delay秒内的修改合并成一个事务写入；读取时优先返回尚未写入的修改。
+    数据库第一次创建时从users目录下原有的character.yaml、preset.yaml和current_character.txt导入。
+    """
+
+    FILE_NAME = "state.db"
+
+    def __init__(self, users_path: str, flush_delay: float = 1.0):
+        """
+        :param users_path: users目录，数据库和需要导入的旧文件都在其中
+        :param flush_delay: 修改后最多等待多少秒写入数据库，0表示立即写入
+        """
+        self.users_path = users_path
+        self.flush_delay = max(flush_delay, 0)
+        self._lock = threading.RLock()
+        self._pending: Dict[str, Dict[str, Any]] = {}  # QQ号 -> 尚未写入的字段
+        self._timer: Optional[threading.Timer] = None
+        os.makedirs(users_path, exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(users_path, self.FILE_NAME), check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS users ("
+            "user_id TEXT PRIMARY KEY, "
+            "person_character TEXT, person_preset TEXT, group_character TEXT, group_preset TEXT, "
+            "enabled INTEGER NOT NULL DEFAULT 0, started INTEGER NOT NULL DEFAULT 0, "
+            "selecting INTEGER NOT NULL DEFAULT 0, page INTEGER, "
+            "updated REAL NOT NULL DEFAULT 0)"
+        )
+        if self._conn.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+            self._migrate_legacy_files()
+            self._conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        self._conn.commit()
+
+    def _migrate_legacy_files(self):
+        """导入users/person和users/group下每个用户原有的状态文件，旧文件保留不动"""
+        imported: Dict[str, Dict[str, Any]] = {}
+        for scope in ('person', 'group'):
+            scope_dir = os.path.join(self.users_path, scope)
+            if not os.path.isdir(scope_dir):
+                continue
+            for user_id in os.listdir(scope_dir):
+                user_dir = os.path.join(scope_dir, user_id)
+                if not os.path.isdir(user_dir):
+                    continue
+                record = imported.setdefault(user_id, {})
+                character = self._read_legacy_yaml(os.path.join(user_dir, "character.yaml"), 'character')
+                if character is None:
+                    # 更早版本只记录了一个角色名
+                    character = self._read_legacy_text(os.path.join(user_dir, "current_character.txt"))
+                preset = self._read_legacy_yaml(os.path.join(user_dir, "preset.yaml"), 'description')
+                if character is not None:
+                    record[f"{scope}_character"] = character
+                if preset is not None:
+                    record[f"{scope}_preset"] = preset
+        imported = {user_id: record for user_id, record in imported.items() if record}
+        if imported:
+            self._write(imported)
+            print(f"已将 {len(imported)} 个用户的状态导入 {self.FILE_NAME}")
+
+    @staticmethod
+    def _read_legacy_yaml(path: str, field: str) -> Optional[str]:
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                value = (yaml.safe_load(f) or {}).get(field)
+            return str(value) if value is not None else None
+        except Exception as e:
+            print(f"导入用户状态失败 {path}: {e}")
+            return None
+
+    @staticmethod
+    def _read_legacy_text(path: str) -> Optional[str]:
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return f.read().strip() or None
+        except Exception as e:
+            print(f"导入用户状态失败 {path}: {e}")
+            return None
+
+    def _write(self, changes: Dict[str, Dict[str, Any]]):
+        """在一个事务中写入多个用户的修改，需要在持有锁时调用"""
+        now = time.time()
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO users (user_id) VALUES (?)",
+                [(user_id,) for user_id in changes]
+            )
+            for user_id, fields in changes.items():
+                assignments = ", ".join(f"{field} = ?" for field in fields)
+                self._conn.execute(
+                    f"UPDATE users SET {assignments}, updated = ? WHERE user_id = ?",
+                    (*fields.values(), now, user_id)
+                )
+
+    def flush(self):
+        """把尚未写入的修改写入数据库"""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not self._pending:
+                return
+            pending, self._pending = self._pending, {}
+            try:
+                self._write(pending)
+            except sqlite3.Error as e:
+                print(f"保存用户状态失败: {e}")
+                # 放回去等下次写入，期间的新修改优先
+                for user_id, fields in pending.items():
+                    self._pending[user_id] = {**fields, **self._pending.get(user_id, {})}
+
+    def update(self, user_id: Any, **fields):
+        """修改用户的字段，在flush_delay秒内与其他修改一起写入"""
+        unknown = set(fields) - set(FIELDS)
+        if unknown:
+            raise ValueError(f"未知的用户状态字段: {', '.join(sorted(unknown))}")
+        with self._lock:
+            self._pending.setdefault(str(user_id), {}).update(fields)
+            if self.flush_delay == 0:
+                self.flush()
+            elif self._timer is None:
+                self._timer = threading.Timer(self.flush_delay, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def get(self, user_id: Any) -> Dict[str, Any]:
+        """读取用户的全部字段，用户不存在时各字段为None"""
+        user_id = str(user_id)
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {', '.join(FIELDS)} FROM users WHERE user_id = ?", (user_id,)
+            ).fetchone()
+            record = dict(row) if row is not None else dict.fromkeys(FIELDS)
+            record.update(self._pending.get(user_id, {}))
+            return record
+
+    def recent(self, limit: int) -> Dict[str, Dict[str, Any]]:
+        """一次读出最近有修改的limit个用户，用于启动时预热缓存"""
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT user_id, {', '.join(FIELDS)} FROM users ORDER BY updated DESC LIMIT ?", (limit,)
+            ).fetchall()
+            records = {row['user_id']: {field: row[field] for field in FIELDS} for row in rows}
+            for user_id, fields in self._pending.items():
+                if user_id in records:
+                    records[user_id].update(fields)
+            return records
+
+    def values(self, field: str) -> Dict[str, Any]:
+        """一次读出所有用户中该字段不为空(标志字段为真)的值"""
+        if field not in FIELDS:
+            raise ValueError(f"未知的用户状态字段: {field}")
+        with self._lock:
+            values = {
+                user_id: value for user_id, value in
+                self._conn.execute(f"SELECT user_id, {field} FROM users WHERE {field}")
+            }
+            for user_id, fields in self._pending.items():
+                if field in fields:
+                    if fields[field]:
+                        values[user_id] = fields[field]
+                    else:
+                        values.pop(user_id, None)
+            return values
+
+    def close(self):
+        """写入剩余的修改并关闭数据库"""
+        with self._lock:
+            self.flush()
+            self._conn.close()
+
+class UserFlagSet:
+    """用户状态库中的一个标志字段，用法与原来的enabled_users等set相同
+
+    启动时一次读出所有标志为真的用户，之后的判断只查内存，修改同时写回状态库。
+    """
+
+    def __init__(self, store: UserStateStore, field: str):
+        if field not in FLAG_FIELDS:
+            raise ValueError(f"不是标志字段: {field}")
+        self._store = store
+        self._field = field
+        self._members: Set[str] = set(store.values(field))
+
+    def __contains__(self, user_id: Any) -> bool:
+        return str(user_id) in self._members
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(list(self._members))
+
+    def __len__(self) -> int:
+        return len(self._members)
+
+    def add(self, user_id: Any):
+        if str(user_id) not in self._members:
+            self._members.add(str(user_id))
+            self._store.update(user_id, **{self._field: 1})
+
+    def discard(self, user_id: Any):
+        if str(user_id) in self._members:
+            self._members.discard(str(user_id))
+            self._store.update(user_id, **{self._field: 0})
+
+    def remove(self, user_id: Any):
+        if str(user_id) not in self._members:
+            raise KeyError(user_id)
+        self.discard(user_id)
+
+class UserPageMap:
+    """用户当前查看的角色列表页码，用法与原来的current_page字典相同"""
+
+    def __init__(self, store: UserStateStore):
+        self._store = store
+        self._pages: Dict[str, int] = dict(store.values('page'))
+
+    def __contains__(self, user_id: Any) -> bool:
+        return str(user_id) in self._pages
+
+    def __getitem__(self, user_id: Any) -> int:
+        return self._pages[str(user_id)]
+
+    def __setitem__(self, user_id: Any, page: int):
+        if self._pages.get(str(user_id)) != page:
+            self._pages[str(user_id)] = page
+            self._store.update(user_id, page=page)
+
+    def __delitem__(self, user_id: Any):
+        del self._pages[str(user_id)]
+        self._store.update(user_id, page=None)
+
+    def get(self, user_id: Any, default: Optional[int] = None) -> Optional[int]:
+        return self._pages.get(str(user_id), default)
+
+    def keys(self) -> List[str]:
+        return list(self._pages)
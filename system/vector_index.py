@@ -0,0 +1,82 @@
+import math
+import zlib
+from collections import Counter
+from typing import Dict, List, Sequence, Tuple, Any
+
+try:
+    import numpy as np
+except ImportError:  # numpy不可用时向量激活整体关闭
+    np = None
+
+def is_available() -> bool:
+    """检查向量激活所需的numpy是否可用"""
+    return np is not None
+
+class HashedNgramEncoder:
+    """把文本编码成哈希字符n-gram向量，不需要模型也不需要联网"""
+
+    def __init__(self, dim: int = 4096, ngram_sizes: Sequence[int] = (1, 2)):
+        """
+        :param dim: 向量维度，n-gram哈希后对其取模
+        :param ngram_sizes: 使用的字符n-gram长度，中文按字切分天然适合字符n-gram
+        """
+        self.dim = dim
+        self.ngram_sizes = tuple(ngram_sizes)
+
+    def _ngrams(self, text: str):
+        """生成文本的字符n-gram，先统一大小写并压缩空白"""
+        text = " ".join(text.casefold().split())
+        for n in self.ngram_sizes:
+            for i in range(len(text) - n + 1):
+                yield text[i:i + n]
+
+    def _features(self, text: str) -> Dict[int, float]:
+        """计算带符号的哈希特征，词频做对数缩放"""
+        counts = Counter()
+        for gram in self._ngrams(text):
+            # crc32在不同进程间稳定，不受PYTHONHASHSEED影响
+            h = zlib.crc32(gram.encode('utf-8'))
+            counts[(h % self.dim, 1.0 if h & 0x80000000 else -1.0)] += 1
+        features: Dict[int, float] = {}
+        for (index, sign), count in counts.items():
+            features[index] = features.get(index, 0.0) + sign * (1.0 + math.log(count))
+        return features
+
+    def encode(self, text: str):
+        """编码单条文本为L2归一化的向量"""
+        vector = np.zeros(self.dim, dtype=np.float32)
+        features = self._features(text)
+        if features:
+            vector[list(features.keys())] = list(features.values())
+            norm = float(np.linalg.norm(vector))
+            if norm > 0:
+                vector /= norm
+        return vector
+
+    def encode_many(self, texts: Sequence[str]):
+        """编码多条文本为一个矩阵，每行一条"""
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            matrix[row] = self.encode(text)
+        return matrix
+
+class VectorBookIndex:
+    """单本世界书中标记为vectorized的条目的向量矩阵"""
+
+    def __init__(self, encoder: HashedNgramEncoder, entries: List[Any]):
+        """
+        :param encoder: 编码器，查询时必须使用同一个
+        :param entries: 需要向量激活的条目，矩阵的行与之一一对应
+        """
+        self.encoder = encoder
+        self.entries = entries
+        self.matrix = encoder.encode_many([entry.content for entry in entries])
+
+    def search(self, query_vector, threshold: float) -> List[Tuple[Any, float]]:
+        """返回与查询向量余弦相似度不低于阈值的条目及其得分"""
+        if not self.entries:
+            return []
+        # 行向量和查询向量都已归一化，矩阵乘积即余弦相似度
+        scores = self.matrix @ query_vector
+        hits = np.nonzero(scores >= threshold)[0]
+        return [(self.entries[i], float(scores[i])) for i in hits]
@@ -1,16 +1,91 @@
 import os
+import re
+import sys
 import json
-from typing import List, Dict, Any, Tuple
+import pickle
+from typing import List, Dict, Any, Tuple, Optional
 from pkg.provider.entities import Message
 import math
+from . import vector_index
+from .keyword_matcher import KeywordMatcher, key_matches, selective_passes
+from .lorebook_io import LorebookReader, validate_entry, write_lorebook
+from .character_cache import CharacterFileCache
+from .atomic_file import atomic_write
+
+# 磁盘缓存的格式版本，条目或匹配器的结构变化时递增，使旧缓存全部失效
+CACHE_FORMAT_VERSION = 1
+
+# SillyTavern条目字段的默认值，所有条目共享这一份，条目自身只保存与默认值不同的字段
+ENTRY_DEFAULTS: Dict[str, Any] = {
+    'uid': 0,
+    'key': [],
+    'keysecondary': [],
+    'comment': '',
+    'content': '',
+    'constant': False,
+    'vectorized': False,
+    'selective': True,
+    'selectiveLogic': 0,
+    'addMemo': True,
+    'order': 100,
+    'position': 4,
+    'disable': False,
+    'excludeRecursion': False,
+    'preventRecursion': False,
+    'delayUntilRecursion': False,
+    'probability': 100,
+    'useProbability': True,
+    'depth': 4,
+    'group': '',
+    'groupOverride': False,
+    'groupWeight': 100,
+    'scanDepth': None,
+    'caseSensitive': None,
+    'matchWholeWords': None,
+    'useGroupScoring': None,
+    'automationId': '',
+    'role': 0,
+    'sticky': 0,
+    'cooldown': 0,
+    'delay': 0,
+    'displayIndex': 0
+}
+
+# 由WorldBookEntry属性直接表示的字段，其余字段作为额外字段保存
+_MODELED_FIELDS = frozenset({
+    'uid', 'key', 'keysecondary', 'comment', 'content', 'constant', 'vectorized',
+    'selective', 'selectiveLogic', 'disable',
+    'order', 'probability', 'depth', 'group', 'caseSensitive', 'matchWholeWords', 'displayIndex'
+})
+
+_MISSING = object()
+
+# 粗略的token估算：中日韩字符各算一个，连续的字母数字算一个，其余符号各算一个
+_TOKEN_PATTERN = re.compile(r'[\u3040-\u30ff\u3400-\u9fff\uac00-\ud7af]|[A-Za-z0-9_]+|[^\sA-Za-z0-9_]')
+
+def estimate_tokens(text: str) -> int:
+    """估算文本的token数"""
+    return len(_TOKEN_PATTERN.findall(text))
 
 class WorldBookEntry:
+    # 大型世界书动辄上万条目，用__slots__去掉每个实例的__dict__
+    __slots__ = (
+        'uid', 'comment', 'content', 'constant', 'vectorized', 'key', 'keysecondary',
+        'selective', 'selective_logic', 'enabled',
+        'order', 'probability', 'depth', 'group', 'case_sensitive', 'match_whole_words',
+        'source_file', 'source_key', '_extra'
+    )
+
     def __init__(self, data: Dict[str, Any]):
         self.uid = data.get('uid', 0)
         self.comment = data.get('comment', '')
         self.content = data.get('content', '')
         self.constant = data.get('constant', False)
+        self.vectorized = bool(data.get('vectorized', False))  # 是否通过向量相似度激活
         self.key = self._parse_keys(data.get('key', []))  # 处理关键词列表
+        self.keysecondary = self._parse_keys(data.get('keysecondary', []))  # 次要关键词
+        self.selective = data.get('selective', True)  # 是否启用次要关键词逻辑
+        self.selective_logic = data.get('selectiveLogic', 0)  # 次要关键词逻辑，见keyword_matcher
         self.enabled = not data.get('disable', False)  # 从disable字段转换
         
         # 保存其他可能有用的字段
@@ -18,30 +93,55 @@ class WorldBookEntry:
         self.probability = data.get('probability', 100)
         self.depth = data.get('depth', 4)
         self.group = data.get('group', '')
-        
-    def _parse_keys(self, keys) -> List[str]:
-        """处理关键词列表，支持字符串和列表格式"""
+        self.case_sensitive = data.get('caseSensitive')  # None表示使用默认设置
+        self.match_whole_words = data.get('matchWholeWords')  # None表示使用默认设置
+
+        # 来源信息，由处理器在加载时填写，用于只回写条目所在的文件
+        self.source_file = None
+        self.source_key = None
+
+        # 与默认值不同的其他字段，回写时原样保留；大多数条目没有，存为None
+        extra = {
+            k: v for k, v in data.items()
+            if k not in _MODELED_FIELDS and ENTRY_DEFAULTS.get(k, _MISSING) != v
+        }
+        display_index = data.get('displayIndex', self.uid)
+        if display_index != self.uid:
+            extra['displayIndex'] = display_index
+        self._extra = extra or None
+
+    def _parse_keys(self, keys) -> Tuple[str, ...]:
+        """处理关键词列表，支持字符串和列表格式，关键词字符串做驻留以共享内存"""
         if isinstance(keys, str):
             # 如果是字符串，按逗号分割
-            return [k.strip() for k in keys.split('，') if k.strip()]
+            return tuple(sys.intern(k.strip()) for k in keys.split('，') if k.strip())
         elif isinstance(keys, list):
             # 如果是列表，处理每个元素
             result = []
             for key in keys:
                 if isinstance(key, str):
                     # 如果元素是字符串，按逗号分割
-                    result.extend([k.strip() for k in key.split('，') if k.strip()])
+                    result.extend(sys.intern(k.strip()) for k in key.split('，') if k.strip())
                 else:
                     # 其他类型直接转字符串
-                    result.append(str(key))
-            return result
-        return []
+                    result.append(sys.intern(str(key)))
+            return tuple(result)
+        return ()
 
     def matches_keywords(self, text: str) -> bool:
-        """检查文本是否包含任何关键词"""
+        """检查文本是否包含任何关键词，支持/正则/、大小写和整词设置；处理器用KeywordMatcher批量匹配"""
         if not self.enabled:  # 如果条目被禁用，不匹配关键词
             return False
-        return any(keyword in text for keyword in self.key)
+        if not any(key_matches(keyword, text, self.case_sensitive, self.match_whole_words) for keyword in self.key):
+            return False
+        if not (self.selective and self.keysecondary):
+            return True
+        # 主关键词命中后再按selectiveLogic检查次要关键词
+        hit_bits = 0
+        for position, keyword in enumerate(self.keysecondary):
+            if key_matches(keyword, text, self.case_sensitive, self.match_whole_words):
+                hit_bits |= 1 << position
+        return selective_passes(self.selective_logic, hit_bits, (1 << len(self.keysecondary)) - 1)
 
     def get_display_info(self, show_keywords: bool = False) -> str:
         """获取显示信息"""
@@ -52,48 +152,59 @@ class WorldBookEntry:
 
     def to_dict(self) -> Dict[str, Any]:
         """转换为字典格式，保持原始格式"""
-        return {
-            'uid': self.uid,
-            'key': self.key,
-            'keysecondary': [],  # 保持原格式
-            'comment': self.comment,
-            'content': self.content,
-            'constant': self.constant,
-            'vectorized': False,
-            'selective': True,
-            'selectiveLogic': 0,
-            'addMemo': True,
-            'order': self.order,
-            'position': 4,
-            'disable': not self.enabled,
-            'excludeRecursion': False,
-            'preventRecursion': False,
-            'delayUntilRecursion': False,
-            'probability': self.probability,
-            'useProbability': True,
-            'depth': self.depth,
-            'group': self.group,
-            'groupOverride': False,
-            'groupWeight': 100,
-            'scanDepth': None,
-            'caseSensitive': None,
-            'matchWholeWords': None,
-            'useGroupScoring': None,
-            'automationId': '',
-            'role': 0,
-            'sticky': 0,
-            'cooldown': 0,
-            'delay': 0,
-            'displayIndex': self.uid
-        }
+        data = dict(ENTRY_DEFAULTS)
+        data['displayIndex'] = self.uid
+        if self._extra:
+            data.update(self._extra)
+        data['uid'] = self.uid
+        data['key'] = list(self.key)
+        data['keysecondary'] = list(self.keysecondary)
+        data['selective'] = self.selective
+        data['selectiveLogic'] = self.selective_logic
+        data['comment'] = self.comment
+        data['content'] = self.content
+        data['constant'] = self.constant
+        data['vectorized'] = self.vectorized
+        data['disable'] = not self.enabled
+        data['order'] = self.order
+        data['probability'] = self.probability
+        data['depth'] = self.depth
+        data['group'] = self.group
+        data['caseSensitive'] = self.case_sensitive
+        data['matchWholeWords'] = self.match_whole_words
+        return data
 
 class WorldBookProcessor:
-    def __init__(self, plugin_dir: str):
-        """初始化世界书处理器"""
-        self.world_book_dir = os.path.join(plugin_dir, "shijieshu")  # 修正路径
+    def __init__(self, plugin_dir: str, world_book_dir: Optional[str] = None):
+        """初始化世界书处理器
+
+        :param plugin_dir: 插件目录，世界书在其下的shijieshu目录
+        :param world_book_dir: 直接指定世界书目录，用于角色卡自带的世界书
+        """
+        self.world_book_dir = world_book_dir or os.path.join(plugin_dir, "shijieshu")  # 修正路径
         self.entries: List[WorldBookEntry] = []
         self.ENTRIES_PER_PAGE = 30  # 每页显示的条目数
+        self.DEFAULT_BOOK_FILE = "世界书.json"  # 没有任何世界书文件时新条目写入的文件
+        self.VECTOR_THRESHOLD = 0.3  # 向量条目的余弦相似度激活阈值
+        self.VECTOR_SCAN_MESSAGES = 4  # 计算聊天向量时使用的最近消息条数
+        self.CACHE_DIR = ".cache"  # 世界书目录下存放解析结果和编译好的匹配器的目录
+        self.MATCHER_CACHE = "matcher"  # 匹配器缓存的文件名
+        self.IMPORT_DIR = "daoru"  # 世界书目录下等待导入的SillyTavern世界书
+        self.EXPORT_DIR = "daochu"  # 世界书目录下导出的世界书
         self.debug_mode = False
+        self._book_meta: Dict[str, Dict[str, Any]] = {}  # 文件名 -> 除entries外的字段
+        self._file_entries: Dict[str, List[WorldBookEntry]] = {}  # 文件名 -> 该文件的条目
+        self._dirty_files = set()  # 需要回写的文件
+        self._file_keys: Dict[str, Tuple] = {}  # 文件名 -> 缓存键(格式版本, 路径, mtime, 大小)
+        self._constant_entries: List[WorldBookEntry] = []  # 常开条目分区
+        self._keyword_entries: List[WorldBookEntry] = []  # 关键词条目分区
+        self._scan_entries: List[WorldBookEntry] = []  # 需要关键词扫描的条目(能按向量激活时排除向量条目)
+        self._keyword_matcher = KeywordMatcher([])  # 扫描条目的关键词编译结果
+        self._vector_encoder = vector_index.HashedNgramEncoder() if vector_index.is_available() else None
+        self._vector_indexes: Dict[str, vector_index.VectorBookIndex] = {}  # 文件名 -> 向量索引
+        self._vector_notice_shown = False
+        self._version = 0  # 条目每次变化都会递增，用于判断缓存是否失效
+        self._constant_block: Optional[Tuple[int, Tuple[str, ...], str, int]] = None  # (版本, 内容, 文本, token数)
         self._load_world_books()
 
     def debug_print(self, *args, **kwargs):
@@ -106,7 +217,7 @@ class WorldBookProcessor:
         self.debug_mode = debug
 
     def _load_world_books(self):
-        """加载所有世界书文件"""
+        """加载所有世界书文件，未变化的文件直接使用磁盘缓存"""
         if not os.path.exists(self.world_book_dir):
             os.makedirs(self.world_book_dir)
             print(f"创建世界书目录: {self.world_book_dir}")
@@ -114,83 +225,248 @@ class WorldBookProcessor:
 
         # 清空现有条目
         self.entries = []
+        self._book_meta = {}
+        self._file_entries = {}
+        self._file_keys = {}
+        self._dirty_files = set()
         
         # 遍历目录下的所有JSON文件
-        for filename in os.listdir(self.world_book_dir):
-            if filename.endswith('.json'):
-                file_path = os.path.join(self.world_book_dir, filename)
-                try:
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        data = json.load(f)
-                        if not isinstance(data, dict) or 'entries' not in data:
-                            print(f"无效的世界书格式 {filename}")
-                            continue
-                            
-                        entries_data = data['entries']
-                        self.debug_print(f"\n加载世界书: {filename}")
-                        self.debug_print(f"发现 {len(entries_data)} 条条目")
-                        
-                        # 处理每个条目
-                        for entry_id, entry_data in entries_data.items():
-                            try:
-                                entry = WorldBookEntry(entry_data)
-                                self.entries.append(entry)
-                            except Exception as e:
-                                print(f"处理条目失败 {filename}#{entry_id}: {e}")
-                                continue
-                                
-                except Exception as e:
-                    print(f"加载世界书 {filename} 失败: {e}")
+        for filename in sorted(os.listdir(self.world_book_dir)):
+            if not filename.endswith('.json'):
+                continue
+            file_path = os.path.join(self.world_book_dir, filename)
+            try:
+                cache_key = self._file_cache_key(file_path)
+            except OSError as e:
+                print(f"加载世界书 {filename} 失败: {e}")
+                continue
+
+            cached = self._read_cache(filename, cache_key)
+            if cached is not None:
+                meta, file_entries = cached['meta'], cached['entries']
+                self.debug_print(f"从缓存加载世界书: {filename} ({len(file_entries)} 条)")
+            else:
+                # 只重新解析发生变化的文件
+                parsed = self._parse_world_book(filename, file_path)
+                if parsed is None:
                     continue
+                meta, file_entries = parsed
+                self._write_cache(filename, cache_key, meta=meta, entries=file_entries)
+
+            self._book_meta[filename] = meta
+            self._file_entries[filename] = file_entries
+            self._file_keys[filename] = cache_key
+            self.entries.extend(file_entries)
 
         # 按UID排序
         self.entries.sort(key=lambda x: x.uid)
+
+        # 所有文件都未变化时，扫描条目的顺序与缓存时相同，编译好的匹配器可以直接使用
+        cached = self._read_cache(self.MATCHER_CACHE, self._matcher_cache_key())
+        self._rebuild_partitions(cached['matcher'] if cached is not None else None)
+        if cached is None:
+            self._write_matcher_cache()
         self.debug_print(f"\n总共加载了 {len(self.entries)} 条世界书条目")
 
-    def _save_world_books(self):
-        """保存世界书条目的更改到原始文件"""
+    def _parse_world_book(self, filename: str, file_path: str) -> Optional[Tuple[Dict[str, Any], List[WorldBookEntry]]]:
+        """解析单个世界书文件，返回(除条目外的字段, 条目列表)，格式无效时返回None"""
         try:
-            # 按文件名组织条目
-            entries_by_file = {}
-            
-            # 遍历目录下的所有JSON文件，读取它们的原始结构
-            for filename in os.listdir(self.world_book_dir):
-                if filename.endswith('.json'):
-                    file_path = os.path.join(self.world_book_dir, filename)
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        data = json.load(f)
-                        if isinstance(data, dict) and 'entries' in data:
-                            entries_by_file[filename] = data
-            
-            # 更新每个文件中的条目
-            for entry in self.entries:
-                # 查找该条目所在的文件
-                found = False
-                for filename, data in entries_by_file.items():
-                    if str(entry.uid) in data['entries']:
-                        # 更新条目
-                        data['entries'][str(entry.uid)] = entry.to_dict()
-                        found = True
-                        break
-                
-                if not found:
-                    # 如果是新条目，添加到第一个文件
-                    if entries_by_file:
-                        first_file = next(iter(entries_by_file))
-                        entries_by_file[first_file]['entries'][str(entry.uid)] = entry.to_dict()
-            
-            # 保存更改到文件
-            for filename, data in entries_by_file.items():
+            with open(file_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except Exception as e:
+            print(f"加载世界书 {filename} 失败: {e}")
+            return None
+        if not isinstance(data, dict) or 'entries' not in data:
+            print(f"无效的世界书格式 {filename}")
+            return None
+
+        entries_data = data['entries']
+        self.debug_print(f"\n加载世界书: {filename}")
+        self.debug_print(f"发现 {len(entries_data)} 条条目")
+
+        # 保存除条目外的其他字段，回写时原样保留
+        meta = {k: v for k, v in data.items() if k != 'entries'}
+        file_entries = []
+
+        # 处理每个条目
+        for entry_id, entry_data in entries_data.items():
+            try:
+                entry = WorldBookEntry(entry_data)
+                entry.source_file = filename
+                entry.source_key = entry_id
+                file_entries.append(entry)
+            except Exception as e:
+                print(f"处理条目失败 {filename}#{entry_id}: {e}")
+                continue
+        return meta, file_entries
+
+    def _file_cache_key(self, file_path: str) -> Tuple:
+        """世界书文件的缓存键，文件被修改后mtime或大小会变化"""
+        stat = os.stat(file_path)
+        return CACHE_FORMAT_VERSION, file_path, stat.st_mtime_ns, stat.st_size
+
+    def _matcher_cache_key(self) -> Tuple:
+        """匹配器的缓存键由全部世界书文件的缓存键组成"""
+        # 没有numpy时向量条目也参与关键词扫描，编译出的匹配器不同
+        vectors = self._vector_encoder is not None
+        return CACHE_FORMAT_VERSION, vectors, tuple(self._file_keys[name] for name in sorted(self._file_keys))
+
+    def _read_cache(self, name: str, cache_key: Tuple) -> Optional[Dict[str, Any]]:
+        """读取磁盘缓存，缓存不存在、损坏或键不一致时返回None"""
+        cache_path = os.path.join(self.world_book_dir, self.CACHE_DIR, f"{name}.pickle")
+        if not os.path.exists(cache_path):
+            return None
+        try:
+            with open(cache_path, 'rb') as f:
+                data = pickle.load(f)
+        except Exception as e:
+            self.debug_print(f"读取世界书缓存 {name} 失败: {e}")
+            return None
+        if not isinstance(data, dict) or data.get('key') != cache_key:
+            return None
+        return data
+
+    def _write_cache(self, name: str, cache_key: Tuple, **payload):
+        """写入磁盘缓存，失败时只影响下次启动的速度"""
+        cache_dir = os.path.join(self.world_book_dir, self.CACHE_DIR)
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            with atomic_write(os.path.join(cache_dir, f"{name}.pickle"), 'wb') as f:
+                pickle.dump({'key': cache_key, **payload}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            print(f"写入世界书缓存 {name} 失败: {e}")
+
+    def _write_matcher_cache(self):
+        """把当前编译好的匹配器与全部文件的缓存键一起写入磁盘"""
+        self._write_cache(self.MATCHER_CACHE, self._matcher_cache_key(), matcher=self._keyword_matcher)
+
+    def _rebuild_partitions(self, matcher: Optional[KeywordMatcher] = None):
+        """按常开/关键词预先划分条目，翻页和提示词构建时不再逐条过滤
+
+        :param matcher: 从缓存读取的匹配器，为None时重新编译
+        """
+        self._constant_entries = [entry for entry in self.entries if entry.constant]
+        self._keyword_entries = [entry for entry in self.entries if not entry.constant]
+        if self._vector_encoder is not None:
+            self._scan_entries = [entry for entry in self._keyword_entries if not entry.vectorized]
+        else:
+            # 没有numpy时向量条目无法按相似度激活，退回按关键词激活
+            self._scan_entries = self._keyword_entries
+        self._keyword_matcher = matcher if matcher is not None else KeywordMatcher(self._scan_entries)
+        self._build_vector_indexes()
+        self._bump_version()
+
+    def _build_vector_indexes(self):
+        """为每本世界书中的向量条目生成一个向量矩阵，向量条目没有变化的世界书沿用原来的矩阵"""
+        vector_entries: Dict[str, List[WorldBookEntry]] = {}
+        for entry in self._keyword_entries:
+            if entry.vectorized:
+                vector_entries.setdefault(entry.source_file, []).append(entry)
+
+        old_indexes, self._vector_indexes = self._vector_indexes, {}
+        if not vector_entries:
+            return
+        if self._vector_encoder is None:
+            if not self._vector_notice_shown:
+                print("未安装numpy，向量世界书条目改为按关键词激活")
+                self._vector_notice_shown = True
+            return
+        for filename, entries in vector_entries.items():
+            # 修改条目时会换成新的条目对象，条目对象都相同说明这本书的向量条目没有变化
+            old_index = old_indexes.get(filename)
+            if (old_index is not None and len(old_index.entries) == len(entries)
+                    and all(old is new for old, new in zip(old_index.entries, entries))):
+                self._vector_indexes[filename] = old_index
+                continue
+            self._vector_indexes[filename] = vector_index.VectorBookIndex(self._vector_encoder, entries)
+            self.debug_print(f"已为 {filename} 生成 {len(entries)} 条向量条目")
+
+    def _match_vector_entries(self, messages: List[Message]) -> List[WorldBookEntry]:
+        """用最近聊天的向量激活相似度达到阈值的向量条目"""
+        if not self._vector_indexes or not messages:
+            return []
+        recent_text = " ".join(msg.content for msg in messages[-self.VECTOR_SCAN_MESSAGES:])
+        query_vector = self._vector_encoder.encode(recent_text)
+
+        hits = []
+        for index in self._vector_indexes.values():
+            for entry, score in index.search(query_vector, self.VECTOR_THRESHOLD):
+                if entry.enabled:
+                    self.debug_print(f"向量激活条目 {entry.comment}: {score:.3f}")
+                    hits.append(entry)
+        hits.sort(key=lambda x: x.uid)
+        return hits
+
+    def _bump_version(self):
+        """条目发生变化，使依赖条目的缓存失效"""
+        self._version += 1
+
+    def _get_constant_block(self) -> Tuple[Tuple[str, ...], str, int]:
+        """获取常开条目块(内容列表, 拼接后的文本, token数)，只在条目变化后重新生成"""
+        cached = self._constant_block
+        if cached is None or cached[0] != self._version:
+            contents = tuple(entry.content for entry in self._constant_entries if entry.enabled)
+            text = "\n".join(contents)
+            cached = self._constant_block = (self._version, contents, text, estimate_tokens(text))
+            self.debug_print(f"重建常开世界书块: {len(contents)} 条, 约 {cached[3]} tokens")
+        return cached[1], cached[2], cached[3]
+
+    def get_constant_block(self) -> Tuple[str, int]:
+        """获取常开条目拼接后的文本和估算的token数"""
+        _, text, tokens = self._get_constant_block()
+        return text, tokens
+
+    def _mark_dirty(self, entry: WorldBookEntry):
+        """标记条目所在的文件需要回写"""
+        if entry.source_file is None:
+            # 新条目归入第一个世界书文件，没有文件时新建一个
+            filename = next(iter(self._file_entries), self.DEFAULT_BOOK_FILE)
+            if filename not in self._file_entries:
+                self._book_meta[filename] = {}
+                self._file_entries[filename] = []
+            entry.source_file = filename
+            entry.source_key = str(entry.uid)
+            self._file_entries[filename].append(entry)
+        self._dirty_files.add(entry.source_file)
+
+    def _write_json_atomic(self, file_path: str, data: Dict[str, Any]):
+        """先写临时文件再替换，避免写到一半时留下损坏的世界书"""
+        with atomic_write(file_path) as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+
+    def _save_world_books(self) -> bool:
+        """只把有改动的世界书文件回写到磁盘，全部写入成功时返回True
+
+        写入失败的文件留在待回写集合中，下次保存时重试
+        """
+        saved = False
+        try:
+            for filename in sorted(self._dirty_files):
+                data = dict(self._book_meta.get(filename, {}))
+                data['entries'] = {
+                    entry.source_key: entry.to_dict()
+                    for entry in self._file_entries.get(filename, [])
+                }
                 file_path = os.path.join(self.world_book_dir, filename)
-                with open(file_path, 'w', encoding='utf-8') as f:
-                    json.dump(data, f, ensure_ascii=False, indent=2)
-                    
-            self.debug_print(f"已保存世界书更改到原始文件")
+                self._write_json_atomic(file_path, data)
+                self.debug_print(f"已保存世界书更改: {filename}")
+
+                # 回写后文件的mtime已变化，同步更新缓存，下次启动不必重新解析
+                meta = self._book_meta.get(filename, {})
+                cache_key = self._file_keys[filename] = self._file_cache_key(file_path)
+                self._write_cache(filename, cache_key, meta=meta, entries=self._file_entries.get(filename, []))
+                self._dirty_files.discard(filename)
+                saved = True
+            return True
             
         except Exception as e:
             print(f"保存世界书失败: {e}")
             import traceback
             traceback.print_exc()
+            return False
+        finally:
+            if saved:
+                self._write_matcher_cache()
 
     def get_entries_by_type(self, constant: bool = True, page: int = 1) -> Tuple[List[WorldBookEntry], int]:
         """获取指定类型的条目
@@ -202,8 +478,8 @@ class WorldBookProcessor:
         Returns:
             Tuple[List[WorldBookEntry], int]: 条目列表和总页数
         """
-        # 过滤条目
-        filtered_entries = [entry for entry in self.entries if entry.constant == constant]
+        # 使用预先划分好的条目
+        filtered_entries = self._constant_entries if constant else self._keyword_entries
         
         # 计算总页数
         total_pages = math.ceil(len(filtered_entries) / self.ENTRIES_PER_PAGE)
@@ -218,54 +494,50 @@ class WorldBookProcessor:
         
         return current_page_entries, total_pages
 
+    def match_keyword_entries(self, text: str) -> List[WorldBookEntry]:
+        """返回被文本中的关键词激活的条目，按UID排序"""
+        # 匹配器包含禁用的条目，启用/禁用时不必重新编译
+        entries = self._scan_entries
+        return [entries[i] for i in self._keyword_matcher.match(text) if entries[i].enabled]
+
+    def match_entries(self, messages: List[Message]) -> List[WorldBookEntry]:
+        """返回被聊天记录激活的非常开条目：先关键词条目，再向量条目"""
+        if not messages:
+            return []
+        # 将所有消息内容合并成一个字符串
+        all_text = " ".join(msg.content for msg in messages)
+        return self.match_keyword_entries(all_text) + self._match_vector_entries(messages)
+
     def process_messages(self, messages: List[Message]) -> List[str]:
         """处理消息列表，返回应该插入的世界书内容"""
         inserted_contents = []
 
         # 首先添加所有constant为true且enabled为true的条目
-        constant_entries = [entry for entry in self.entries if entry.constant and entry.enabled]
-        inserted_contents.extend(entry.content for entry in constant_entries)
+        inserted_contents.extend(self._get_constant_block()[0])
 
-        # 然后检查关键词触发的条目
-        if messages:
-            # 将所有消息内容合并成一个字符串
-            all_text = " ".join(msg.content for msg in messages)
-            
-            # 检查每个非constant且enabled为true的条目
-            keyword_entries = [entry for entry in self.entries if not entry.constant and entry.enabled]
-            for entry in keyword_entries:
-                if entry.matches_keywords(all_text):
-                    inserted_contents.append(entry.content)
+        # 然后是关键词和向量激活的条目
+        inserted_contents.extend(entry.content for entry in self.match_entries(messages))
 
         return inserted_contents
 
-    def get_world_book_prompt(self, messages: List[Message]) -> List[Message]:
-        """获取世界书提示词"""
-        if not messages:
-            return []
+    def get_world_book_prompt(self, messages: List[Message], title: str = "# 世界设定") -> List[Message]:
+        """获取世界书提示词
 
-        # 将所有消息内容合并成一个字符串
-        all_text = " ".join(msg.content for msg in messages)
-        
-        # 获取所有匹配的世界书内容
-        contents = []
-        
-        # 首先添加所有constant为true且enabled为true的条目
-        constant_entries = [entry for entry in self.entries if entry.constant and entry.enabled]
-        contents.extend(entry.content for entry in constant_entries)
+        :param title: 提示词的标题，角色卡自带的世界书使用单独的标题以免与公共世界书重复
+        """
+        # 常开条目不依赖聊天记录，即使没有历史消息也要注入
+        _, constant_text, _ = self._get_constant_block()
+        contents = [constant_text] if constant_text else []
 
-        # 然后检查关键词触发的条目
-        keyword_entries = [entry for entry in self.entries if not entry.constant and entry.enabled]
-        for entry in keyword_entries:
-            if entry.matches_keywords(all_text):
-                contents.append(entry.content)
+        # 然后是关键词和向量激活的条目
+        contents.extend(entry.content for entry in self.match_entries(messages))
 
         if not contents:
             return []
 
-        # 将所有内容组合成一个提示词
+        # 将所有内容组合成一个提示词，常开块固定在最前面，便于提示词前缀缓存
         world_book_text = "\n".join([
-            "# 世界设定",
+            title,
             *contents
         ])
 
@@ -275,51 +547,211 @@ class WorldBookProcessor:
         )]
 
     def add_entry(self, entry_data: Dict[str, Any]) -> WorldBookEntry:
-        """添加新条目"""
+        """添加新条目，写入失败时撤销添加并抛出OSError"""
         # 分配新的UID
         next_uid = max((entry.uid for entry in self.entries), default=-1) + 1
         entry_data['uid'] = next_uid
         
         # 创建新条目
         entry = WorldBookEntry(entry_data)
+        known_files = set(self._file_entries)
         self.entries.append(entry)
+        self._mark_dirty(entry)
         
         # 重新排序并保存
         self.entries.sort(key=lambda x: x.uid)
-        self._save_world_books()
+        self._rebuild_partitions()
+        if not self._save_world_books():
+            self.entries.remove(entry)
+            self._file_entries[entry.source_file].remove(entry)
+            if entry.source_file not in known_files:
+                # 为这个条目新建的世界书文件也一并撤销
+                del self._book_meta[entry.source_file]
+                del self._file_entries[entry.source_file]
+                self._dirty_files.discard(entry.source_file)
+            self._rebuild_partitions()
+            raise OSError(f"写入世界书文件 {entry.source_file} 失败")
         
         return entry
 
     def update_entry(self, entry_id: int, entry_data: Dict[str, Any]) -> bool:
-        """更新条目"""
+        """更新条目，写入失败时恢复原条目并返回False"""
         if 0 <= entry_id < len(self.entries):
-            # 保持原有的UID
-            entry_data['uid'] = self.entries[entry_id].uid
-            self.entries[entry_id] = WorldBookEntry(entry_data)
-            self._save_world_books()
-            return True
+            # 保持原有的UID和来源文件
+            old_entry = self.entries[entry_id]
+            entry_data['uid'] = old_entry.uid
+            entry = WorldBookEntry(entry_data)
+            entry.source_file = old_entry.source_file
+            entry.source_key = old_entry.source_key
+            self.entries[entry_id] = entry
+            if entry.source_file is not None:
+                file_entries = self._file_entries[entry.source_file]
+                file_entries[file_entries.index(old_entry)] = entry
+            self._mark_dirty(entry)
+            self._rebuild_partitions()
+            if self._save_world_books():
+                return True
+            self.entries[entry_id] = old_entry
+            file_entries = self._file_entries[entry.source_file]
+            if old_entry.source_file is not None:
+                file_entries[file_entries.index(entry)] = old_entry
+            else:
+                file_entries.remove(entry)
+            self._rebuild_partitions()
+            return False
         return False
 
     def delete_entry(self, entry_id: int) -> bool:
-        """删除条目"""
+        """删除条目，写入失败时恢复条目并返回False"""
         if 0 <= entry_id < len(self.entries):
-            self.entries.pop(entry_id)
-            self._save_world_books()
+            entry = self.entries.pop(entry_id)
+            position = None
+            if entry.source_file is not None:
+                file_entries = self._file_entries[entry.source_file]
+                position = file_entries.index(entry)
+                del file_entries[position]
+                self._dirty_files.add(entry.source_file)
+            self._rebuild_partitions()
+            if self._save_world_books():
+                return True
+            self.entries.insert(entry_id, entry)
+            if position is not None:
+                self._file_entries[entry.source_file].insert(position, entry)
+            self._rebuild_partitions()
+            return False
+        return False
+
+    def set_entry_enabled(self, entry: WorldBookEntry, enabled: bool) -> bool:
+        """修改条目的启用状态，只回写该条目所在的文件；写入失败时恢复原状态并返回False"""
+        if entry.enabled == enabled:
+            return True
+        entry.enabled = enabled
+        self._bump_version()
+        self._mark_dirty(entry)
+        if self._save_world_books():
             return True
+        entry.enabled = not enabled
+        self._bump_version()
         return False
 
+    def get_book_files(self) -> List[str]:
+        """获取已加载的世界书文件名"""
+        return list(self._file_entries)
+
+    def _unique_book_filename(self, name: str) -> str:
+        """为导入的世界书生成不与现有文件重名的文件名"""
+        base = os.path.splitext(os.path.basename(name))[0] or "导入的世界书"
+        filename = f"{base}.json"
+        suffix = 1
+        while filename in self._file_entries or os.path.exists(os.path.join(self.world_book_dir, filename)):
+            filename = f"{base}_{suffix}.json"
+            suffix += 1
+        return filename
+
+    def import_world_book(self, source_path: str, book_name: Optional[str] = None) -> Tuple[str, int, List[str]]:
+        """把一本SillyTavern世界书导入为新的世界书文件
+
+        条目流式读取并逐个校验，UID一次性连续分配，最后只写一次文件、只重建一次索引。
+        文件格式错误时抛出LorebookFormatError，此时不会导入任何条目。
+
+        Returns:
+            Tuple[str, int, List[str]]: 新世界书文件名、导入的条目数、被跳过的条目及原因
+        """
+        filename = self._unique_book_filename(book_name or source_path)
+        next_uid = max((entry.uid for entry in self.entries), default=-1) + 1
+        reader = LorebookReader(source_path)
+        imported: List[WorldBookEntry] = []
+        skipped: List[str] = []
+
+        for entry_key, entry_data in reader:
+            problem = validate_entry(entry_data)
+            if problem:
+                skipped.append(f"{entry_key}: {problem}")
+                continue
+            entry_data = dict(entry_data)
+            # 原有的displayIndex跟随原UID，重新编号后随新UID
+            if entry_data.get('displayIndex') == entry_data.get('uid'):
+                entry_data.pop('displayIndex', None)
+            entry_data['uid'] = next_uid
+            try:
+                entry = WorldBookEntry(entry_data)
+            except Exception as e:
+                skipped.append(f"{entry_key}: {e}")
+                continue
+            entry.source_file = filename
+            entry.source_key = str(next_uid)
+            imported.append(entry)
+            next_uid += 1
+
+        if not imported:
+            return filename, 0, skipped
+
+        self._book_meta[filename] = reader.meta
+        self._file_entries[filename] = imported
+        # 新UID都大于现有条目，追加后仍按UID有序
+        self.entries.extend(imported)
+        self._dirty_files.add(filename)
+        self._rebuild_partitions()
+        if not self._save_world_books():
+            # 没有写入磁盘的导入不保留，避免提示成功而重启后条目消失
+            self.entries = [entry for entry in self.entries if entry.source_file != filename]
+            del self._book_meta[filename]
+            del self._file_entries[filename]
+            self._dirty_files.discard(filename)
+            self._rebuild_partitions()
+            raise OSError(f"写入世界书文件 {filename} 失败")
+        self.debug_print(f"已导入世界书 {filename}: {len(imported)} 条, 跳过 {len(skipped)} 条")
+        return filename, len(imported), skipped
+
+    def export_world_book(self, target_path: str, filename: Optional[str] = None) -> int:
+        """导出为SillyTavern世界书，filename为None时把所有世界书合并导出
+
+        Returns:
+            int: 导出的条目数
+        """
+        if filename is None:
+            # 不同文件的条目键可能重复，合并导出时以UID为键
+            meta = {}
+            items = ((str(entry.uid), entry.to_dict()) for entry in self.entries)
+        else:
+            if filename not in self._file_entries:
+                raise ValueError(f"世界书 {filename} 不存在")
+            meta = self._book_meta.get(filename, {})
+            items = ((entry.source_key, entry.to_dict()) for entry in self._file_entries[filename])
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        return write_lorebook(target_path, meta, items)
+
     def enable_entry(self, entry_id: int) -> bool:
         """启用条目"""
         if 0 <= entry_id < len(self.entries):
-            self.entries[entry_id].enabled = True
-            self._save_world_books()
-            return True
+            return self.set_entry_enabled(self.entries[entry_id], True)
         return False
 
     def disable_entry(self, entry_id: int) -> bool:
         """禁用条目"""
         if 0 <= entry_id < len(self.entries):
-            self.entries[entry_id].enabled = False
-            self._save_world_books()
-            return True
-        return False 
\ No newline at end of file
+            return self.set_entry_enabled(self.entries[entry_id], False)
+        return False
+
+class CharacterWorldBooks(CharacterFileCache):
+    """角色卡自带的世界书(juese/shijieshu/角色名/角色名.json)，按角色缓存处理器
+
+    转换角色卡时已经解析并编译好关键词索引写入缓存，第一次用到某个角色时直接从缓存加载。
+    """
+
+    def __init__(self, books_dir: str):
+        super().__init__()
+        self.books_dir = books_dir
+
+    def book_dir(self, character: str) -> str:
+        return os.path.join(self.books_dir, character)
+
+    def file_path(self, character: str) -> str:
+        return os.path.join(self.book_dir(character), f"{character}.json")
+
+    def _load(self, character: str, path: str) -> Optional[WorldBookProcessor]:
+        try:
+            return WorldBookProcessor(self.books_dir, world_book_dir=self.book_dir(character))
+        except Exception as e:
+            print(f"加载角色世界书失败 {character}: {e}")
+            return None